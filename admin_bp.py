@@ -1,9 +1,63 @@
 # admin_bp.py
 
-from flask import Blueprint, render_template
+import os
+from datetime import datetime
+
+from flask import Blueprint, render_template, jsonify, session, abort
+from db import user_db_pool, write_coordinator, get_auth_db
+from tenant_stats import platform_stats
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
+# e-mails com acesso à área administrativa (separados por vírgula); vazio = ninguém
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+@admin_bp.before_request
+def require_admin():
+    """A área administrativa enxerga todos os bancos: só para ADMIN_EMAILS."""
+    if not session.get("user_id"):
+        abort(401)
+    if (session.get("user_email") or "").lower() not in ADMIN_EMAILS:
+        abort(403)
+
+def _tenant_overview():
+    """platform_stats() com nome/e-mail de cada conta, vindos do banco central."""
+    stats = platform_stats()
+    ids = [t["user_id"] for t in stats["tenant_list"]]
+    accounts = {}
+    if ids:
+        placeholders = ",".join("?" * len(ids))
+        accounts = {
+            row["id"]: row for row in get_auth_db().execute(
+                f"SELECT id, name, email FROM users WHERE id IN ({placeholders})", ids)
+        }
+    for tenant in stats["tenant_list"]:
+        account = accounts.get(tenant["user_id"])
+        tenant["name"] = account["name"] if account else None
+        tenant["email"] = account["email"] if account else None
+    return stats
+
 @admin_bp.route("/users")
 def admin_users():
-    return render_template("admin_users.html")
+    """Visão da plataforma: contas, tamanho dos bancos, agendamentos, receita e atividade."""
+    stats = _tenant_overview()
+    for tenant in stats["tenant_list"]:
+        tenant["last_activity_at"] = (datetime.fromtimestamp(tenant["last_activity"]).strftime("%d/%m/%Y %H:%M")
+                                      if tenant["last_activity"] else "-")
+    busy_days = [(day, count) for day, count in zip(stats["per_day"]["dates"], stats["per_day"]["counts"]) if count]
+    return render_template("admin_users.html", stats=stats, busy_days=busy_days)
+
+@admin_bp.route("/tenants.json")
+def tenants_json():
+    """Mesmo agregado de /admin/users em JSON (para monitoramento)."""
+    return jsonify(_tenant_overview())
+
+@admin_bp.route("/db_pool")
+def db_pool_stats():
+    """Contadores do pool de conexões deste worker (hits, misses, evicções)."""
+    return jsonify(user_db_pool.stats())
+
+@admin_bp.route("/db_writes")
+def db_write_stats():
+    """Fila de escrita por banco neste worker (profundidade, espera, retentativas)."""
+    return jsonify(write_coordinator.stats())
@@ -0,0 +1,126 @@
+# analytics.py
+# Séries e quebras de receita calculadas em NumPy/pandas sobre o snapshot
+# colunar (snapshot.py), sem reler as tabelas a cada requisição.
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+import snapshot
+
+EPOCH_DAY = date(1970, 1, 1)
+MOVING_AVERAGES = (7, 28)     # janelas (dias) das médias móveis
+MAX_RANGE_DAYS = 3 * 366
+
+
+def _day_number(day):
+    return (day - EPOCH_DAY).days
+
+
+def _daily_totals(days, weights, first, length):
+    """Soma de `weights` por dia em [first, first + length), via bincount."""
+    offset = days - first
+    keep = (offset >= 0) & (offset < length)
+    if weights is None:
+        return np.bincount(offset[keep], minlength=length).astype(np.int64)
+    return np.bincount(offset[keep], weights=weights[keep], minlength=length)
+
+
+def _breakdown(keys, amounts, names):
+    """Receita e quantidade por chave, da maior receita para a menor."""
+    if not len(keys):
+        return []
+    unique, inverse = np.unique(keys, return_inverse=True)
+    revenue = np.bincount(inverse, weights=amounts)
+    count = np.bincount(inverse)
+    total = revenue.sum()
+    order = np.argsort(-revenue, kind="stable")
+    return [
+        {
+            "id": int(unique[i]) or None,
+            "name": names.get(int(unique[i])),
+            "revenue": round(float(revenue[i]), 2),
+            "count": int(count[i]),
+            "share": round(float(revenue[i] / total), 4) if total else 0.0,
+        }
+        for i in order
+    ]
+
+
+def _round(values):
+    return [None if pd.isna(v) else round(float(v), 2) for v in values]
+
+
+def revenue_analytics(conn, db_path, start, end):
+    """Receita de [start, end] (datas, inclusive) em séries e quebras.
+
+    Retorna séries diária (com médias móveis e agendamentos), semanal
+    (semanas de segunda a domingo) e mensal (com comparação ano a ano), e a
+    receita por profissional e por serviço no período.
+    """
+    data = snapshot.load(conn, db_path)
+    finance = data["finance"]
+    schedules = data["schedules"]
+
+    # o histórico começa 12 meses antes do mês inicial: médias móveis e
+    # ano anterior do primeiro mês já têm dados
+    history_start = (pd.Timestamp(start).to_period("M") - 12).start_time.date()
+    first = _day_number(history_start)
+    length = _day_number(end) - first + 1
+
+    income = finance["is_income"].astype(bool)
+    days = finance["day"][income].astype(np.int64)
+    amounts = finance["amount"][income]
+
+    index = pd.date_range(history_start, end, freq="D")
+    daily = pd.DataFrame({
+        "revenue": _daily_totals(days, amounts, first, length),
+        "count": _daily_totals(days, None, first, length),
+        "bookings": _daily_totals(schedules["day"].astype(np.int64), None, first, length),
+    }, index=index)
+    for window in MOVING_AVERAGES:
+        daily[f"ma{window}"] = daily["revenue"].rolling(window, min_periods=1).mean()
+
+    monthly = daily[["revenue", "count", "bookings"]].groupby(daily.index.to_period("M")).sum()
+    monthly["previous_year"] = monthly["revenue"].shift(12)
+    monthly["yoy_change"] = (monthly["revenue"] - monthly["previous_year"]) / monthly["previous_year"].replace(0, np.nan)
+
+    window = daily.loc[pd.Timestamp(start):]
+    weekly = window[["revenue", "count", "bookings"]].groupby(window.index.to_period("W")).sum()
+    monthly = monthly.loc[pd.Timestamp(start).to_period("M"):]
+
+    # quebras do período pedido
+    in_range = (days >= _day_number(start)) & (days <= _day_number(end))
+    professional_names = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM professionals")}
+    service_names = {r["id"]: r["name"] for r in conn.execute("SELECT id, name FROM services")}
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total_revenue": round(float(window["revenue"].sum()), 2),
+        "total_count": int(window["count"].sum()),
+        "daily": {
+            "dates": [d.date().isoformat() for d in window.index],
+            "revenue": _round(window["revenue"]),
+            "count": [int(v) for v in window["count"]],
+            "bookings": [int(v) for v in window["bookings"]],
+            **{f"ma{w}": _round(window[f"ma{w}"]) for w in MOVING_AVERAGES},
+        },
+        "weekly": {
+            "weeks": [p.start_time.date().isoformat() for p in weekly.index],
+            "revenue": _round(weekly["revenue"]),
+            "count": [int(v) for v in weekly["count"]],
+            "bookings": [int(v) for v in weekly["bookings"]],
+        },
+        "monthly": {
+            "months": [str(p) for p in monthly.index],
+            "revenue": _round(monthly["revenue"]),
+            "count": [int(v) for v in monthly["count"]],
+            "bookings": [int(v) for v in monthly["bookings"]],
+            "previous_year": _round(monthly["previous_year"]),
+            "yoy_change": [None if pd.isna(v) else round(float(v), 4) for v in monthly["yoy_change"]],
+        },
+        "by_professional": _breakdown(finance["professional_id"][income][in_range], amounts[in_range],
+                                      professional_names),
+        "by_service": _breakdown(finance["service_id"][income][in_range], amounts[in_range], service_names),
+    }
@@ -4,7 +4,9 @@ from flask import Flask, Blueprint, request, redirect, url_for, session, render_
 from werkzeug.security import generate_password_hash, check_password_hash
 from authlib.integrations.flask_client import OAuth
 from dotenv import load_dotenv
-from db import AUTH_DB, init_auth_db, get_user_db, close_dbs
+from db import AUTH_DB, init_auth_db, get_user_db, release_user_db, close_dbs
+from date_windows import day_window
+import stock
 
 load_dotenv()
 # --------------------- Configurações Iniciais ---------------------
@@ -98,24 +100,27 @@ def dashboard():
         flash('Você precisa estar logado.', 'error')
         return redirect(url_for('auth.login'))
 
-    conn = get_user_db()
+    conn = get_user_db(readonly=True)
 
     cur = conn.cursor()
     cur.execute('SELECT COUNT(*) AS c FROM clients')
     clients_count = cur.fetchone()['c']
     cur.execute('SELECT COUNT(*) AS c FROM services')
     services_count = cur.fetchone()['c']
-    cur.execute("SELECT COUNT(*) AS c FROM schedules WHERE date(date_time) = date('now')")
+    today_start, today_end = day_window()
+    cur.execute("SELECT COUNT(*) AS c FROM schedules WHERE day >= ? AND day < ?", (today_start, today_end))
     today_schedule = cur.fetchone()['c']
     cur.execute('SELECT * FROM services')
     services = cur.fetchall()
-    conn.close()
+    low_stock_alerts = stock.alert_count(conn)
+    release_user_db()
 
     return render_template('dashboard.html',
                            clients_count=clients_count,
                            services_count=services_count,
                            today_schedule=today_schedule,
-                           services=services)
+                           services=services,
+                           low_stock_alerts=low_stock_alerts)
 
 @auth_bp.route('/logout')
 def logout():
@@ -222,6 +227,8 @@ from finance_bp import finance_bp
 from inventory_bp import inventory_bp  # Corrija o caminho conforme sua estrutura
 from reports_bp import reports_bp
 from admin_bp import admin_bp
+from sync_bp import sync_bp
+from export import export_bp
 
 
 app.register_blueprint(admin_bp)
@@ -232,6 +239,8 @@ app.register_blueprint(professionals_bp)
 app.register_blueprint(services_bp)
 app.register_blueprint(schedule_bp)
 app.register_blueprint(finance_bp)
+app.register_blueprint(sync_bp)
+app.register_blueprint(export_bp)
 
 # --------------------- Rota Inicial ---------------------
 #@app.route("/")
@@ -0,0 +1,251 @@
+# availability.py
+# Horários livres por profissional e serviço.
+#
+# A ocupação de cada (profissional, dia) é um bitmap de slots de SLOT_MINUTES:
+# o bit i indica que [i * SLOT, (i + 1) * SLOT) está ocupado. Os bitmaps ficam
+# em cache por processo e são invalidados um a um quando um agendamento é
+# criado, editado ou excluído neste worker. Alterações feitas por outros
+# workers são detectadas pelo marcador `change_markers` (mantido por triggers):
+# se ele andar mais do que as escritas locais explicam, o cache do banco é
+# descartado inteiro. O horário sugerido é conferido de novo por
+# booking.find_conflicts na hora de agendar.
+import threading
+from datetime import date, datetime, timedelta
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+MAX_RANGE_DAYS = 31
+EPOCH_DAY = date(1970, 1, 1)   # start_epoch é strftime('%s'), contado a partir daqui
+
+# sem linhas em professional_hours: segunda a sábado, 09:00-18:00
+DEFAULT_WORKING_HOURS = {weekday: [(9 * 60, 18 * 60)] for weekday in range(6)}
+
+WATCHED_MARKERS = ("schedules", "services", "professional_hours")
+
+_lock = threading.Lock()
+_occupancy = {}   # (tenant, professional_id, 'YYYY-MM-DD') -> bitmap
+_markers = {}     # tenant -> soma dos marcadores vista pelo cache
+
+
+def _marker(conn):
+    placeholders = ",".join("?" * len(WATCHED_MARKERS))
+    return conn.execute(
+        f"SELECT COALESCE(SUM(version), 0) FROM change_markers WHERE name IN ({placeholders})",
+        WATCHED_MARKERS,
+    ).fetchone()[0]
+
+
+def _drop_tenant(tenant):
+    for key in [k for k in _occupancy if k[0] == tenant]:
+        del _occupancy[key]
+
+
+def sync(conn, tenant):
+    """Descarta o cache do banco se outro worker o alterou desde a última leitura."""
+    current = _marker(conn)
+    with _lock:
+        if _markers.get(tenant) != current:
+            _drop_tenant(tenant)
+            _markers[tenant] = current
+
+
+def _touched_days(date_time, duration):
+    """Dias ('YYYY-MM-DD') que o atendimento [início, início + duração) toca."""
+    try:
+        start = datetime.fromisoformat(str(date_time))
+    except ValueError:
+        return [str(date_time)[:10]]
+    end = start + timedelta(minutes=max(int(duration or 0), 1))
+    days = []
+    day = start.date()
+    while datetime.combine(day, datetime.min.time()) < end:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def invalidate(conn, tenant, changes, expected_changes=None):
+    """Invalida os dias afetados por uma escrita local, já confirmada (commit).
+
+    `changes` é um iterável de (professional_id, date_time, duração em
+    minutos); todos os dias que o atendimento toca caem, inclusive o seguinte
+    quando ele passa da meia-noite. `expected_changes` é quantas linhas
+    vigiadas a escrita alterou (padrão: len(changes)); se o marcador andou
+    mais que isso, outra escrita aconteceu e o cache todo cai.
+    """
+    changes = list(changes)
+    expected = len(changes) if expected_changes is None else expected_changes
+    current = _marker(conn)
+    with _lock:
+        for professional_id, date_time, duration in changes:
+            if professional_id is None or not date_time:
+                continue
+            for day in _touched_days(date_time, duration):
+                _occupancy.pop((tenant, int(professional_id), day), None)
+        seen = _markers.get(tenant)
+        if seen is None or current != seen + expected:
+            _drop_tenant(tenant)
+        _markers[tenant] = current
+
+
+def invalidate_tenant(conn, tenant):
+    """Descarta todo o cache de um banco (ex.: horário de trabalho ou duração mudou)."""
+    current = _marker(conn)
+    with _lock:
+        _drop_tenant(tenant)
+        _markers[tenant] = current
+
+
+def _slot_range(start_minute, end_minute):
+    """Bitmap com os slots que intersectam [start_minute, end_minute)."""
+    first = max(start_minute // SLOT_MINUTES, 0)
+    last = min(-(-end_minute // SLOT_MINUTES), SLOTS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def _build(conn, tenant, professional_ids, days):
+    """Calcula de uma vez os bitmaps que faltam no cache; retorna os calculados."""
+    with _lock:
+        missing = {(pid, d) for pid in professional_ids for d in days
+                   if (tenant, pid, d) not in _occupancy}
+    if not missing:
+        return {}
+    built = {key: 0 for key in missing}
+    first = min(d for _, d in missing)
+    last = max(d for _, d in missing)
+    # o dia anterior entra por causa de atendimentos que passam da meia-noite
+    lower = (date.fromisoformat(first) - timedelta(days=1)).isoformat()
+    upper = (date.fromisoformat(last) + timedelta(days=1)).isoformat()
+    placeholders = ",".join("?" * len(professional_ids))
+    rows = conn.execute(
+        f"""
+        SELECT s.professional_id, s.start_epoch, COALESCE(sv.duration, 0) AS duration
+        FROM schedules s
+        LEFT JOIN services sv ON sv.id = s.service_id
+        WHERE s.day >= ? AND s.day < ? AND s.professional_id IN ({placeholders})
+        """,
+        (lower, upper, *professional_ids),
+    ).fetchall()
+    for row in rows:
+        if row["start_epoch"] is None:
+            continue
+        start = row["start_epoch"]
+        end = start + max(int(row["duration"] or 0), 1) * 60
+        day = EPOCH_DAY + timedelta(days=start // 86400)
+        # espalha o intervalo pelos dias que ele toca
+        while True:
+            day_epoch = (day - EPOCH_DAY).days * 86400
+            if day_epoch >= end:
+                break
+            key = (row["professional_id"], day.isoformat())
+            if key in built:
+                built[key] |= _slot_range((start - day_epoch) // 60, (end - day_epoch) // 60)
+            day += timedelta(days=1)
+    with _lock:
+        for (pid, d), bitmap in built.items():
+            _occupancy[(tenant, pid, d)] = bitmap
+    return built
+
+
+def _occupied(conn, tenant, professional_ids, days):
+    """{(professional_id, dia): bitmap}, copiado do cache sob o lock.
+
+    Uma invalidação de outra thread entre o cálculo e a cópia tira a entrada
+    do cache; aí ela é calculada de novo (uma vez) e, se sumir outra vez,
+    vale o bitmap recém-calculado.
+    """
+    built = {}
+    for _ in range(2):
+        built.update(_build(conn, tenant, professional_ids, days))
+        with _lock:
+            cached = {(pid, d): _occupancy.get((tenant, pid, d)) for pid in professional_ids for d in days}
+        if None not in cached.values():
+            return cached
+    return {key: bitmap if bitmap is not None else built.get(key, 0) for key, bitmap in cached.items()}
+
+
+def _working_masks(conn, professional_ids):
+    """{professional_id: {weekday: bitmap dos slots de trabalho}}."""
+    placeholders = ",".join("?" * len(professional_ids))
+    rows = conn.execute(
+        f"""
+        SELECT professional_id, weekday, start_minute, end_minute
+        FROM professional_hours
+        WHERE professional_id IN ({placeholders})
+        """,
+        professional_ids,
+    ).fetchall()
+    configured = {}
+    for row in rows:
+        masks = configured.setdefault(row["professional_id"], {})
+        masks[row["weekday"]] = masks.get(row["weekday"], 0) | _slot_range(row["start_minute"], row["end_minute"])
+
+    default = {weekday: 0 for weekday in range(7)}
+    for weekday, ranges in DEFAULT_WORKING_HOURS.items():
+        for start_minute, end_minute in ranges:
+            default[weekday] |= _slot_range(start_minute, end_minute)
+    return {pid: configured.get(pid, default) for pid in professional_ids}
+
+
+def _fitting_starts(free, needed):
+    """Bitmap dos slots onde começam `needed` slots livres consecutivos."""
+    fits = free
+    for shift in range(1, needed):
+        fits &= free >> shift
+    return fits
+
+
+def free_slots(conn, tenant, service_id, start_day, end_day, professional_id=None, now=None):
+    """Horários de início livres para o serviço em [start_day, end_day].
+
+    Retorna None se o serviço não existir; senão um dict com a duração e, por
+    profissional e dia, a lista de horários 'HH:MM' disponíveis.
+    """
+    service = conn.execute("SELECT id, name, duration FROM services WHERE id=?", (service_id,)).fetchone()
+    if not service:
+        return None
+    needed = max(-(-int(service["duration"] or 0) // SLOT_MINUTES), 1)
+
+    if professional_id is not None:
+        professionals = conn.execute("SELECT id, name FROM professionals WHERE id=?",
+                                     (professional_id,)).fetchall()
+    else:
+        professionals = conn.execute("SELECT id, name FROM professionals ORDER BY name").fetchall()
+    end_day = min(end_day, start_day + timedelta(days=MAX_RANGE_DAYS - 1))
+    days = [(start_day + timedelta(days=i)).isoformat() for i in range((end_day - start_day).days + 1)]
+    result = {"service_id": service["id"], "service_name": service["name"],
+              "duration": service["duration"], "slot_minutes": SLOT_MINUTES, "slots": []}
+    if not professionals or not days:
+        return result
+
+    ids = [p["id"] for p in professionals]
+    sync(conn, tenant)
+    occupied = _occupied(conn, tenant, ids, days)
+    masks = _working_masks(conn, ids)
+
+    now = now or datetime.now()
+    today = now.date().isoformat()
+    past_today = _slot_range(0, now.hour * 60 + now.minute)
+
+    for prof in professionals:
+        for d in days:
+            if d < today:
+                continue
+            free = masks[prof["id"]].get(date.fromisoformat(d).weekday(), 0)
+            free &= ~occupied[(prof["id"], d)]
+            if d == today:
+                free &= ~past_today
+            fits = _fitting_starts(free, needed)
+            times = []
+            while fits:
+                low = fits & -fits
+                slot = low.bit_length() - 1
+                minute = slot * SLOT_MINUTES
+                times.append(f"{minute // 60:02d}:{minute % 60:02d}")
+                fits ^= low
+            if times:
+                result["slots"].append({"professional_id": prof["id"], "professional_name": prof["name"],
+                                        "date": d, "times": times})
+    return result
@@ -0,0 +1,471 @@
+# backup.py
+# Backup a quente e restauração dos bancos individuais.
+#
+#   python backup.py run [user_id ...] [--jobs N]     faz um snapshot de cada banco
+#   python backup.py list [user_id ...]               lista os snapshots
+#   python backup.py restore USER_ID SNAPSHOT|latest [--to ARQUIVO]
+#   python backup.py prune [user_id ...]              aplica a retenção e limpa os blocos órfãos
+#
+# Sem user_id, percorre todos os bancos em user_dbs/. Cada snapshot sai da
+# API de backup online do SQLite (com uma transação de leitura aberta na
+# origem, então é um retrato consistente mesmo com o app gravando), copiada
+# BACKUP_PAGES_PER_STEP páginas por vez com uma pausa entre os passos para
+# não segurar as requisições. A cópia é cortada em blocos de BACKUP_CHUNK_PAGES
+# páginas, guardados comprimidos (zlib) pelo hash do conteúdo em
+# BACKUP_DIR/chunks/: um bloco igual ao de qualquer snapshot anterior (de
+# qualquer banco) não é gravado de novo, então cada snapshot custa só as
+# páginas que mudaram. O manifesto JSON de cada snapshot lista os blocos.
+#
+# `restore` remonta o arquivo, confere hash e `PRAGMA quick_check` e copia
+# por cima do banco vivo pela própria API de backup (as conexões abertas do
+# app passam a ver o conteúdo restaurado). Depois disso o change_log continua
+# de onde estava, com todas as linhas re-registradas e as que sumiram como
+# exclusões, para que sync e exportações incrementais peguem a restauração.
+# Os contadores de change_markers sobem acima do valor de antes (as ETags
+# montadas a partir deles nunca repetem uma já entregue) e as marcas dos
+# consumidores (export_watermarks e o último lote, export_batches) continuam
+# as do banco vivo.
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from db import (USER_DB_DIR, SYNC_TABLES, user_db_path, readonly_uri, _open_user_db)
+from snapshot import snapshot_dir as columnar_snapshot_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos
+    fcntl = None
+
+BACKUP_DIR = os.getenv("BACKUP_DIR") or os.path.join(USER_DB_DIR, "backups")
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))    # segundos entre passos
+BACKUP_CHUNK_PAGES = 16          # páginas por bloco deduplicado
+BACKUP_COMPRESS_LEVEL = 6
+BACKUP_JOBS = int(os.getenv("BACKUP_JOBS", "0")) or min(os.cpu_count() or 1, 4)
+
+# retenção: os N mais recentes + o último de cada dia / semana ISO
+BACKUP_KEEP_LAST = int(os.getenv("BACKUP_KEEP_LAST", "7"))
+BACKUP_KEEP_DAILY = int(os.getenv("BACKUP_KEEP_DAILY", "14"))
+BACKUP_KEEP_WEEKLY = int(os.getenv("BACKUP_KEEP_WEEKLY", "8"))
+
+CHUNK_DIR = os.path.join(BACKUP_DIR, "chunks")
+STAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+class _StoreLock:
+    """Lock do repositório: compartilhado para gravar snapshots, exclusivo para a limpeza."""
+
+    def __init__(self, exclusive=False):
+        self.exclusive = exclusive
+        self.handle = None
+
+    def __enter__(self):
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        if fcntl is not None:
+            self.handle = open(os.path.join(BACKUP_DIR, ".lock"), "a")
+            fcntl.flock(self.handle, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+
+
+def tenant_paths(user_ids):
+    if user_ids:
+        return [user_db_path(uid) for uid in user_ids]
+    return sorted(glob.glob(os.path.join(USER_DB_DIR, "agenda_*.db")))
+
+
+def _tenant_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def manifest_dir(path):
+    return os.path.join(BACKUP_DIR, _tenant_name(path))
+
+
+def _chunk_path(digest):
+    return os.path.join(CHUNK_DIR, digest[:2], digest + ".z")
+
+
+def _write_atomic(target, data, mode="wb"):
+    tmp = f"{target}.{os.getpid()}.tmp"
+    with open(tmp, mode) as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, target)
+
+
+def list_snapshots(path):
+    """Manifestos do banco, do mais antigo para o mais novo."""
+    manifests = []
+    for name in sorted(glob.glob(os.path.join(manifest_dir(path), "*.json"))):
+        try:
+            with open(name, encoding="utf-8") as fh:
+                manifests.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+    return sorted(manifests, key=lambda m: m["snapshot"])
+
+
+# ------------------ Snapshot ------------------
+
+def _online_copy(path, staging):
+    """Cópia consistente do banco vivo para `staging` pela API de backup, em passos."""
+    src = sqlite3.connect(readonly_uri(path), uri=True, timeout=30)
+    dst = sqlite3.connect(staging)
+    try:
+        # a transação de leitura fixa o retrato: commits do app durante a
+        # cópia não reiniciam o backup nem entram pela metade
+        src.execute("BEGIN")
+        schema = src.execute("PRAGMA user_version").fetchone()[0]
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP)
+        src.rollback()
+        dst.execute("PRAGMA journal_mode=DELETE")
+        check = dst.execute("PRAGMA quick_check").fetchone()[0]
+        page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return schema, check, page_size
+
+
+def _store_chunks(staging, page_size):
+    """Grava os blocos ainda inexistentes; devolve (hashes, sha256 do arquivo, bytes novos)."""
+    digests = []
+    whole = hashlib.sha256()
+    written = 0
+    with open(staging, "rb") as fh:
+        while True:
+            block = fh.read(page_size * BACKUP_CHUNK_PAGES)
+            if not block:
+                break
+            whole.update(block)
+            digest = hashlib.blake2b(block, digest_size=20).hexdigest()
+            target = _chunk_path(digest)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                data = zlib.compress(block, BACKUP_COMPRESS_LEVEL)
+                _write_atomic(target, data)
+                written += len(data)
+            digests.append(digest)
+    return digests, whole.hexdigest(), written
+
+
+def backup_tenant(path):
+    """Snapshot de um banco (roda nos processos do pool). Devolve um resumo."""
+    name = _tenant_name(path)
+    if not os.path.exists(path):
+        return {"tenant": name, "error": "não encontrado"}
+    started = time.monotonic()
+    directory = manifest_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    staging = os.path.join(directory, f".staging.{os.getpid()}.db")
+    try:
+        with _StoreLock():
+            schema, check, page_size = _online_copy(path, staging)
+            if check != "ok":
+                return {"tenant": name, "error": f"quick_check: {check}"}
+            digests, sha256, written = _store_chunks(staging, page_size)
+            size = os.path.getsize(staging)
+
+            previous = list_snapshots(path)
+            if previous and previous[-1]["sha256"] == sha256:
+                return {"tenant": name, "snapshot": previous[-1]["snapshot"], "unchanged": True,
+                        "size": size, "written": 0, "seconds": round(time.monotonic() - started, 2)}
+
+            now = datetime.now(timezone.utc)
+            snapshot = now.strftime(STAMP_FORMAT)
+            suffix = 1
+            while os.path.exists(os.path.join(directory, f"{snapshot}.json")):
+                snapshot = f"{now.strftime(STAMP_FORMAT)}-{suffix}"
+                suffix += 1
+            manifest = {
+                "snapshot": snapshot,
+                "tenant": name,
+                "created_at": now.isoformat(timespec="seconds"),
+                "schema_version": schema,
+                "page_size": page_size,
+                "chunk_pages": BACKUP_CHUNK_PAGES,
+                "size": size,
+                "sha256": sha256,
+                "chunks": digests,
+            }
+            _write_atomic(os.path.join(directory, f"{snapshot}.json"),
+                          json.dumps(manifest), mode="w")
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    return {"tenant": name, "snapshot": snapshot, "unchanged": False, "size": size,
+            "written": written, "seconds": round(time.monotonic() - started, 2)}
+
+
+# ------------------ Retenção ------------------
+
+def _retained(manifests, keep_last, keep_daily, keep_weekly):
+    """Snapshots mantidos: os últimos `keep_last` e o mais novo de cada dia/semana recente."""
+    keep = set()
+    ordered = sorted(manifests, key=lambda m: m["snapshot"], reverse=True)
+    keep.update(m["snapshot"] for m in ordered[:keep_last])
+    for limit, bucket in ((keep_daily, lambda d: d.date()),
+                          (keep_weekly, lambda d: d.isocalendar()[:2])):
+        seen = []
+        for m in ordered:
+            key = bucket(datetime.fromisoformat(m["created_at"]))
+            if key in seen:
+                continue
+            if len(seen) >= limit:
+                break
+            seen.append(key)
+            keep.add(m["snapshot"])
+    return keep
+
+
+def prune_tenant(path):
+    """Remove os manifestos fora da política de retenção; devolve quantos saíram."""
+    manifests = list_snapshots(path)
+    keep = _retained(manifests, BACKUP_KEEP_LAST, BACKUP_KEEP_DAILY, BACKUP_KEEP_WEEKLY)
+    removed = 0
+    for m in manifests:
+        if m["snapshot"] not in keep:
+            os.remove(os.path.join(manifest_dir(path), f"{m['snapshot']}.json"))
+            removed += 1
+    return removed
+
+
+def collect_garbage():
+    """Apaga os blocos que nenhum manifesto (de nenhum banco) referencia."""
+    with _StoreLock(exclusive=True):
+        referenced = set()
+        for name in glob.glob(os.path.join(BACKUP_DIR, "*", "*.json")):
+            try:
+                with open(name, encoding="utf-8") as fh:
+                    referenced.update(json.load(fh)["chunks"])
+            except (OSError, ValueError, KeyError):
+                return 0  # manifesto ilegível: melhor não apagar nada
+        removed = 0
+        for chunk in glob.glob(os.path.join(CHUNK_DIR, "*", "*.z")):
+            if os.path.basename(chunk)[:-2] not in referenced:
+                os.remove(chunk)
+                removed += 1
+        return removed
+
+
+# ------------------ Restauração ------------------
+
+def _assemble(manifest, target):
+    """Remonta o arquivo do snapshot em `target` e confere o hash."""
+    whole = hashlib.sha256()
+    with open(target, "wb") as out:
+        for digest in manifest["chunks"]:
+            with open(_chunk_path(digest), "rb") as fh:
+                block = zlib.decompress(fh.read())
+            whole.update(block)
+            out.write(block)
+    if whole.hexdigest() != manifest["sha256"]:
+        raise ValueError(f"snapshot {manifest['snapshot']} corrompido (hash diferente)")
+
+
+def _relog_after_restore(conn, previous_version, previous_rows, previous_markers, watermarks, batches):
+    """Continua o change_log depois da versão de antes e re-registra as linhas.
+
+    Uma entrada '_restore' logo acima da versão de antes empurra o
+    AUTOINCREMENT (e marca a restauração no log); depois, tudo o que existe
+    agora vira 'upsert' com versão nova e o que existia antes da restauração
+    e não existe mais vira 'delete'; `previous_rows` ({tabela: {id:
+    created_version}}) mantém a versão de inserção de quem já existia, e as
+    linhas que só o snapshot tem ficam sem ela (saem como insert na
+    exportação incremental). Cada contador de change_markers passa do maior
+    valor entre o de antes e o restaurado, e export_watermarks/export_batches
+    voltam a ser as do banco vivo (as versões do log continuam valendo).
+    """
+    now = int(time.time())
+    conn.execute("BEGIN IMMEDIATE")
+    restored_markers = dict(conn.execute("SELECT name, version FROM change_markers").fetchall())
+    conn.executemany(
+        "INSERT INTO change_markers (name, version, changed_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET version = excluded.version, changed_at = excluded.changed_at",
+        [(name, max(previous_markers.get(name, 0), restored_markers.get(name, 0)) + 1, now)
+         for name in sorted(previous_markers.keys() | restored_markers.keys())],
+    )
+    conn.execute("DELETE FROM export_watermarks")
+    conn.executemany(
+        "INSERT INTO export_watermarks (consumer, version, previous_version, exported_at) VALUES (?, ?, ?, ?)",
+        watermarks,
+    )
+    conn.execute("DELETE FROM export_batches")
+    conn.executemany(
+        "INSERT INTO export_batches (consumer, table_name, row_id, change, version) VALUES (?, ?, ?, ?, ?)",
+        batches,
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO change_log (version, table_name, row_id, op, changed_at) "
+        "VALUES (?, '_restore', 0, 'restore', ?)",
+        (previous_version + 1, now),
+    )
+    for table in SYNC_TABLES:
+        previous = previous_rows.get(table, {})
+        current = {row[0] for row in conn.execute(f"SELECT id FROM {table}")}
+        conn.executemany(
+            "INSERT OR REPLACE INTO change_log (table_name, row_id, op, changed_at, created_version) "
+            "VALUES (?, ?, 'upsert', ?, ?)",
+            [(table, row_id, now, previous.get(row_id)) for row_id in sorted(current)],
+        )
+        gone = sorted(previous.keys() - current)
+        conn.executemany(
+            "INSERT OR REPLACE INTO change_log (table_name, row_id, op, changed_at, created_version) "
+            "VALUES (?, ?, 'delete', ?, ?)",
+            [(table, row_id, now, previous[row_id]) for row_id in gone],
+        )
+    conn.commit()
+
+
+def restore_tenant(path, snapshot, target=None):
+    """Restaura o banco para `snapshot` ('latest' = o mais novo).
+
+    Com `target`, só grava o arquivo restaurado nesse caminho.
+    """
+    manifests = list_snapshots(path)
+    if not manifests:
+        raise ValueError(f"{_tenant_name(path)}: nenhum snapshot")
+    if snapshot == "latest":
+        manifest = manifests[-1]
+    else:
+        matches = [m for m in manifests if m["snapshot"] == snapshot]
+        if not matches:
+            raise ValueError(f"{_tenant_name(path)}: snapshot {snapshot} não existe")
+        manifest = matches[0]
+
+    staging = os.path.join(manifest_dir(path), f".restore.{os.getpid()}.db")
+    try:
+        _assemble(manifest, staging)
+        check = sqlite3.connect(staging)
+        try:
+            result = check.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            check.close()
+        if result != "ok":
+            raise ValueError(f"snapshot {manifest['snapshot']}: quick_check: {result}")
+
+        if target:
+            shutil.copyfile(staging, target)
+            return manifest
+
+        # abrir pelo caminho normal migra/cria o banco vivo, se preciso
+        live = _open_user_db(path)
+        try:
+            previous_version = live.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+            previous_rows = {}
+            for table_name, row_id, op, created_version in live.execute(
+                    "SELECT table_name, row_id, op, created_version FROM change_log"):
+                if op != "delete":
+                    previous_rows.setdefault(table_name, {})[row_id] = created_version
+            previous_markers = dict(live.execute("SELECT name, version FROM change_markers").fetchall())
+            watermarks = live.execute(
+                "SELECT consumer, version, previous_version, exported_at FROM export_watermarks").fetchall()
+            batches = live.execute(
+                "SELECT consumer, table_name, row_id, change, version FROM export_batches").fetchall()
+
+            source = sqlite3.connect(staging)
+            try:
+                source.backup(live)  # um passo só: quem lê o banco vê o antes ou o depois
+            finally:
+                source.close()
+
+            # snapshot antigo (schema anterior) é migrado na hora
+            live.close()
+            live = _open_user_db(path)
+            _relog_after_restore(live, previous_version, previous_rows, previous_markers, watermarks, batches)
+        finally:
+            live.close()
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+
+    # o snapshot colunar das análises é montado de novo no próximo acesso
+    shutil.rmtree(columnar_snapshot_dir(path), ignore_errors=True)
+    return manifest
+
+
+# ------------------ Linha de comando ------------------
+
+def _split_options(args, names):
+    values, rest = {}, []
+    it = iter(args)
+    for arg in it:
+        if arg in names:
+            values[arg] = next(it, None)
+        else:
+            rest.append(arg)
+    return values, rest
+
+
+def main(argv):
+    usage = ("uso: python backup.py run [user_id ...] [--jobs N] | list [user_id ...] | "
+             "restore USER_ID SNAPSHOT|latest [--to ARQUIVO] | prune [user_id ...]")
+    if not argv or argv[0] not in ("run", "list", "restore", "prune"):
+        print(usage)
+        return 2
+    command = argv[0]
+    options, args = _split_options(argv[1:], ("--jobs", "--to"))
+
+    if command == "restore":
+        if len(args) != 2:
+            print(usage)
+            return 2
+        path = user_db_path(args[0])
+        try:
+            manifest = restore_tenant(path, args[1], options.get("--to"))
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"{_tenant_name(path)}: falha na restauração: {e}")
+            return 1
+        where = options.get("--to") or os.path.basename(path)
+        print(f"{_tenant_name(path)}: snapshot {manifest['snapshot']} restaurado em {where}")
+        return 0
+
+    paths = tenant_paths(args)
+
+    if command == "list":
+        for path in paths:
+            for m in list_snapshots(path):
+                print(f"{m['tenant']}  {m['snapshot']}  {m['size']:>12} bytes  schema v{m['schema_version']}")
+        return 0
+
+    if command == "prune":
+        removed = sum(prune_tenant(path) for path in paths)
+        chunks = collect_garbage()
+        print(f"{removed} snapshot(s) e {chunks} bloco(s) removidos")
+        return 0
+
+    jobs = int(options.get("--jobs") or BACKUP_JOBS)
+    failures = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(paths) or 1))) as pool:
+        for result in pool.map(backup_tenant, paths):
+            if result.get("error"):
+                failures += 1
+                print(f"{result['tenant']}: {result['error']}")
+            elif result["unchanged"]:
+                print(f"{result['tenant']}: sem alterações desde {result['snapshot']}")
+            else:
+                print(f"{result['tenant']}: {result['snapshot']} ({result['size']} bytes, "
+                      f"{result['written']} novos comprimidos, {result['seconds']}s)")
+    for path in paths:
+        prune_tenant(path)
+    collect_garbage()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,147 @@
+# booking.py
+# Detecção de sobreposição de agendamentos considerando a duração do serviço.
+#
+# Cada agendamento ocupa [início, início + duração) do profissional. A busca
+# usa o índice (professional_id, start_epoch): como nenhum serviço dura mais
+# que MAX(services.duration), só os agendamentos que começam dentro de
+# (início - duração máxima, fim) podem colidir, e esse intervalo é uma única
+# busca por faixa no índice.
+from bisect import bisect_left, bisect_right
+from calendar import timegm
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+# agendamentos sem duração cadastrada ainda ocupam o horário
+MIN_DURATION_MINUTES = 1
+
+# recorrência: intervalo em dias entre as ocorrências de uma série
+RECURRENCE_STEPS = {"weekly": 7, "biweekly": 14}
+MAX_OCCURRENCES = 60
+
+Booking = namedtuple("Booking", "professional_id date_time service_id schedule_id")
+Booking.__new__.__defaults__ = (None,)
+
+
+def to_epoch(date_time):
+    """Segundos desde 1970 (UTC), igual a strftime('%s', date_time) no SQLite."""
+    return timegm(datetime.fromisoformat(str(date_time).replace("T", " ")).timetuple())
+
+
+def expand_recurrence(date_time, repeat=None, count=None, until=None):
+    """Datas/horas 'YYYY-MM-DD HH:MM:SS' de uma série que começa em `date_time`.
+
+    `repeat` é uma chave de RECURRENCE_STEPS (vazio: só a primeira ocorrência).
+    A série para em `count` ocorrências ou no dia `until` (inclusive), o que
+    vier primeiro, e nunca passa de MAX_OCCURRENCES. Levanta ValueError para
+    datas ou recorrência inválidas.
+    """
+    first = datetime.fromisoformat(str(date_time).replace("T", " "))
+    if not repeat:
+        return [first.strftime("%Y-%m-%d %H:%M:%S")]
+    if repeat not in RECURRENCE_STEPS:
+        raise ValueError(f"recorrência desconhecida: {repeat}")
+    if not count and not until:
+        raise ValueError("informe a quantidade de repetições ou a data final")
+
+    limit = min(int(count), MAX_OCCURRENCES) if count else MAX_OCCURRENCES
+    last_day = date.fromisoformat(until) if until else None
+    step = timedelta(days=RECURRENCE_STEPS[repeat])
+    occurrences = []
+    current = first
+    while len(occurrences) < limit and (last_day is None or current.date() <= last_day):
+        occurrences.append(current.strftime("%Y-%m-%d %H:%M:%S"))
+        current += step
+    if not occurrences:
+        raise ValueError("a data final é anterior à primeira ocorrência")
+    return occurrences
+
+
+def _duration_seconds(minutes):
+    return max(int(minutes or 0), MIN_DURATION_MINUTES) * 60
+
+
+def service_durations(conn):
+    """{service_id: duração em minutos}."""
+    return {row[0]: row[1] for row in conn.execute("SELECT id, duration FROM services")}
+
+
+def max_duration_seconds(conn):
+    """Maior duração entre os serviços cadastrados, em segundos."""
+    longest = conn.execute("SELECT MAX(duration) FROM services").fetchone()[0]
+    return _duration_seconds(longest)
+
+
+def _existing(conn, professional_id, lower, upper):
+    """Agendamentos do profissional que começam em (lower, upper), ordenados pelo início."""
+    return conn.execute(
+        """
+        SELECT s.id, s.date_time, s.start_epoch, COALESCE(sv.duration, 0) AS duration
+        FROM schedules s
+        LEFT JOIN services sv ON sv.id = s.service_id
+        WHERE s.professional_id = ? AND s.start_epoch > ? AND s.start_epoch < ?
+        ORDER BY s.start_epoch
+        """,
+        (professional_id, lower, upper),
+    ).fetchall()
+
+
+def find_conflicts(conn, professional_id, date_time, duration, exclude_id=None):
+    """Agendamentos do profissional que se sobrepõem a um novo horário.
+
+    `duration` é a duração (minutos) do serviço do novo horário; `exclude_id`
+    ignora o próprio agendamento quando ele está sendo editado.
+    """
+    start = to_epoch(date_time)
+    end = start + _duration_seconds(duration)
+    rows = _existing(conn, int(professional_id), start - max_duration_seconds(conn), end)
+    return [
+        row for row in rows
+        if row["id"] != exclude_id and row["start_epoch"] + _duration_seconds(row["duration"]) > start
+    ]
+
+
+def validate_batch(conn, bookings):
+    """Valida de uma vez uma lista de `Booking` propostos.
+
+    Retorna uma lista de (índice, motivo) para cada item que colide com um
+    agendamento existente ou com outro item do próprio lote. Cada profissional
+    custa uma única consulta por faixa; depois, cada item é checado por busca
+    binária na lista ordenada de intervalos existentes.
+    """
+    durations = service_durations(conn)
+    longest = max_duration_seconds(conn)
+    conflicts = []
+
+    by_professional = defaultdict(list)
+    for index, booking in enumerate(bookings):
+        start = to_epoch(booking.date_time)
+        end = start + _duration_seconds(durations.get(int(booking.service_id)))
+        by_professional[int(booking.professional_id)].append((start, end, index, booking))
+
+    for professional_id, proposed in by_professional.items():
+        proposed.sort()
+        rows = _existing(conn, professional_id,
+                         proposed[0][0] - longest, max(end for _, end, _, _ in proposed))
+        starts = [row["start_epoch"] for row in rows]
+
+        latest_end = None
+        latest_index = None
+        for start, end, index, booking in proposed:
+            # contra o banco: candidatos começam em (start - longest, end)
+            lo = bisect_right(starts, start - longest)
+            hi = bisect_left(starts, end)
+            for row in rows[lo:hi]:
+                if row["id"] == booking.schedule_id:
+                    continue
+                if row["start_epoch"] + _duration_seconds(row["duration"]) > start:
+                    conflicts.append((index, f"conflita com o agendamento de {row['date_time']}"))
+                    break
+            else:
+                # contra o próprio lote (já ordenado pelo início)
+                if latest_end is not None and latest_end > start:
+                    conflicts.append((index, f"conflita com {bookings[latest_index].date_time} do mesmo lote"))
+            if latest_end is None or end > latest_end:
+                latest_end, latest_index = end, index
+
+    conflicts.sort()
+    return conflicts
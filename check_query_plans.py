@@ -0,0 +1,333 @@
+# check_query_plans.py
+# Roda EXPLAIN QUERY PLAN em todo SQL dos blueprints contra um banco
+# individual populado e falha (exit 1) se uma consulta com WHERE fizer SCAN
+# ou se uma listagem sem WHERE fizer mais de um SCAN (joins sem índice).
+# SQL montado em f-string é verificado com os valores representativos de
+# `dynamic_bindings`. Também roda na suíte (tests/test_query_plans.py).
+#
+#   python check_query_plans.py
+import ast
+import builtins
+import os
+import random
+import re
+import sqlite3
+import string
+import sys
+import tempfile
+
+from db import BASE_DIR, init_user_db, migrate, AUTH_MIGRATIONS
+from paging import CURSOR_SEP, _keyset_query
+
+# módulos cujo SQL é verificado
+MODULES = [
+    "app.py",
+    "admin_bp.py",
+    "clients.py",
+    "professionals_bp.py",
+    "services_bp.py",
+    "schedule_bp.py",
+    "finance_bp.py",
+    "inventory_bp.py",
+    "reports_bp.py",
+    "booking.py",
+    "availability.py",
+    "sync_bp.py",
+    "finance_rollup.py",
+    "tenant_stats.py",
+    "export.py",
+    "backup.py",
+    "inventory_import.py",
+    "stock.py",
+    "forecast.py",
+    "prefetch.py",
+    "ics.py",
+    "snapshot.py",
+    "analytics.py",
+]
+
+# trechos de SQL (sem parâmetros) que podem fazer SCAN, com o motivo
+KNOWN_SCANS = {
+    'WHERE category="uso"': "estoque é pequeno e a tela lista quase tudo",
+    "WHERE 1=1": "listagem completa do financeiro quando não há filtro de período",
+    "FROM sqlite_master": "catálogo do schema, poucas linhas",
+}
+
+# tabelas de tamanho fixo e mínimo, em que o SCAN é o plano certo mesmo com filtro
+SMALL_TABLES = {
+    "change_markers": "uma linha por marcador (poucas, fixas)",
+}
+
+SQL_START = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\s", re.I)
+
+
+def _order_suffix(keys_node, descending, constants):
+    """Filtro do cursor + ORDER BY/LIMIT que a paginação por chave acrescenta (página seguinte)."""
+    try:
+        if isinstance(keys_node, ast.Name):
+            keys = constants[keys_node.id]
+        else:
+            keys = ast.literal_eval(keys_node)
+    except (KeyError, ValueError):
+        return ""
+    if not keys:
+        return ""
+    cursor = CURSOR_SEP.join("1" for _ in keys)
+    query, _, _, _ = _keyset_query("", (), keys, cursor, None, 0, descending)
+    return query
+
+
+def _keyset_suffix(call, constants):
+    """ORDER BY/LIMIT que `paging.keyset_page`/`keyset_stream` acrescenta ao SQL base da chamada."""
+    keys_node = call.args[3] if len(call.args) > 3 else None
+    descending = any(kw.arg == "descending" and getattr(kw.value, "value", False)
+                     for kw in call.keywords)
+    return _order_suffix(keys_node, descending, constants)
+
+
+def _report_suffix(call, constants):
+    """ORDER BY de um `ReportDef` de reports_bp: `keys` (decrescente, paginado) ou `order_by`."""
+    kwargs = {kw.arg: kw.value for kw in call.keywords}
+    suffix = _order_suffix(kwargs.get("keys"), True, constants)
+    order_by = kwargs.get("order_by")
+    if not suffix and isinstance(order_by, ast.Constant) and order_by.value:
+        suffix = " ORDER BY " + order_by.value
+    return suffix
+
+
+def dynamic_bindings(conn):
+    """{módulo: [{variável: valor}]} para montar o SQL em f-string de cada módulo.
+
+    Cada f-string SQL é montado uma vez para cada conjunto que define todos os
+    nomes que ele usa (tabelas e colunas vêm das constantes dos próprios
+    módulos e do schema atual). Um f-string SQL sem nenhum conjunto é
+    reportado: SQL dinâmico novo precisa ganhar valores aqui.
+    """
+    import export
+    import snapshot
+    from db import SYNC_TABLES
+
+    ids = ",".join("?" * 3)
+    table_columns = [{"table": table, "columns": export._columns(conn, table)}
+                     for table, _ in export.export_tables(conn)]
+    return {
+        "admin_bp.py": [{"placeholders": ids}],
+        "availability.py": [{"placeholders": ids}],
+        "services_bp.py": [{"fields": ["name", "category", "price", "duration", "promotion"],
+                            "set_parts": ["name=?", "price=?", "duration=?", "promotion=?"],
+                            "sp_quantity_col": "quantity_used"}],
+        "sync_bp.py": [{"table": table, "placeholders": ids} for table in SYNC_TABLES],
+        "export.py": table_columns,
+        "backup.py": [{"table": table} for table in SYNC_TABLES],
+        "inventory_import.py": [{"column": column}
+                                for column in ("category", "unit_price", "usage_per_service", "min_stock")],
+        "snapshot.py": [{"_DAY_EXPR": snapshot._DAY_EXPR}],
+        "ics.py": [{"placeholders": ids}],
+        # SQL com campos de str.format ({ids}, {where}) montado em duas etapas
+        "prefetch.py": [{"qty": "sp.quantity_used", "where": where, "ids": ids}
+                        for where in ("", "WHERE sp.service_id IN ({ids})")],
+    }
+
+
+def _fstring_names(node):
+    """Nomes livres usados nas expressões do f-string (sem builtins e variáveis de compreensões)."""
+    loaded, stored = set(), set()
+    for value in node.values:
+        if isinstance(value, ast.FormattedValue):
+            for name in ast.walk(value.value):
+                if isinstance(name, ast.Name):
+                    (stored if isinstance(name.ctx, ast.Store) else loaded).add(name.id)
+    return loaded - stored - set(dir(builtins))
+
+
+def _render(node, values):
+    """Texto do f-string com as variáveis de `values`."""
+    scope = dict(values)
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append(value.value)
+        else:
+            parts.append(str(eval(compile(ast.Expression(value.value), "<sql>", "eval"), scope)))
+    return "".join(parts)
+
+
+def _format_fields(text):
+    """Campos de str.format no texto ({ids}, {where}); vazio se não houver ou não for um modelo."""
+    try:
+        return {field for _, field, _, _ in string.Formatter().parse(text) if field}
+    except ValueError:
+        return set()
+
+
+def _expand(text, values):
+    """Preenche os campos de str.format com `values` (também os que aparecem depois de preencher)."""
+    for _ in range(3):
+        fields = _format_fields(text)
+        if not fields or not fields <= values.keys():
+            break
+        text = text.format(**values)
+    return text
+
+
+def _fstring_text(node):
+    return "".join(v.value if isinstance(v, ast.Constant) else "{}" for v in node.values)
+
+
+def collect_statements(path, bindings=()):
+    """Retorna [(linha, sql)] com as strings SQL do módulo e [(linha, sql)] dos f-strings sem valores.
+
+    Strings literais entram como estão; cada f-string SQL entra uma vez por
+    conjunto de `bindings` que define seus nomes. O SQL base passado a
+    `keyset_page`/`keyset_stream` ou declarado num `ReportDef` recebe o
+    ORDER BY/LIMIT que a paginação (ou o relatório) usa.
+    """
+    with open(path, encoding="utf-8") as fh:
+        tree = ast.parse(fh.read(), filename=path)
+
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+
+    in_fstring = set()
+    suffixes = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            in_fstring.update(id(v) for v in node.values)
+        if (isinstance(node, ast.Call) and getattr(node.func, "id", None) in ("keyset_page", "keyset_stream")
+                and len(node.args) > 1):
+            suffixes[id(node.args[1])] = _keyset_suffix(node, constants)
+        if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "ReportDef":
+            sql = next((kw.value for kw in node.keywords if kw.arg == "sql"), None)
+            if sql is not None:
+                suffixes[id(sql)] = _report_suffix(node, constants)
+
+    statements = []
+    unbound = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Constant) and isinstance(node.value, str)
+                and id(node) not in in_fstring and SQL_START.match(node.value)):
+            if not _format_fields(node.value):
+                statements.append((node.lineno, node.value + suffixes.get(id(node), "")))
+                continue
+            texts = [_expand(node.value, values) for values in bindings]
+        elif isinstance(node, ast.JoinedStr) and SQL_START.match(_fstring_text(node)):
+            names = _fstring_names(node)
+            texts = [_expand(_render(node, values), values) for values in bindings if names <= values.keys()]
+        else:
+            continue
+        rendered = {text for text in texts if not _format_fields(text)}
+        if not rendered:
+            unbound.append((node.lineno, node.value if isinstance(node, ast.Constant) else _fstring_text(node)))
+        statements.extend((node.lineno, sql + suffixes.get(id(node), "")) for sql in sorted(rendered))
+    return statements, unbound
+
+
+def populate(conn, rows=2000):
+    """Preenche o banco com dados suficientes para o planejador preferir índices."""
+    rnd = random.Random(42)
+    conn.executemany("INSERT INTO clients (name, phone) VALUES (?, ?)",
+                     [(f"Cliente {i}", f"119{i:08d}") for i in range(rows // 4)])
+    conn.executemany("INSERT INTO professionals (name) VALUES (?)",
+                     [(f"Profissional {i}",) for i in range(8)])
+    conn.executemany("INSERT INTO services (name, category, price, duration) VALUES (?, ?, ?, ?)",
+                     [(f"Serviço {i}", "Serviço", 50 + i, 30 + 15 * (i % 4)) for i in range(20)])
+    conn.executemany("INSERT INTO inventory (name, category, quantity, min_stock) VALUES (?, ?, ?, ?)",
+                     [(f"Produto {i}", "uso" if i % 2 else "venda", 100, 5) for i in range(60)])
+    conn.executemany("INSERT INTO service_products (service_id, product_id, quantity_used) VALUES (?, ?, ?)",
+                     [(s, rnd.randint(1, 60), 1) for s in range(1, 21) for _ in range(3)])
+    schedules = []
+    for i in range(rows):
+        day = 1 + i % 28
+        month = 1 + (i // 28) % 12
+        schedules.append((rnd.randint(1, rows // 4), rnd.randint(1, 8), rnd.randint(1, 20),
+                          f"2024-{month:02d}-{day:02d} {8 + i % 10:02d}:00:00"))
+    conn.executemany(
+        "INSERT INTO schedules (client_id, professional_id, service_id, date_time) VALUES (?, ?, ?, ?)",
+        schedules)
+    conn.executemany("INSERT INTO schedule_products (schedule_id, product_id, quantity_used) VALUES (?, ?, ?)",
+                     [(i, rnd.randint(1, 60), 1) for i in range(1, rows + 1)])
+    conn.executemany("INSERT INTO finance (date, professional_id, service_id, amount, type) VALUES (?, ?, ?, ?, ?)",
+                     [(s[3], s[1], s[2], 50, "entrada") for s in schedules])
+    conn.execute("ANALYZE")
+    conn.commit()
+
+
+def plan(conns, sql):
+    """EXPLAIN QUERY PLAN no primeiro banco que conhece as tabelas do SQL."""
+    params = (None,) * sql.count("?")
+    error = None
+    for conn in conns:
+        try:
+            return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        except sqlite3.OperationalError as e:
+            error = e
+    raise error
+
+
+def violations(sql, details):
+    scans = [d for d in details if d.startswith("SCAN") and d != "SCAN CONSTANT ROW"
+             and d.split()[1] not in SMALL_TABLES]
+    # percorrer um índice já na ordem pedida e parar no LIMIT não é varredura completa
+    if re.search(r"\bLIMIT\b", sql, re.I) and not any("TEMP B-TREE" in d for d in details):
+        scans = [d for d in scans if " USING INDEX " not in d and " USING COVERING INDEX " not in d]
+    allowed = 0 if re.search(r"\bWHERE\b", sql, re.I) else 1
+    if len(scans) <= allowed:
+        return []
+    # só consultas sem parâmetros podem ser dispensadas: um filtro com ? que
+    # faz SCAN é sempre regressão, mesmo que contenha um trecho conhecido
+    if "?" not in sql and any(marker in sql for marker in KNOWN_SCANS):
+        return []
+    return scans
+
+
+def check():
+    """(consultas verificadas, [problemas]) de todos os MODULES."""
+    tmp = tempfile.mkdtemp(prefix="query_plans_")
+    tenant = sqlite3.connect(os.path.join(tmp, "tenant.db"))
+    tenant.row_factory = sqlite3.Row
+    init_user_db(tenant)
+    populate(tenant)
+    auth = sqlite3.connect(os.path.join(tmp, "auth.db"))
+    migrate(auth, AUTH_MIGRATIONS)
+    bindings = dynamic_bindings(tenant)
+
+    problems = []
+    checked = 0
+    try:
+        for module in MODULES:
+            statements, unbound = collect_statements(os.path.join(BASE_DIR, module), bindings.get(module, ()))
+            for lineno, text in unbound:
+                problems.append(f"SEM VALORES  {module}:{lineno}: {' '.join(text.split())[:90]}\n"
+                                "      f-string SQL sem conjunto em dynamic_bindings")
+            for lineno, sql in statements:
+                checked += 1
+                where = f"{module}:{lineno}"
+                first_line = " ".join(sql.split())[:90]
+                try:
+                    details = plan([tenant, auth], sql)
+                except sqlite3.Error as e:
+                    problems.append(f"ERRO  {where}: {e}\n      {first_line}")
+                    continue
+                if violations(sql, details):
+                    problems.append("\n".join([f"SCAN  {where}: {first_line}"] + [f"      {d}" for d in details]))
+    finally:
+        tenant.close()
+        auth.close()
+    return checked, problems
+
+
+def main():
+    checked, problems = check()
+    for problem in problems:
+        print(problem)
+    print(f"{checked} consultas verificadas, {len(problems)} problema(s).")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
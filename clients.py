@@ -1,5 +1,5 @@
 from flask import Blueprint, request, render_template, redirect, url_for, flash
-from db import get_user_db as get_db
+from db import get_user_db as get_db, write_transaction
 
 
 clients_bp = Blueprint("clients", __name__)
@@ -23,11 +23,11 @@ def clients():
             all_clients = cur.fetchall()
             return render_template("clients.html", all_clients=all_clients)
 
-        cur.execute(
-            "INSERT INTO clients (name, phone, notes) VALUES (?, ?, ?)",
-            (name, phone, notes),
-        )
-        db.commit()
+        with write_transaction(db):
+            cur.execute(
+                "INSERT INTO clients (name, phone, notes) VALUES (?, ?, ?)",
+                (name, phone, notes),
+            )
         return redirect(url_for("clients.clients"))
 
     # carregar clientes
@@ -48,11 +48,11 @@ def edit_client(client_id):
         name = request.form["name"]
         phone = request.form["phone"]
         notes = request.form.get("notes", None)
-        cur.execute(
-            "UPDATE clients SET name=?, phone=?, notes=? WHERE id=?",
-            (name, phone, notes, client_id),
-        )
-        db.commit()
+        with write_transaction(db):
+            cur.execute(
+                "UPDATE clients SET name=?, phone=?, notes=? WHERE id=?",
+                (name, phone, notes, client_id),
+            )
         return redirect(url_for("clients.clients"))
 
     cur.execute("SELECT * FROM clients WHERE id=?", (client_id,))
@@ -66,6 +66,6 @@ def edit_client(client_id):
 def delete_client(client_id):
     db = get_db()
     cur = db.cursor()
-    cur.execute("DELETE FROM clients WHERE id=?", (client_id,))
-    db.commit()
+    with write_transaction(db):
+        cur.execute("DELETE FROM clients WHERE id=?", (client_id,))
     return redirect(url_for("clients.clients"))
@@ -0,0 +1,34 @@
+# date_windows.py
+# Janelas de datas semiabertas [início, fim) no formato 'YYYY-MM-DD', usadas
+# contra as colunas geradas `day` de schedules e finance.
+from datetime import date, timedelta
+
+
+def parse_day(value):
+    """Converte 'YYYY-MM-DD' em date; retorna None se vazio ou inválido."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def day_window(day=None):
+    """Janela de um único dia (hoje, por padrão)."""
+    start = day or date.today()
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+
+def week_window(day=None):
+    """Semana de segunda a domingo que contém `day` (hoje, por padrão)."""
+    day = day or date.today()
+    start = day - timedelta(days=day.weekday())
+    return start.isoformat(), (start + timedelta(days=7)).isoformat()
+
+
+def range_window(start=None, end=None):
+    """Janela de `start` até `end` inclusive; extremos ausentes ficam abertos (None)."""
+    lower = start.isoformat() if start else None
+    upper = (end + timedelta(days=1)).isoformat() if end else None
+    return lower, upper
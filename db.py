@@ -1,11 +1,17 @@
 # db.py
 import os
+import random
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from flask import g, session
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-AUTH_DB = os.path.join(BASE_DIR, "auth_users.db")        # banco central (login)
-USER_DB_DIR = os.path.join(BASE_DIR, "user_dbs")    # pastas dos bancos individuais
+DATA_DIR = os.getenv("AGENDA_DATA_DIR") or BASE_DIR       # onde ficam os bancos (testes usam uma pasta temporária)
+AUTH_DB = os.path.join(DATA_DIR, "auth_users.db")        # banco central (login)
+USER_DB_DIR = os.path.join(DATA_DIR, "user_dbs")    # pastas dos bancos individuais
 
 def ensure_user_db_dir():
     """Garante que a pasta onde ficam os bancos individuais exista."""
@@ -16,6 +22,46 @@ def sanitize_filename(s):
     s = str(s)
     return "".join(c for c in s if c.isalnum() or c in ("-", "_")).strip()
 
+# ------------------ Migrações versionadas (PRAGMA user_version) ------------------
+
+def schema_version(conn):
+    """Versão do schema gravada no cabeçalho do arquivo (`PRAGMA user_version`)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def add_column_if_missing(conn, table, column, definition):
+    """Adiciona uma coluna a uma tabela antiga; retorna True se ela não existia."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+def migrate(conn, migrations):
+    """Aplica, em ordem, as migrações que o banco ainda não tem.
+
+    `migrations[n - 1]` leva o banco da versão n-1 para a versão n. Tudo roda
+    em uma única transação `BEGIN IMMEDIATE`, e a versão é relida depois de
+    obter o lock de escrita para que dois workers não apliquem a mesma migração.
+    Retorna a versão final do banco.
+    """
+    target = len(migrations)
+    if schema_version(conn) >= target:
+        return schema_version(conn)
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)
+        for number in range(version + 1, target + 1):
+            migrations[number - 1](conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return max(version, target)
+
 # ------------------ AUTH DB (Login Central) ------------------
 def get_auth_db():
     if not hasattr(g, "auth_db"):
@@ -24,35 +70,34 @@ def get_auth_db():
         g.auth_db = conn
     return g.auth_db
 
-def init_auth_db():
-    """Cria a tabela de usuários e atualiza o schema quando necessário."""
-    conn = sqlite3.connect(AUTH_DB)
-    try:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT,
-            birth_date TEXT
-        )
-        """)
-        conn.commit()
+def _auth_v1_users(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT,
+        birth_date TEXT
+    )
+    """)
 
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(users)")
-        columns = [row[1] for row in cur.fetchall()]
+def _auth_v2_legacy_columns(conn):
+    # bancos antigos guardavam a senha em `password` e não tinham `birth_date`
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if add_column_if_missing(conn, "users", "password_hash", "TEXT") and "password" in columns:
+        conn.execute("UPDATE users SET password_hash = password WHERE password IS NOT NULL")
+    add_column_if_missing(conn, "users", "birth_date", "TEXT")
 
-        if "password_hash" not in columns:
-            conn.execute("ALTER TABLE users ADD COLUMN password_hash TEXT")
-            conn.commit()
-            if "password" in columns:
-                conn.execute("UPDATE users SET password_hash = password WHERE password IS NOT NULL")
-                conn.commit()
+AUTH_MIGRATIONS = [
+    _auth_v1_users,
+    _auth_v2_legacy_columns,
+]
 
-        if "birth_date" not in columns:
-            conn.execute("ALTER TABLE users ADD COLUMN birth_date TEXT")
-            conn.commit()
+def init_auth_db():
+    """Cria a tabela de usuários e aplica as migrações pendentes do banco de login."""
+    conn = sqlite3.connect(AUTH_DB)
+    try:
+        migrate(conn, AUTH_MIGRATIONS)
     finally:
         conn.close()
 
@@ -63,8 +108,7 @@ def user_db_path(user_id):
     fname = f"agenda_{sanitize_filename(user_id)}.db"
     return os.path.join(USER_DB_DIR, fname)
 
-def init_user_db(conn):
-    """Cria todas as tabelas do banco do usuário."""
+def _user_v1_base_schema(conn):
     conn.execute("""
     CREATE TABLE IF NOT EXISTS services (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -170,50 +214,959 @@ def init_user_db(conn):
     )
     """)
 
-    conn.commit()
+def _user_v2_legacy_columns(conn):
+    # bancos criados antes destas colunas existirem
+    add_column_if_missing(conn, "clients", "notes", "TEXT")
+    add_column_if_missing(conn, "schedules", "professional_id", "INTEGER")
 
-def get_user_db():
-    """Retorna a conexão com o banco individual do usuário logado."""
-    if "user_id" not in session:
-        raise RuntimeError("Usuário não está logado — nenhuma base individual pode ser carregada.")
+def ensure_indexes(conn, indexes):
+    """Cria os índices de `indexes` (nome -> "tabela(colunas)") que ainda não existem."""
+    for name, target in indexes.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
 
-    if not hasattr(g, "user_db"):
-        ensure_user_db_dir()
-        path = user_db_path(session["user_id"])
-        first_creation = not os.path.exists(path)
+def _user_v3_indexes(conn):
+    # caminhos de acesso quentes dos blueprints; `check_query_plans.py`
+    # falha se alguma consulta quente voltar a fazer SCAN
+    ensure_indexes(conn, {
+        "idx_schedules_professional_date_time": "schedules(professional_id, date_time)",
+        "idx_schedules_date_time": "schedules(date_time)",
+        "idx_service_products_service": "service_products(service_id)",
+        "idx_schedule_products_schedule": "schedule_products(schedule_id)",
+        "idx_schedule_products_product": "schedule_products(product_id)",
+        "idx_finance_type_date": "finance(type, date)",
+    })
+    conn.execute("ANALYZE")
 
-        conn = sqlite3.connect(path, timeout=10)
-        conn.row_factory = sqlite3.Row
+def _user_v4_day_columns(conn):
+    # colunas derivadas (geradas) de data: os filtros por dia/semana viram
+    # intervalos semiabertos indexáveis em vez de date(coluna) = ?
+    add_column_if_missing(conn, "schedules", "day",
+                          "TEXT GENERATED ALWAYS AS (substr(date_time, 1, 10)) VIRTUAL")
+    add_column_if_missing(conn, "schedules", "start_epoch",
+                          "INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', date_time) AS INTEGER)) VIRTUAL")
+    add_column_if_missing(conn, "finance", "day",
+                          "TEXT GENERATED ALWAYS AS (substr(date, 1, 10)) VIRTUAL")
+    add_column_if_missing(conn, "finance", "epoch",
+                          "INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', date) AS INTEGER)) VIRTUAL")
+    conn.execute("DROP INDEX IF EXISTS idx_finance_type_date")
+    ensure_indexes(conn, {
+        "idx_schedules_day": "schedules(day, date_time)",
+        "idx_finance_day": "finance(day)",
+    })
+    conn.execute("ANALYZE")
+
+def _user_v5_paging_indexes(conn):
+    # o relatório financeiro pagina por (date, id)
+    ensure_indexes(conn, {
+        "idx_finance_date": "finance(date)",
+    })
+
+def _user_v6_overlap_index(conn):
+    # busca de sobreposição por faixa de início de cada profissional (booking.py)
+    ensure_indexes(conn, {
+        "idx_schedules_professional_start": "schedules(professional_id, start_epoch)",
+    })
+
+def create_change_marker(conn, table):
+    """Mantém em `change_markers` um contador de alterações de `table` (via triggers).
+
+    Ler o contador é uma busca pela chave primária: serve de marcador barato
+    de "algo mudou" para caches e para respostas condicionais (ETag).
+    """
+    conn.execute(
+        "INSERT OR IGNORE INTO change_markers (name, version, changed_at) "
+        "VALUES (?, 0, CAST(strftime('%s', 'now') AS INTEGER))",
+        (table,),
+    )
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_marker_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            UPDATE change_markers
+            SET version = version + 1, changed_at = CAST(strftime('%s', 'now') AS INTEGER)
+            WHERE name = '{table}';
+        END
+        """)
+
+def _user_v7_working_hours(conn):
+    # horário de trabalho por profissional e dia da semana (0 = segunda),
+    # em minutos desde 00:00; sem linhas, vale o horário padrão de availability.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS professional_hours (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        professional_id INTEGER NOT NULL,
+        weekday INTEGER NOT NULL,
+        start_minute INTEGER NOT NULL,
+        end_minute INTEGER NOT NULL,
+        FOREIGN KEY(professional_id) REFERENCES professionals(id)
+    )
+    """)
+    ensure_indexes(conn, {
+        "idx_professional_hours_professional": "professional_hours(professional_id, weekday)",
+    })
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_markers (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        changed_at INTEGER
+    )
+    """)
+    for table in ("schedules", "services", "professional_hours"):
+        create_change_marker(conn, table)
+
+def _user_v8_calendar_tokens(conn):
+    # token secreto do feed iCalendar de cada profissional (NULL = feed desligado)
+    add_column_if_missing(conn, "professionals", "ics_token", "TEXT")
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_professionals_ics_token ON professionals(ics_token)"
+    )
+    # nomes de clientes e profissionais também aparecem no feed
+    for table in ("clients", "professionals"):
+        create_change_marker(conn, table)
+
+# tabelas cujas alterações entram em `change_log` (sync incremental)
+SYNC_TABLES = ("clients", "professionals", "services", "schedules", "inventory", "finance")
+
+def create_change_log_triggers(conn, table, created=True):
+    """Registra em `change_log` cada inserção, alteração ou exclusão de `table`.
+
+    `INSERT OR REPLACE` mantém uma linha por (tabela, id) e lhe dá uma versão
+    nova a cada alteração, então o log cresce com o número de linhas vivas e
+    excluídas, não com o número de escritas. `created_version` guarda a
+    versão da inserção da linha (NULL se ela é anterior ao log) e atravessa
+    as alterações seguintes: quem leu o log até a versão N sabe se a linha é
+    nova para ele (created_version > N) ou só mudou. `created=False` cria os
+    triggers da v9, anteriores a essa coluna.
+    """
+    now = "CAST(strftime('%s', 'now') AS INTEGER)"
+    if not created:
+        for event, ref, op in (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete")):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT OR REPLACE INTO change_log (table_name, row_id, op, changed_at)
+                VALUES ('{table}', {ref}.id, '{op}', {now});
+            END
+            """)
+        return
+    bodies = {
+        "INSERT": f"""
+            INSERT OR REPLACE INTO change_log (table_name, row_id, op, changed_at, created_version)
+            VALUES ('{table}', NEW.id, 'upsert', {now}, NULL);
+            UPDATE change_log SET created_version = version WHERE table_name = '{table}' AND row_id = NEW.id;
+        """,
+    }
+    for event, ref, op in (("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete")):
+        bodies[event] = f"""
+            INSERT OR REPLACE INTO change_log (table_name, row_id, op, changed_at, created_version)
+            VALUES ('{table}', {ref}.id, '{op}', {now},
+                    (SELECT created_version FROM change_log WHERE table_name = '{table}' AND row_id = {ref}.id));
+        """
+    for event, body in bodies.items():
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_log_{event.lower()}
+        AFTER {event} ON {table}
+        BEGIN
+            {body}
+        END
+        """)
+
+def _user_v9_change_log(conn):
+    # versão = chave primária crescente; a consulta "desde a versão N" é uma
+    # busca por faixa nela
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at INTEGER NOT NULL,
+        UNIQUE(table_name, row_id)
+    )
+    """)
+    for table in SYNC_TABLES:
+        # as linhas que já existem entram como versão inicial
+        conn.execute(f"""
+        INSERT OR IGNORE INTO change_log (table_name, row_id, op, changed_at)
+        SELECT '{table}', id, 'upsert', CAST(strftime('%s', 'now') AS INTEGER) FROM {table}
+        """)
+        create_change_log_triggers(conn, table, created=False)
+
+# ------------------ Rollup diário do financeiro ------------------
+# finance_daily guarda, por (type, day, professional_id, service_id), a
+# quantidade de lançamentos e a soma dos valores. Triggers em `finance` a
+# mantêm na mesma transação do lançamento; os resumos leem dela em vez de
+# agregar o livro inteiro. Chaves ausentes viram '' / 0 para que o UPSERT
+# encontre o grupo (NULL nunca conflita numa chave primária).
+
+FINANCE_ROLLUP_KEY = (
+    "IFNULL({ref}.type, '')", "IFNULL({ref}.day, '')",
+    "IFNULL({ref}.professional_id, 0)", "IFNULL({ref}.service_id, 0)",
+)
+
+def _rollup_key(ref):
+    return [expr.format(ref=ref) for expr in FINANCE_ROLLUP_KEY]
+
+def create_finance_rollup(conn):
+    """Cria a tabela `finance_daily` e os triggers que a mantêm."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS finance_daily (
+        type TEXT NOT NULL,
+        day TEXT NOT NULL,
+        professional_id INTEGER NOT NULL,
+        service_id INTEGER NOT NULL,
+        entries INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        PRIMARY KEY (type, day, professional_id, service_id)
+    ) WITHOUT ROWID
+    """)
+    new_key = ", ".join(_rollup_key("NEW"))
+    old_match = " AND ".join(
+        f"{col} = {expr}" for col, expr in zip(("type", "day", "professional_id", "service_id"), _rollup_key("OLD"))
+    )
+    add_new = f"""
+        INSERT INTO finance_daily (type, day, professional_id, service_id, entries, amount)
+        VALUES ({new_key}, 1, IFNULL(NEW.amount, 0))
+        ON CONFLICT (type, day, professional_id, service_id)
+        DO UPDATE SET entries = entries + 1, amount = amount + excluded.amount;
+    """
+    remove_old = f"""
+        UPDATE finance_daily SET entries = entries - 1, amount = amount - IFNULL(OLD.amount, 0)
+        WHERE {old_match};
+        DELETE FROM finance_daily WHERE {old_match} AND entries <= 0;
+    """
+    for event, body in (("insert", add_new), ("delete", remove_old), ("update", remove_old + add_new)):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_finance_rollup_{event}
+        AFTER {event.upper()} ON finance
+        BEGIN
+            {body}
+        END
+        """)
+
+def rebuild_finance_rollup(conn):
+    """Recalcula `finance_daily` inteira a partir do livro (`finance`)."""
+    conn.execute("DELETE FROM finance_daily")
+    conn.execute(f"""
+    INSERT INTO finance_daily (type, day, professional_id, service_id, entries, amount)
+    SELECT {", ".join(_rollup_key("f"))}, COUNT(*), COALESCE(SUM(f.amount), 0)
+    FROM finance f
+    GROUP BY 1, 2, 3, 4
+    """)
+
+def check_finance_rollup(conn, tolerance=0.005):
+    """Compara `finance_daily` com o livro; retorna a lista de grupos divergentes.
+
+    Cada item é (type, day, professional_id, service_id, (entries, amount) no
+    livro, (entries, amount) no rollup); lista vazia = consistente.
+    """
+    ledger = {
+        tuple(row[:4]): (row[4], row[5])
+        for row in conn.execute(f"""
+            SELECT {", ".join(_rollup_key("f"))}, COUNT(*), COALESCE(SUM(f.amount), 0)
+            FROM finance f
+            GROUP BY 1, 2, 3, 4
+        """)
+    }
+    rollup = {
+        tuple(row[:4]): (row[4], row[5])
+        for row in conn.execute(
+            "SELECT type, day, professional_id, service_id, entries, amount FROM finance_daily"
+        )
+    }
+    problems = []
+    for key in sorted(set(ledger) | set(rollup), key=str):
+        expected = ledger.get(key, (0, 0.0))
+        found = rollup.get(key, (0, 0.0))
+        if expected[0] != found[0] or abs((expected[1] or 0) - (found[1] or 0)) > tolerance:
+            problems.append((*key, expected, found))
+    return problems
+
+def _user_v10_finance_rollup(conn):
+    create_finance_rollup(conn)
+    rebuild_finance_rollup(conn)
+
+def _user_v11_export_watermarks(conn):
+    # inserção x alteração no log (exportação incremental por consumidor)
+    add_column_if_missing(conn, "change_log", "created_version", "INTEGER")
+    for table in SYNC_TABLES:
+        for event in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_log_{event}")
+        create_change_log_triggers(conn, table)
+    ensure_indexes(conn, {
+        "idx_change_log_table_version": "change_log(table_name, version)",
+    })
+    # até onde cada consumidor (contador, integração...) já exportou
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS export_watermarks (
+        consumer TEXT PRIMARY KEY,
+        version INTEGER NOT NULL,
+        previous_version INTEGER NOT NULL DEFAULT 0,
+        exported_at INTEGER NOT NULL
+    )
+    """)
+
+# ------------------ Livro de movimentações de estoque ------------------
+# Toda mudança de quantidade vira uma linha de `stock_movements` (somente
+# inserção, com sinal: consumo negativo, reposição positiva). Um trigger
+# aplica cada movimentação em `inventory.quantity` (saldo) e
+# `inventory.total_used` (consumo acumulado) na mesma transação; o livro
+# permite auditar esses dois valores a qualquer momento.
+
+STOCK_MOVEMENT_KINDS = ("opening", "consumption", "restock", "adjustment", "reversal")
+
+# tipos que contam no consumo acumulado (o estorno devolve o que um consumo tirou)
+STOCK_USAGE_KINDS = ("consumption", "reversal")
+
+def create_stock_ledger(conn):
+    """Cria `stock_movements` e os triggers que mantêm os saldos de `inventory`."""
+    kinds = ", ".join(f"'{kind}'" for kind in STOCK_MOVEMENT_KINDS)
+    usage_kinds = ", ".join(f"'{kind}'" for kind in STOCK_USAGE_KINDS)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ({kinds})),
+        quantity REAL NOT NULL,
+        schedule_id INTEGER,
+        note TEXT,
+        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        FOREIGN KEY(product_id) REFERENCES inventory(id),
+        FOREIGN KEY(schedule_id) REFERENCES schedules(id)
+    )
+    """)
+    ensure_indexes(conn, {
+        "idx_stock_movements_product": "stock_movements(product_id, id)",
+        "idx_stock_movements_schedule": "stock_movements(schedule_id)",
+    })
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_stock_movements_apply
+    AFTER INSERT ON stock_movements
+    BEGIN
+        UPDATE inventory
+        SET quantity = IFNULL(quantity, 0) + NEW.quantity,
+            total_used = total_used - CASE WHEN NEW.kind IN ({usage_kinds}) THEN NEW.quantity ELSE 0 END
+        WHERE id = NEW.product_id;
+    END
+    """)
+    for event in ("UPDATE", "DELETE"):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stock_movements_no_{event.lower()}
+        BEFORE {event} ON stock_movements
+        BEGIN
+            SELECT RAISE(ABORT, 'stock_movements é somente inserção: registre um ajuste ou estorno');
+        END
+        """)
+
+def check_stock_ledger(conn, tolerance=0.0001):
+    """Compara saldo e consumo acumulado de cada produto com o livro.
+
+    Retorna [(product_id, name, (quantity, total_used) no livro,
+    (quantity, total_used) em inventory)] dos divergentes; vazia = consistente.
+    Produto excluído com saldo diferente de zero no livro também diverge
+    (name None e inventory (0, total_used do livro)): a exclusão zera o saldo.
+    """
+    usage_kinds = ", ".join(f"'{kind}'" for kind in STOCK_USAGE_KINDS)
+    problems = []
+    for row in conn.execute(f"""
+        SELECT i.id, i.name, IFNULL(i.quantity, 0), i.total_used,
+               COALESCE(SUM(m.quantity), 0),
+               -COALESCE(SUM(CASE WHEN m.kind IN ({usage_kinds}) THEN m.quantity END), 0)
+        FROM inventory i
+        LEFT JOIN stock_movements m ON m.product_id = i.id
+        GROUP BY i.id
+        ORDER BY i.id
+    """):
+        product_id, name, quantity, total_used, ledger_quantity, ledger_used = row
+        if abs(quantity - ledger_quantity) > tolerance or abs(total_used - ledger_used) > tolerance:
+            problems.append((product_id, name, (ledger_quantity, ledger_used), (quantity, total_used)))
+    for row in conn.execute(f"""
+        SELECT m.product_id, SUM(m.quantity),
+               -COALESCE(SUM(CASE WHEN m.kind IN ({usage_kinds}) THEN m.quantity END), 0)
+        FROM stock_movements m
+        WHERE NOT EXISTS (SELECT 1 FROM inventory i WHERE i.id = m.product_id)
+        GROUP BY m.product_id
+        ORDER BY m.product_id
+    """):
+        product_id, ledger_quantity, ledger_used = row
+        if abs(ledger_quantity) > tolerance:
+            problems.append((product_id, None, (ledger_quantity, ledger_used), (0, ledger_used)))
+    return problems
 
-        # guarda em g
-        g.user_db = conn
+def create_stock_alerts(conn):
+    """Cria `stock_alerts` e os triggers que abrem e fecham alertas de estoque baixo.
 
-        # cria ou atualiza tabelas sempre que necessário
+    Só a linha de `inventory` que mudou é avaliada (saldo <= mínimo, com
+    mínimo > 0): abre um alerta se ainda não há um aberto para o produto e
+    fecha o aberto quando o saldo volta acima do mínimo. Um produto tem no
+    máximo um alerta aberto (índice único parcial).
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS stock_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        quantity REAL NOT NULL,
+        min_stock INTEGER NOT NULL,
+        opened_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+        resolved_at INTEGER,
+        resolved_quantity REAL,
+        FOREIGN KEY(product_id) REFERENCES inventory(id)
+    )
+    """)
+    conn.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_stock_alerts_open
+    ON stock_alerts(product_id) WHERE resolved_at IS NULL
+    """)
+    ensure_indexes(conn, {"idx_stock_alerts_resolved": "stock_alerts(resolved_at)"})
+    # UPDATE OF dispara mesmo sem o valor mudar: toda movimentação reavalia o produto
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_low
+    AFTER UPDATE OF quantity, min_stock ON inventory
+    WHEN NEW.min_stock > 0 AND IFNULL(NEW.quantity, 0) <= NEW.min_stock
+    BEGIN
+        INSERT OR IGNORE INTO stock_alerts (product_id, quantity, min_stock)
+        VALUES (NEW.id, IFNULL(NEW.quantity, 0), NEW.min_stock);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_ok
+    AFTER UPDATE OF quantity, min_stock ON inventory
+    WHEN NOT (NEW.min_stock > 0 AND IFNULL(NEW.quantity, 0) <= NEW.min_stock)
+    BEGIN
+        UPDATE stock_alerts
+        SET resolved_at = CAST(strftime('%s', 'now') AS INTEGER), resolved_quantity = IFNULL(NEW.quantity, 0)
+        WHERE product_id = NEW.id AND resolved_at IS NULL;
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_inventory_stock_alerts_delete
+    AFTER DELETE ON inventory
+    BEGIN
+        DELETE FROM stock_alerts WHERE product_id = OLD.id;
+    END
+    """)
+
+def _user_v12_stock_ledger(conn):
+    add_column_if_missing(conn, "inventory", "total_used", "REAL NOT NULL DEFAULT 0")
+    create_stock_ledger(conn)
+    # livro inicial, antes de os triggers valerem para ele: o consumo já
+    # registrado em schedule_products e uma abertura que, somada a ele, dá o
+    # saldo atual
+    conn.execute("DROP TRIGGER IF EXISTS trg_stock_movements_apply")
+    conn.execute("""
+    INSERT INTO stock_movements (product_id, kind, quantity, note)
+    SELECT i.id, 'opening', IFNULL(i.quantity, 0) + IFNULL(u.used, 0), 'saldo ao criar o livro'
+    FROM inventory i
+    LEFT JOIN (SELECT product_id, SUM(quantity_used) AS used FROM schedule_products GROUP BY product_id) u
+        ON u.product_id = i.id
+    WHERE IFNULL(i.quantity, 0) + IFNULL(u.used, 0) != 0
+    """)
+    conn.execute("""
+    INSERT INTO stock_movements (product_id, kind, quantity, note)
+    SELECT sp.product_id, 'consumption', -SUM(sp.quantity_used), 'consumo anterior ao livro'
+    FROM schedule_products sp
+    JOIN inventory i ON i.id = sp.product_id
+    GROUP BY sp.product_id
+    HAVING SUM(sp.quantity_used) != 0
+    """)
+    conn.execute("""
+    UPDATE inventory SET total_used = IFNULL(
+        (SELECT SUM(quantity_used) FROM schedule_products WHERE product_id = inventory.id), 0)
+    """)
+    create_stock_ledger(conn)
+
+def _user_v13_stock_alerts(conn):
+    create_stock_alerts(conn)
+    # produtos que já estão abaixo do mínimo entram como alertas abertos
+    conn.execute("""
+    INSERT OR IGNORE INTO stock_alerts (product_id, quantity, min_stock)
+    SELECT id, IFNULL(quantity, 0), min_stock
+    FROM inventory
+    WHERE min_stock > 0 AND IFNULL(quantity, 0) <= min_stock
+    """)
+
+def _user_v14_finance_paging_index(conn):
+    # o relatório financeiro pagina por (IFNULL(date, ''), id): lançamentos sem
+    # data também entram nas páginas
+    ensure_indexes(conn, {
+        "idx_finance_date_key": "finance(IFNULL(date, ''), id)",
+    })
+
+def _user_v15_export_batches(conn):
+    # linhas do change_log de antes da v11 (created_version NULL) passam a ter
+    # a própria versão como inserção: na dúvida, o consumidor recebe "insert"
+    # (idempotente pelo id) em vez de um "update" de linha que nunca viu
+    conn.execute("UPDATE change_log SET created_version = version WHERE created_version IS NULL")
+    # último lote entregue a cada consumidor (para ?replay=1): o change_log só
+    # guarda a versão mais recente de cada linha, então a faixa de versões do
+    # lote não basta para refazê-lo depois que alguma linha muda de novo
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS export_batches (
+        consumer TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        change TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (consumer, table_name, row_id)
+    )
+    """)
+
+def _user_v16_service_products_product_index(conn):
+    # excluir um produto tira ele dos serviços que o usam (stock.remove_product)
+    ensure_indexes(conn, {
+        "idx_service_products_product": "service_products(product_id)",
+    })
+
+# A posição na lista é a versão: nunca reordene nem remova, só acrescente no fim.
+USER_MIGRATIONS = [
+    _user_v1_base_schema,
+    _user_v2_legacy_columns,
+    _user_v3_indexes,
+    _user_v4_day_columns,
+    _user_v5_paging_indexes,
+    _user_v6_overlap_index,
+    _user_v7_working_hours,
+    _user_v8_calendar_tokens,
+    _user_v9_change_log,
+    _user_v10_finance_rollup,
+    _user_v11_export_watermarks,
+    _user_v12_stock_ledger,
+    _user_v13_stock_alerts,
+    _user_v14_finance_paging_index,
+    _user_v15_export_batches,
+    _user_v16_service_products_product_index,
+]
+USER_SCHEMA_VERSION = len(USER_MIGRATIONS)
+
+def init_user_db(conn):
+    """Cria ou atualiza as tabelas do banco do usuário até a versão atual."""
+    return migrate(conn, USER_MIGRATIONS)
+
+# ------------------ Pool de conexões (por processo) ------------------
+
+USER_DB_POOL_SIZE = int(os.getenv("USER_DB_POOL_SIZE", "32"))                 # máx. de arquivos abertos
+USER_DB_POOL_IDLE_SECONDS = float(os.getenv("USER_DB_POOL_IDLE_SECONDS", "300"))  # idade máx. ociosa
+
+class UserDBPool:
+    """Pool LRU de conexões ociosas com os bancos individuais.
+
+    Cada worker do gunicorn tem o seu pool. Uma conexão emprestada sai do pool
+    e só volta em `release`, então nunca é usada por duas requisições ao mesmo
+    tempo. Conexões ociosas há mais de `idle_seconds` são fechadas e o total de
+    conexões guardadas nunca passa de `max_size`.
+    """
+
+    def __init__(self, max_size=USER_DB_POOL_SIZE, idle_seconds=USER_DB_POOL_IDLE_SECONDS):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = OrderedDict()  # path -> [(conn, devolvida_em), ...], do menos ao mais recente
+        self._size = 0
+        self._borrowed = 0
+        self._hits = 0
+        self._misses = 0
+        self._evicted_idle = 0
+        self._evicted_capacity = 0
+
+    def _check_fork(self):
+        # conexões herdadas de outro processo (fork do gunicorn) não podem ser reusadas
+        if self._pid != os.getpid():
+            self._reset()
+
+    def acquire(self, path, opener):
+        """Empresta uma conexão para `path`, abrindo uma nova com `opener` se preciso."""
+        conn = None
+        with self._lock:
+            self._check_fork()
+            expired = self._evict_expired(time.monotonic())
+            entries = self._idle.get(path)
+            if entries:
+                conn, _ = entries.pop()
+                if not entries:
+                    del self._idle[path]
+                self._size -= 1
+                self._hits += 1
+                self._borrowed += 1
+            else:
+                self._misses += 1
+
+        for old_conn in expired:
+            old_conn.close()
+        if conn is not None:
+            return conn
+
+        conn = opener(path)
+        with self._lock:
+            self._borrowed += 1
+        return conn
+
+    def release(self, path, conn):
+        """Devolve uma conexão ao pool (ou a fecha, se estiver inutilizável)."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+        except sqlite3.ProgrammingError:
+            # a conexão foi fechada por quem a usou
+            with self._lock:
+                self._borrowed = max(self._borrowed - 1, 0)
+            return
+
+        to_close = []
+        with self._lock:
+            self._check_fork()
+            self._borrowed = max(self._borrowed - 1, 0)
+            now = time.monotonic()
+            self._idle.setdefault(path, []).append((conn, now))
+            self._idle.move_to_end(path)
+            self._size += 1
+            to_close.extend(self._evict_expired(now))
+            while self._size > self.max_size:
+                lru_path, entries = next(iter(self._idle.items()))
+                old_conn, _ = entries.pop(0)
+                if not entries:
+                    del self._idle[lru_path]
+                self._size -= 1
+                self._evicted_capacity += 1
+                to_close.append(old_conn)
+
+        for old_conn in to_close:
+            old_conn.close()
+
+    def _evict_expired(self, now):
+        """Remove (sem fechar) as conexões ociosas há mais tempo que o limite."""
+        expired = []
+        cutoff = now - self.idle_seconds
+        for path in list(self._idle):
+            entries = self._idle[path]
+            while entries and entries[0][1] < cutoff:
+                expired.append(entries.pop(0)[0])
+            if not entries:
+                del self._idle[path]
+        self._size -= len(expired)
+        self._evicted_idle += len(expired)
+        return expired
+
+    def clear(self):
+        """Fecha todas as conexões ociosas do pool."""
+        with self._lock:
+            conns = [conn for entries in self._idle.values() for conn, _ in entries]
+            self._idle.clear()
+            self._size = 0
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        """Contadores para dimensionar o pool."""
+        with self._lock:
+            return {
+                "pid": self._pid,
+                "max_size": self.max_size,
+                "idle_seconds": self.idle_seconds,
+                "idle": self._size,
+                "tenants": len(self._idle),
+                "borrowed": self._borrowed,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evicted_idle": self._evicted_idle,
+                "evicted_capacity": self._evicted_capacity,
+            }
+
+user_db_pool = UserDBPool()
+
+# ------------------ Perfil de execução do SQLite ------------------
+
+SQLITE_PROFILE = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-16000")),               # negativo = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),    # bytes
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000")),
+    "wal_autocheckpoint": int(os.getenv("SQLITE_WAL_AUTOCHECKPOINT", "1000")),  # páginas
+    "journal_size_limit": int(os.getenv("SQLITE_JOURNAL_SIZE_LIMIT", str(16 * 1024 * 1024))),
+}
+# intervalo mínimo entre checkpoints PASSIVE feitos ao devolver a conexão ao pool
+WAL_CHECKPOINT_SECONDS = float(os.getenv("SQLITE_WAL_CHECKPOINT_SECONDS", "60"))
+
+_last_checkpoint = {}   # path -> time.monotonic() do último checkpoint
+_checkpoint_lock = threading.Lock()
+_schema_ready = set()   # bancos já migrados neste processo
+
+def apply_sqlite_profile(conn, readonly=False):
+    """Aplica o perfil de execução (`SQLITE_PROFILE`) a uma conexão recém-aberta."""
+    p = SQLITE_PROFILE
+    conn.execute(f"PRAGMA busy_timeout = {p['busy_timeout']:d}")
+    if not readonly:
+        # journal_mode é gravado no arquivo; só uma conexão de escrita pode mudá-lo
+        conn.execute(f"PRAGMA journal_mode = {p['journal_mode']}")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {p['wal_autocheckpoint']:d}")
+        conn.execute(f"PRAGMA journal_size_limit = {p['journal_size_limit']:d}")
+    conn.execute(f"PRAGMA synchronous = {p['synchronous']}")
+    conn.execute(f"PRAGMA cache_size = {p['cache_size']:d}")
+    conn.execute(f"PRAGMA mmap_size = {p['mmap_size']:d}")
+    conn.execute(f"PRAGMA temp_store = {p['temp_store']}")
+
+def checkpoint_wal(path, conn, force=False):
+    """Faz um checkpoint PASSIVE do WAL se o último foi há mais de WAL_CHECKPOINT_SECONDS.
+
+    PASSIVE nunca espera por leitores nem escritores; junto com
+    `journal_size_limit`, impede que o arquivo `-wal` cresça sem limite.
+    """
+    if conn.in_transaction:
+        return False
+    # a vez é reservada sob o lock: duas devoluções simultâneas não fazem o mesmo checkpoint
+    with _checkpoint_lock:
+        now = time.monotonic()
+        if not force and now - _last_checkpoint.get(path, 0) < WAL_CHECKPOINT_SECONDS:
+            return False
+        _last_checkpoint[path] = now
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    return True
+
+def readonly_uri(path):
+    """URI `mode=ro` do banco: leituras que nunca pegam lock de escrita."""
+    return f"file:{path}?mode=ro"
+
+def _open_user_db(path):
+    """Abre (e prepara o schema de) uma nova conexão com o banco individual."""
+    conn = sqlite3.connect(path, timeout=SQLITE_PROFILE["busy_timeout"] / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    apply_sqlite_profile(conn)
+
+    # migra só quando o arquivo está numa versão antiga; conexões vindas do pool
+    # já passaram por aqui, então o caminho quente é uma única comparação
+    if schema_version(conn) < USER_SCHEMA_VERSION:
         init_user_db(conn)
+    _schema_ready.add(path)
+
+    return conn
+
+def _open_user_db_readonly(uri):
+    """Abre uma conexão somente leitura (`mode=ro`) com o banco individual."""
+    conn = sqlite3.connect(uri, uri=True, timeout=SQLITE_PROFILE["busy_timeout"] / 1000,
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    apply_sqlite_profile(conn, readonly=True)
+    return conn
+
+def _ensure_user_schema(path):
+    """Garante (uma vez por processo) que o arquivo exista e esteja migrado."""
+    if path not in _schema_ready:
+        conn = user_db_pool.acquire(path, _open_user_db)
+        user_db_pool.release(path, conn)
+
+# ------------------ Escritas serializadas por banco ------------------
+
+def _is_busy(error):
+    """True se o erro do SQLite for 'database is locked' / SQLITE_BUSY."""
+    name = getattr(error, "sqlite_errorname", "")
+    if name:
+        return name.startswith(("SQLITE_BUSY", "SQLITE_LOCKED"))
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+class TenantWriteCoordinator:
+    """Fila de escrita por banco individual.
+
+    Dentro do processo, um lock por arquivo serializa as transações: só uma
+    requisição por vez disputa o `BEGIN IMMEDIATE`, e as outras esperam na
+    fila em vez de girar no busy_timeout do SQLite. Entre processos (workers
+    do gunicorn), o `BEGIN IMMEDIATE` é tentado com um busy_timeout curto e
+    refeito com backoff exponencial com jitter até `retry_seconds`.
+
+    Chamadas aninhadas na mesma conexão entram na transação de fora, então
+    vários passos de uma requisição viram um único commit.
+    """
+
+    def __init__(self, retry_seconds=15.0, busy_slice_ms=50, backoff_base=0.01, backoff_cap=0.5):
+        self.retry_seconds = retry_seconds
+        self.busy_slice_ms = busy_slice_ms
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._lock = threading.Lock()
+        self._queues = {}     # path -> threading.Lock
+        self._stats = {}      # path -> contadores
+        self._active = set()  # id() das conexões com transação aberta pela fila
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        # locks herdados de outro processo não valem aqui
+        if self._pid != os.getpid():
+            self._queues.clear()
+            self._stats.clear()
+            self._active.clear()
+            self._pid = os.getpid()
+
+    def _queue(self, path):
+        with self._lock:
+            self._check_fork()
+            if path not in self._queues:
+                self._queues[path] = threading.Lock()
+                self._stats[path] = {
+                    "waiting": 0, "max_waiting": 0, "transactions": 0, "busy_retries": 0,
+                    "failures": 0, "wait_total": 0.0, "wait_max": 0.0,
+                }
+            return self._queues[path], self._stats[path]
+
+    def _begin(self, conn):
+        """BEGIN IMMEDIATE com backoff; retorna quantas vezes o banco estava ocupado."""
+        deadline = time.monotonic() + self.retry_seconds
+        retries = 0
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_slice_ms:d}")
+        try:
+            while True:
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    return retries
+                except sqlite3.OperationalError as e:
+                    remaining = deadline - time.monotonic()
+                    if not _is_busy(e) or remaining <= 0:
+                        raise
+                    retries += 1
+                    delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** retries))
+                    time.sleep(min(delay, remaining))
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {SQLITE_PROFILE['busy_timeout']:d}")
+
+    @contextmanager
+    def transaction(self, path, conn):
+        """Abre uma transação de escrita em `conn`; commit ao sair, rollback se houver erro."""
+        with self._lock:
+            nested = id(conn) in self._active
+        if nested:
+            yield conn
+            return
+
+        queue, stats = self._queue(path)
+        queued_at = time.monotonic()
+        with self._lock:
+            stats["waiting"] += 1
+            stats["max_waiting"] = max(stats["max_waiting"], stats["waiting"])
+        queue.acquire()
+        try:
+            with self._lock:
+                stats["waiting"] -= 1
+            if conn.in_transaction:
+                conn.commit()  # escrita implícita anterior não entra na fila
+            try:
+                retries = self._begin(conn)
+            except sqlite3.Error:
+                with self._lock:
+                    stats["failures"] += 1
+                raise
+            waited = time.monotonic() - queued_at
+            with self._lock:
+                stats["transactions"] += 1
+                stats["busy_retries"] += retries
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+                self._active.add(id(conn))
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+            finally:
+                with self._lock:
+                    self._active.discard(id(conn))
+        finally:
+            queue.release()
+
+    def stats(self):
+        """Profundidade da fila e tempo de espera por banco (id do usuário, sem o caminho do arquivo)."""
+        with self._lock:
+            result = {}
+            for path, s in self._stats.items():
+                done = s["transactions"]
+                tenant = os.path.splitext(os.path.basename(path))[0].removeprefix("agenda_")
+                result[tenant] = {
+                    "waiting": s["waiting"],
+                    "max_waiting": s["max_waiting"],
+                    "transactions": done,
+                    "busy_retries": s["busy_retries"],
+                    "failures": s["failures"],
+                    "wait_avg_ms": round(s["wait_total"] / done * 1000, 2) if done else 0.0,
+                    "wait_max_ms": round(s["wait_max"] * 1000, 2),
+                }
+            return {"pid": self._pid, "tenants": result}
+
+write_coordinator = TenantWriteCoordinator(
+    retry_seconds=float(os.getenv("SQLITE_WRITE_RETRY_SECONDS", "15")),
+    busy_slice_ms=int(os.getenv("SQLITE_WRITE_BUSY_SLICE_MS", "50")),
+)
+
+@contextmanager
+def write_transaction(conn=None):
+    """Transação de escrita no banco do usuário logado, passando pela fila do banco.
+
+        with write_transaction() as conn:
+            conn.execute("INSERT ...")
+
+    Não chame `conn.commit()` dentro do bloco: o commit é feito na saída.
+    """
+    conn = conn or get_user_db()
+    with write_coordinator.transaction(g.user_db_path, conn):
+        yield conn
+
+def get_user_db(readonly=False, user_id=None):
+    """Empresta do pool a conexão com o banco individual do usuário logado.
+
+    Com `readonly=True` a conexão é aberta com `mode=ro`: use nas rotas GET que
+    só leem (relatórios, financeiro, downloads) para não disputar o lock de escrita.
+    `user_id` abre o banco de outro usuário sem sessão (ex.: feeds com token);
+    quem chama é responsável por ter validado o acesso.
+    """
+    if user_id is None:
+        if "user_id" not in session:
+            raise RuntimeError("Usuário não está logado — nenhuma base individual pode ser carregada.")
+        user_id = session["user_id"]
+
+    attr = "user_db_ro" if readonly else "user_db"
+    if attr not in g:
+        ensure_user_db_dir()
+        path = user_db_path(user_id)
+        if readonly:
+            _ensure_user_schema(path)
+            key = readonly_uri(path)
+            g.user_db_ro = user_db_pool.acquire(key, _open_user_db_readonly)
+            g.user_db_ro_key = key
+        else:
+            g.user_db = user_db_pool.acquire(path, _open_user_db)
+            g.user_db_path = path
 
-        cur = conn.cursor()
-        cur.execute("PRAGMA table_info(clients)")
-        client_columns = [row[1] for row in cur.fetchall()]
-        if "notes" not in client_columns:
-            cur.execute("ALTER TABLE clients ADD COLUMN notes TEXT")
-            conn.commit()
+    return g.get(attr)
 
-        cur.execute("PRAGMA table_info(schedules)")
-        schedule_columns = [row[1] for row in cur.fetchall()]
-        if "professional_id" not in schedule_columns:
-            cur.execute("ALTER TABLE schedules ADD COLUMN professional_id INTEGER")
-            conn.commit()
+def release_user_db():
+    """Devolve ao pool as conexões emprestadas por `get_user_db` (em vez de fechá-las)."""
+    conn = g.pop("user_db", None)
+    path = g.pop("user_db_path", None)
+    if conn is not None:
+        try:
+            checkpoint_wal(path, conn)
+        except sqlite3.Error:
+            pass  # o checkpoint é só manutenção; não derruba a requisição
+        user_db_pool.release(path, conn)
 
-    return g.user_db
+    conn = g.pop("user_db_ro", None)
+    key = g.pop("user_db_ro_key", None)
+    if conn is not None:
+        user_db_pool.release(key, conn)
 
 # ------------------ Fechamento das conexões ------------------
 
 def close_dbs(e=None):
-    """Fecha todos os bancos abertos no contexto do Flask."""
+    """Fecha o banco de login e devolve ao pool o banco individual."""
     auth = g.pop("auth_db", None)
     if auth:
         auth.close()
 
-    userdb = g.pop("user_db", None)
-    if userdb:
-        userdb.close()
+    release_user_db()
@@ -1,73 +1,442 @@
-from flask import Blueprint, redirect, url_for, session, send_file, flash
-from db import get_db
-from datetime import datetime
+# export.py
+# Exportação completa do banco individual: uma aba por tabela num XLSX
+# (openpyxl em modo write-only) ou um CSV por tabela dentro de um ZIP. A
+# exportação incremental (/export/changes) usa os mesmos formatos, só com o
+# que mudou desde a última exportação de cada consumidor.
+#
+# As linhas são lidas em blocos de EXPORT_FETCH_SIZE e escritas direto no
+# arquivo temporário da resposta, então a memória não cresce com o tamanho
+# do banco. Todas as tabelas saem da mesma transação de leitura (um retrato
+# consistente). O andamento vai para um JSON em user_dbs/exports/, lido por
+# /export/progress (funciona com vários workers).
+import csv
 import io
+import json
+import os
+import re
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+from flask import Blueprint, redirect, url_for, session, send_file, request, jsonify
+from db import USER_DB_DIR, get_user_db, release_user_db, write_transaction
+
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+except ImportError:  # sem openpyxl a exportação sai só em CSV/ZIP
+    Workbook = None
 
 export_bp = Blueprint('export', __name__, url_prefix='/export')
 
+EXPORT_FETCH_SIZE = 1000
+EXPORT_PROGRESS_DIR = os.path.join(USER_DB_DIR, "exports")
+PROGRESS_INTERVAL = 1.0      # segundos entre gravações do andamento
+
+# A exportação completa leva toda tabela do banco, menos as de controle
+# interno (EXPORT_EXCLUDED e as sqlite_*): tabela nova de migration sai
+# sozinha. EXPORT_TABLES dá o nome da aba / do CSV e a ordem das conhecidas;
+# as demais vão no fim, com o nome da própria tabela.
+EXPORT_TABLES = [
+    ("clients", "Clientes"),
+    ("professionals", "Profissionais"),
+    ("professional_hours", "Horarios"),
+    ("services", "Servicos"),
+    ("service_products", "Produtos por servico"),
+    ("inventory", "Estoque"),
+    ("schedules", "Agendamentos"),
+    ("schedule_products", "Produtos por agendamento"),
+    ("finance", "Financeiro"),
+    ("notas_fiscais", "Notas fiscais"),
+    ("stock_movements", "Movimentos de estoque"),
+    ("stock_alerts", "Alertas de estoque"),
+]
+
+# tabelas de controle (log de alterações, marcas e lotes dos consumidores) e derivadas
+# (finance_daily é refeita a partir de finance), fora da exportação completa
+EXPORT_EXCLUDED = {"change_log", "change_markers", "export_watermarks", "export_batches", "finance_daily"}
+
+# colunas que nunca saem na exportação
+EXPORT_HIDDEN_COLUMNS = {"professionals": {"ics_token"}}
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _progress_path(user_id):
+    return os.path.join(EXPORT_PROGRESS_DIR, f"progress_{user_id}.json")
+
+
+class ExportProgress:
+    """Andamento de uma exportação, gravado (no máximo a cada PROGRESS_INTERVAL) em JSON."""
+
+    def __init__(self, user_id, fmt, totals):
+        self.path = _progress_path(user_id)
+        self.state = {
+            "format": fmt,
+            "status": "running",
+            "started_at": int(time.time()),
+            "table": None,
+            "rows_done": 0,
+            "rows_total": sum(totals.values()),
+            "tables": totals,
+        }
+        self._written = 0.0
+        os.makedirs(EXPORT_PROGRESS_DIR, exist_ok=True)
+        self._write()
+
+    def _write(self):
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp, self.path)
+        self._written = time.monotonic()
+
+    def advance(self, table, rows):
+        self.state["table"] = table
+        self.state["rows_done"] += rows
+        if time.monotonic() - self._written >= PROGRESS_INTERVAL:
+            self._write()
+
+    def finish(self, error=None):
+        self.state["status"] = "error" if error else "done"
+        self.state["error"] = error
+        self.state["finished_at"] = int(time.time())
+        self._write()
+
+
+def _columns(conn, table):
+    """Colunas gravadas da tabela (PRAGMA table_info não lista as geradas)."""
+    hidden = EXPORT_HIDDEN_COLUMNS.get(table, set())
+    return [row["name"] for row in conn.execute(f"PRAGMA table_info({table})") if row["name"] not in hidden]
+
+
+def export_tables(conn):
+    """(tabela, título) de cada tabela exportada: as de EXPORT_TABLES primeiro, depois as novas."""
+    names = [row["name"] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' "
+        "ORDER BY rowid")]
+    names = [name for name in names if name not in EXPORT_EXCLUDED]
+    titles = dict(EXPORT_TABLES)
+    known = [(table, title) for table, title in EXPORT_TABLES if table in names]
+    # aba do XLSX tem no máximo 31 caracteres
+    return known + [(table, table.replace("_", " ").capitalize()[:31]) for table in names if table not in titles]
+
+
+def _fetch_blocks(cursor, table, progress, convert):
+    """Linhas do cursor em blocos de EXPORT_FETCH_SIZE, passadas por `convert` (None descarta)."""
+    while True:
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        block = [row for row in (convert(list(row)) for row in rows) if row is not None]
+        if block:
+            yield block
+        progress.advance(table, len(rows))
+
+
+def _date_fixer(columns):
+    """date_time com espaço no lugar do 'T', como no resto da aplicação."""
+    if "date_time" not in columns:
+        return lambda row: row
+    position = columns.index("date_time")
+
+    def convert(row):
+        if isinstance(row[position], str):
+            row[position] = row[position].replace('T', ' ')
+        return row
+    return convert
+
+
+def full_sections(conn, progress):
+    """(título, colunas, blocos) de cada tabela inteira."""
+    for table, title in export_tables(conn):
+        columns = _columns(conn, table)
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+        yield title, columns, _fetch_blocks(cursor, table, progress, _date_fixer(columns))
+
+
+def _xlsx_cell(sheet, value):
+    """Célula do write-only: texto sempre como texto (sem virar fórmula) e sem caracteres inválidos no XML."""
+    if isinstance(value, str):
+        cell = WriteOnlyCell(sheet, ILLEGAL_CHARACTERS_RE.sub("", value))
+        cell.data_type = "s"
+        return cell
+    return value
+
+
+def write_xlsx(sections, out):
+    workbook = Workbook(write_only=True)
+    for title, columns, blocks in sections:
+        sheet = workbook.create_sheet(title=title)
+        sheet.append(columns)
+        for block in blocks:
+            for row in block:
+                sheet.append([_xlsx_cell(sheet, value) for value in row])
+    workbook.save(out)
+
+
+def write_csv_zip(sections, out):
+    with zipfile.ZipFile(out, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for title, columns, blocks in sections:
+            with zf.open(f"{title.lower().replace(' ', '_')}.csv", mode='w', force_zip64=True) as member:
+                text = io.TextIOWrapper(member, encoding='utf-8-sig', newline='')
+                writer = csv.writer(text)
+                writer.writerow(columns)
+                for block in blocks:
+                    writer.writerows(block)
+                text.flush()
+                text.detach()
+
+
+def _export_format():
+    fmt = request.args.get('format') or ('xlsx' if Workbook is not None else 'csv')
+    return 'csv' if fmt == 'xlsx' and Workbook is None else fmt
+
+
+def _build_file(fmt, sections):
+    """Arquivo temporário (já no início) com as seções em XLSX ou CSV/ZIP."""
+    out = tempfile.TemporaryFile()
+    try:
+        if fmt == 'xlsx':
+            write_xlsx(sections, out)
+        else:
+            write_csv_zip(sections, out)
+    except Exception:
+        out.close()
+        raise
+    out.seek(0)
+    return out
+
+
+def _send(out, fmt, name):
+    if fmt == 'xlsx':
+        return send_file(out, download_name=f'{name}.xlsx', as_attachment=True, mimetype=XLSX_MIMETYPE)
+    return send_file(out, download_name=f'{name}.zip', as_attachment=True, mimetype='application/zip')
+
+
 @export_bp.route('/')
 def export_excel():
+    """Baixa o banco inteiro: ?format=xlsx (padrão, se houver openpyxl) ou ?format=csv (ZIP)."""
     if not session.get('user'):
         return redirect(url_for('auth.login'))
 
-    conn = get_db()
+    fmt = _export_format()
+    conn = get_user_db(readonly=True)
+    progress = None
     try:
-        import pandas as pd
-        clients_df = pd.read_sql_query('SELECT * FROM clients', conn)
-        schedules_df = pd.read_sql_query('''SELECT s.id, c.name as client_name, s.date_time, sv.name as service_name, sv.price, sv.cost, s.notes
-                                           FROM schedules s
-                                           LEFT JOIN clients c ON c.id = s.client_id
-                                           LEFT JOIN services sv ON sv.id = s.service_id''', conn)
-        if 'date_time' in schedules_df.columns:
-            schedules_df['date_time'] = schedules_df['date_time'].apply(lambda x: x.replace('T',' ') if isinstance(x, str) else x)
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            clients_df.to_excel(writer, index=False, sheet_name='Clientes')
-            schedules_df.to_excel(writer, index=False, sheet_name='Agendamentos')
-        output.seek(0)
-        filename = f'planilha_agenda_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        return send_file(output, download_name=filename, as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        conn.execute("BEGIN")  # todas as tabelas do mesmo retrato
+        totals = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table, _ in export_tables(conn)}
+        progress = ExportProgress(session['user_id'], fmt, totals)
+        out = _build_file(fmt, full_sections(conn, progress))
+        progress.finish()
+    except Exception as e:
+        if progress is not None:
+            progress.finish(error=str(e))
+        raise
+    finally:
+        conn.rollback()
+        release_user_db()
 
-    except Exception:
-        # Fallback CSV + ZIP
-        import csv
-        import zipfile
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM clients')
-        clients_rows = cur.fetchall()
-        clients_cols = [desc[0] for desc in cur.description]
-
-        cur.execute('''SELECT s.id, c.name as client_name, s.date_time, sv.name as service_name, sv.price, sv.cost, s.notes
-                       FROM schedules s
-                       LEFT JOIN clients c ON c.id = s.client_id
-                       LEFT JOIN services sv ON sv.id = s.service_id''')
-        sched_rows = cur.fetchall()
-        sched_cols = [desc[0] for desc in cur.description]
-
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
-            clients_io = io.StringIO()
-            writer = csv.writer(clients_io)
-            writer.writerow(clients_cols)
-            for r in clients_rows:
-                writer.writerow([r[col] for col in clients_cols])
-            zf.writestr('clientes.csv', clients_io.getvalue())
-
-            sched_io = io.StringIO()
-            writer = csv.writer(sched_io)
-            writer.writerow(sched_cols)
-            for r in sched_rows:
-                row = []
-                for col in sched_cols:
-                    val = r[col]
-                    if col == 'date_time' and isinstance(val, str):
-                        val = val.replace('T', ' ')
-                    row.append(val)
-                writer.writerow(row)
-            zf.writestr('agendamentos.csv', sched_io.getvalue())
-
-        zip_buffer.seek(0)
-        filename = f'planilha_agenda_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
-        return send_file(zip_buffer, download_name=filename, as_attachment=True, mimetype='application/zip')
+    return _send(out, fmt, f'planilha_agenda_{datetime.now().strftime("%Y%m%d_%H%M%S")}')
+
+
+# ==================== Exportação incremental ====================
+# Só o que mudou desde a última exportação de cada consumidor (contador,
+# integração...), lido do change_log pela faixa de versões: o custo acompanha
+# o movimento do período, não o tamanho do histórico. O change_log só guarda
+# a versão mais recente de cada linha, então o lote entregue (linha,
+# classificação e versão) fica em export_batches para o ?replay=1.
+
+INCREMENTAL_TABLES = [("finance", "Financeiro"), ("schedules", "Agendamentos"), ("clients", "Clientes")]
+CONSUMER_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,40}$")
+
+
+def _deleted(columns, row_id):
+    values = [None] * len(columns)
+    values[columns.index("id")] = row_id
+    return values
+
+
+def _change_converter(columns, since, table, batch):
+    """Linha do log + linha atual -> [change, version, colunas...] (None = omitir).
+
+    Cada linha que sai é anotada em `batch` como (tabela, id, change, version).
+    """
+    fix = _date_fixer(columns)
+
+    def convert(row):
+        version, op, created_version, row_id, values = row[0], row[1], row[2], row[3], row[4:]
+        # o consumidor já recebeu a linha (sem created_version: na dúvida, não)
+        seen = since and created_version is not None and created_version <= since
+        if op == "delete":
+            if not seen:
+                return None  # criada e excluída depois da marca: nada a informar
+            change, values = "delete", _deleted(columns, row_id)
+        else:
+            change, values = "update" if seen else "insert", fix(values)
+        batch.append((table, row_id, change, version))
+        return [change, version] + values
+    return convert
+
+
+def change_sections(conn, since, until, progress, batch):
+    """(título, colunas, blocos) das alterações em (since, until] de cada tabela incremental."""
+    for table, title in INCREMENTAL_TABLES:
+        columns = _columns(conn, table)
+        cursor = conn.execute(f"""
+            SELECT l.version, l.op, l.created_version, l.row_id, {", ".join("t." + c for c in columns)}
+            FROM change_log l
+            LEFT JOIN {table} t ON t.id = l.row_id
+            WHERE l.table_name = ? AND l.version > ? AND l.version <= ?
+            ORDER BY l.version
+        """, (table, since, until))
+        yield (title, ["change", "version"] + columns,
+               _fetch_blocks(cursor, table, progress, _change_converter(columns, since, table, batch)))
+
+
+def _replay_converter(columns):
+    """Linha do lote + linha atual -> [change, version, colunas...]; linha que sumiu sai como delete."""
+    fix = _date_fixer(columns)
+    id_position = columns.index("id")
+
+    def convert(row):
+        change, version, row_id, values = row[0], row[1], row[2], row[3:]
+        if change == "delete" or values[id_position] is None:
+            return ["delete", version] + _deleted(columns, row_id)
+        return [change, version] + fix(values)
+    return convert
+
+
+def replay_sections(conn, consumer, progress):
+    """(título, colunas, blocos) do último lote do consumidor, com os valores atuais das linhas."""
+    for table, title in INCREMENTAL_TABLES:
+        columns = _columns(conn, table)
+        cursor = conn.execute(f"""
+            SELECT b.change, b.version, b.row_id, {", ".join("t." + c for c in columns)}
+            FROM export_batches b
+            LEFT JOIN {table} t ON t.id = b.row_id
+            WHERE b.consumer = ? AND b.table_name = ?
+            ORDER BY b.version
+        """, (consumer, table))
+        yield title, ["change", "version"] + columns, _fetch_blocks(cursor, table, progress, _replay_converter(columns))
+
+
+@export_bp.route('/changes')
+def export_changes():
+    """Inserções, alterações e exclusões desde a marca do consumidor.
+
+    ?consumer=nome (padrão "padrao") e ?format=xlsx|csv. Cada aba/CSV traz
+    `change` (insert, update ou delete; exclusões só com o id) e a versão do
+    log. A marca avança quando o arquivo fica pronto; ?peek=1 gera o
+    arquivo sem mexer na marca. ?replay=1 repete o último lote: as mesmas
+    linhas, classificações e versões, com os valores atuais de cada linha
+    (a que foi excluída depois sai como delete).
+    """
+    if not session.get('user'):
+        return redirect(url_for('auth.login'))
+
+    consumer = request.args.get('consumer', 'padrao')
+    if not CONSUMER_NAME.match(consumer):
+        return jsonify({"error": "Nome de consumidor inválido."}), 400
+    fmt = _export_format()
+    replay = request.args.get('replay') == '1'
+    peek = request.args.get('peek') == '1'
+
+    try:
+        conn = get_user_db(readonly=True)
+        progress = None
+        try:
+            conn.execute("BEGIN")  # marca, versão atual e linhas do mesmo retrato
+            mark = conn.execute(
+                "SELECT version, previous_version FROM export_watermarks WHERE consumer = ?", (consumer,)
+            ).fetchone()
+            until = conn.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+            if mark is None:
+                since = 0
+            elif replay:
+                since, until = mark["previous_version"], mark["version"]
+            else:
+                since = mark["version"]
+            # lote gravado pela exportação que avançou a marca; sem ele (marca
+            # anterior à v15), o replay relê a faixa de versões
+            stored = replay and mark is not None and conn.execute(
+                "SELECT 1 FROM export_batches WHERE consumer = ? LIMIT 1", (consumer,)
+            ).fetchone() is not None
+            if stored:
+                count_sql = "SELECT COUNT(*) FROM export_batches WHERE table_name = ? AND consumer = ?"
+                count_args = (consumer,)
+            else:
+                count_sql = "SELECT COUNT(*) FROM change_log WHERE table_name = ? AND version > ? AND version <= ?"
+                count_args = (since, until)
+            totals = {table: conn.execute(count_sql, (table,) + count_args).fetchone()[0]
+                      for table, _ in INCREMENTAL_TABLES}
+            progress = ExportProgress(session['user_id'], f"changes-{fmt}", totals)
+            batch = []
+            if stored:
+                sections = replay_sections(conn, consumer, progress)
+            else:
+                sections = change_sections(conn, since, until, progress, batch)
+            out = _build_file(fmt, sections)
+            progress.finish()
+        except Exception as e:
+            if progress is not None:
+                progress.finish(error=str(e))
+            raise
+        finally:
+            conn.rollback()
+
+        if not (replay or peek) and until > since:
+            with write_transaction() as wconn:
+                advanced = wconn.execute(
+                    """
+                    INSERT INTO export_watermarks (consumer, version, previous_version, exported_at)
+                    VALUES (?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+                    ON CONFLICT(consumer) DO UPDATE SET
+                        previous_version = export_watermarks.version,
+                        version = excluded.version,
+                        exported_at = excluded.exported_at
+                    WHERE excluded.version > export_watermarks.version
+                    """,
+                    (consumer, until, since),
+                ).rowcount
+                if advanced:
+                    wconn.execute("DELETE FROM export_batches WHERE consumer = ?", (consumer,))
+                    wconn.executemany(
+                        "INSERT INTO export_batches (consumer, table_name, row_id, change, version) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(consumer,) + entry for entry in batch],
+                    )
     finally:
-        conn.close()
+        release_user_db()
+
+    response = _send(out, fmt, f'alteracoes_{consumer}_{since}-{until}')
+    response.headers['X-Export-Since'] = str(since)
+    response.headers['X-Export-Version'] = str(until)
+    return response
+
+
+@export_bp.route('/watermarks')
+def export_watermarks():
+    """Marca de cada consumidor da exportação incremental."""
+    if not session.get('user_id'):
+        return jsonify({"error": "Usuário não está logado."}), 401
+    conn = get_user_db(readonly=True)
+    marks = [dict(row) for row in conn.execute(
+        "SELECT consumer, version, previous_version, exported_at FROM export_watermarks ORDER BY consumer")]
+    release_user_db()
+    return jsonify(marks)
+
+
+@export_bp.route('/progress')
+def export_progress():
+    """Andamento da última exportação do usuário ({} se nunca exportou)."""
+    if not session.get('user_id'):
+        return jsonify({"error": "Usuário não está logado."}), 401
+    try:
+        with open(_progress_path(session['user_id']), encoding="utf-8") as fh:
+            return jsonify(json.load(fh))
+    except (OSError, ValueError):
+        return jsonify({})
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session
-from db import get_user_db
+from db import get_user_db, release_user_db
+from date_windows import parse_day, day_window, week_window, range_window
 
 finance_bp = Blueprint("finance", __name__, url_prefix="/finance")
 
@@ -8,7 +9,7 @@ def finance():
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
 
-    conn = get_user_db()
+    conn = get_user_db(readonly=True)
     cur = conn.cursor()
 
     # Receber filtros de data, se houver
@@ -16,14 +17,20 @@ def finance():
     end_date = request.args.get("end_date")
 
     date_filter = ""
+    rollup_filter = ""
     params = []
 
-    if start_date:
-        date_filter += " AND date(f.date) >= date(?)"
-        params.append(start_date)
-    if end_date:
-        date_filter += " AND date(f.date) <= date(?)"
-        params.append(end_date)
+    # intervalo semiaberto [início, fim + 1 dia) sobre a coluna indexada f.day
+    # (e sobre r.day no rollup, que tem o mesmo formato)
+    lower, upper = range_window(parse_day(start_date), parse_day(end_date))
+    if lower:
+        date_filter += " AND f.day >= ?"
+        rollup_filter += " AND r.day >= ?"
+        params.append(lower)
+    if upper:
+        date_filter += " AND f.day < ?"
+        rollup_filter += " AND r.day < ?"
+        params.append(upper)
 
     # Lista de entradas (serviços) filtrada por data, se houver
     rows = cur.execute(
@@ -36,52 +43,57 @@ def finance():
         params
     ).fetchall()
 
+    # Os resumos leem o rollup diário (finance_daily), mantido por triggers,
+    # em vez de agregar o livro inteiro a cada visita
+
     # Resumo para o período filtrado
     filtered_summary = None
     filtered_by_professional = None
     if start_date or end_date:
         filtered_summary = cur.execute(
-            "SELECT COUNT(*) as total_services, COALESCE(SUM(amount),0) as total_price "
-            "FROM finance f WHERE f.type='entrada'" + date_filter,
+            "SELECT COALESCE(SUM(r.entries),0) as total_services, COALESCE(SUM(r.amount),0) as total_price "
+            "FROM finance_daily r WHERE r.type='entrada'" + rollup_filter,
             params
         ).fetchone()
         filtered_by_professional = cur.execute(
-            "SELECT p.name, COUNT(f.id) as total_services, COALESCE(SUM(f.amount), 0) as total_price "
-            "FROM finance f "
-            "LEFT JOIN professionals p ON p.id = f.professional_id "
-            "WHERE f.type='entrada' " + date_filter +
+            "SELECT p.name, SUM(r.entries) as total_services, COALESCE(SUM(r.amount), 0) as total_price "
+            "FROM finance_daily r "
+            "LEFT JOIN professionals p ON p.id = r.professional_id "
+            "WHERE r.type='entrada' " + rollup_filter +
             " GROUP BY p.id, p.name ORDER BY total_price DESC",
             params
         ).fetchall()
 
     # Totais gerais
     total_summary = cur.execute(
-        "SELECT COUNT(*) as total_services, COALESCE(SUM(amount),0) as total_price "
-        "FROM finance f WHERE f.type='entrada'",
+        "SELECT COALESCE(SUM(r.entries),0) as total_services, COALESCE(SUM(r.amount),0) as total_price "
+        "FROM finance_daily r WHERE r.type='entrada'",
     ).fetchone()
 
     # Resumo geral por profissional
     summary_by_professional = cur.execute(
-        "SELECT p.name, COUNT(f.id) as total_services, COALESCE(SUM(f.amount), 0) as total_price "
-        "FROM finance f "
-        "LEFT JOIN professionals p ON p.id = f.professional_id "
-        "WHERE f.type='entrada' "
+        "SELECT p.name, SUM(r.entries) as total_services, COALESCE(SUM(r.amount), 0) as total_price "
+        "FROM finance_daily r "
+        "LEFT JOIN professionals p ON p.id = r.professional_id "
+        "WHERE r.type='entrada' "
         "GROUP BY p.id, p.name ORDER BY total_price DESC",
     ).fetchall()
 
     # Hoje
     daily_summary = cur.execute(
-        "SELECT COUNT(*) as total_services, COALESCE(SUM(amount),0) as total_price "
-        "FROM finance f WHERE f.type='entrada' AND date(f.date)=date('now')"
+        "SELECT COALESCE(SUM(r.entries),0) as total_services, COALESCE(SUM(r.amount),0) as total_price "
+        "FROM finance_daily r WHERE r.type='entrada' AND r.day >= ? AND r.day < ?",
+        day_window()
     ).fetchone()
 
-    # Esta semana
+    # Esta semana (segunda a domingo do ano corrente)
     weekly_summary = cur.execute(
-        "SELECT COUNT(*) as total_services, COALESCE(SUM(amount),0) as total_price "
-        "FROM finance f WHERE f.type='entrada' AND strftime('%W', f.date)=strftime('%W', 'now')"
+        "SELECT COALESCE(SUM(r.entries),0) as total_services, COALESCE(SUM(r.amount),0) as total_price "
+        "FROM finance_daily r WHERE r.type='entrada' AND r.day >= ? AND r.day < ?",
+        week_window()
     ).fetchone()
 
-    conn.close()
+    release_user_db()
 
     return render_template(
         "finance.html",
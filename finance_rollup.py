@@ -0,0 +1,62 @@
+# finance_rollup.py
+# Manutenção do rollup diário do financeiro (`finance_daily`) nos bancos individuais.
+#
+#   python finance_rollup.py check [user_id ...]     compara rollup x livro
+#   python finance_rollup.py rebuild [user_id ...]   recalcula o rollup
+#
+# Sem user_id, percorre todos os bancos em user_dbs/. `check` sai com 1 se
+# algum banco estiver divergente.
+import glob
+import os
+import sys
+
+from db import (USER_DB_DIR, user_db_path, _open_user_db,
+                rebuild_finance_rollup, check_finance_rollup)
+
+
+def tenant_paths(user_ids):
+    if user_ids:
+        return [user_db_path(uid) for uid in user_ids]
+    return sorted(glob.glob(os.path.join(USER_DB_DIR, "agenda_*.db")))
+
+
+def main(argv):
+    if not argv or argv[0] not in ("check", "rebuild"):
+        print("uso: python finance_rollup.py check|rebuild [user_id ...]")
+        return 2
+    command, user_ids = argv[0], argv[1:]
+
+    failures = 0
+    for path in tenant_paths(user_ids):
+        name = os.path.basename(path)
+        if not os.path.exists(path):
+            print(f"{name}: não encontrado")
+            failures += 1
+            continue
+        # abrir migra o banco, se preciso (a migração já monta o rollup)
+        conn = _open_user_db(path)
+        try:
+            if command == "rebuild":
+                conn.execute("BEGIN IMMEDIATE")
+                rebuild_finance_rollup(conn)
+                conn.commit()
+                groups = conn.execute("SELECT COUNT(*) FROM finance_daily").fetchone()[0]
+                print(f"{name}: rollup recalculado ({groups} grupos)")
+            else:
+                problems = check_finance_rollup(conn)
+                if problems:
+                    failures += 1
+                    print(f"{name}: {len(problems)} grupo(s) divergente(s)")
+                    for type_, day, professional_id, service_id, expected, found in problems[:20]:
+                        print(f"      {type_} {day} prof={professional_id} serv={service_id}: "
+                              f"livro={expected} rollup={found}")
+                else:
+                    print(f"{name}: ok")
+        finally:
+            conn.close()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
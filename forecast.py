@@ -0,0 +1,123 @@
+# forecast.py
+# Previsão de esgotamento do estoque: quando o saldo de cada produto chega ao
+# mínimo, combinando os agendamentos já marcados (agendamentos por serviço e
+# dia × consumo por serviço, em NumPy) com o ritmo de consumo recente.
+#
+# O consumo de um agendamento já sai de `inventory.quantity` quando ele é
+# criado (stock.consume), então o saldo físico de hoje é a quantidade mais o
+# que está reservado para os agendamentos de hoje em diante.
+from datetime import date, timedelta
+
+import numpy as np
+
+FORECAST_DAYS = 60     # horizonte da projeção
+TRAILING_DAYS = 28     # janela do ritmo de consumo recente
+
+
+def _index(ids):
+    """ids ordenados e únicos e a função que converte ids em posições."""
+    unique = np.unique(np.asarray(ids, dtype=np.int64))
+    return unique, lambda values: np.searchsorted(unique, np.asarray(values, dtype=np.int64))
+
+
+def _booked_usage(conn, products, start, horizon):
+    """Consumo previsto [dia × produto] dos agendamentos marcados em [start, start + horizon)."""
+    end = start + timedelta(days=horizon)
+    bookings = conn.execute(
+        """
+        SELECT service_id, day, COUNT(*)
+        FROM schedules
+        WHERE day >= ? AND day < ? AND service_id IS NOT NULL
+        GROUP BY service_id, day
+        """,
+        (start.isoformat(), end.isoformat()),
+    ).fetchall()
+    usage = [row for row in conn.execute(
+        "SELECT service_id, product_id, SUM(quantity_used) FROM service_products GROUP BY service_id, product_id"
+    ) if row[2]]
+    result = np.zeros((horizon, len(products)))
+    if not bookings or not usage:
+        return result
+
+    services, service_pos = _index([row[0] for row in usage])
+    booked_service = np.array([row[0] for row in bookings], dtype=np.int64)
+    known = np.isin(booked_service, services)
+    if not known.any():
+        return result
+    day_offset = np.array([(date.fromisoformat(row[1]) - start).days for row in bookings])[known]
+    counts = np.zeros((horizon, len(services)))
+    np.add.at(counts, (day_offset, service_pos(booked_service[known])),
+              np.array([row[2] for row in bookings], dtype=float)[known])
+
+    usage_product = np.array([row[1] for row in usage], dtype=np.int64)
+    in_stock = np.isin(usage_product, products)
+    per_service = np.zeros((len(services), len(products)))
+    np.add.at(per_service,
+              (service_pos([row[0] for row in usage])[in_stock],
+               np.searchsorted(products, usage_product[in_stock])),
+              np.array([row[2] for row in usage], dtype=float)[in_stock])
+    return counts @ per_service
+
+
+def _recorded_usage(conn, products, start, trailing):
+    """(ritmo diário recente, reservado de `start` em diante) por produto, de schedule_products."""
+    rows = conn.execute(
+        """
+        SELECT sp.product_id,
+               SUM(CASE WHEN s.day < ? THEN sp.quantity_used ELSE 0 END),
+               SUM(CASE WHEN s.day >= ? THEN sp.quantity_used ELSE 0 END)
+        FROM schedules s
+        JOIN schedule_products sp ON sp.schedule_id = s.id
+        WHERE s.day >= ?
+        GROUP BY sp.product_id
+        """,
+        (start.isoformat(), start.isoformat(), (start - timedelta(days=trailing)).isoformat()),
+    ).fetchall()
+    rate = np.zeros(len(products))
+    reserved = np.zeros(len(products))
+    rows = [row for row in rows if row[0] is not None]
+    if rows:
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        keep = np.isin(ids, products)
+        pos = np.searchsorted(products, ids[keep])
+        rate[pos] = np.array([row[1] or 0 for row in rows], dtype=float)[keep] / trailing
+        reserved[pos] = np.array([row[2] or 0 for row in rows], dtype=float)[keep]
+    return rate, reserved
+
+
+def depletion_forecast(conn, today=None, horizon=FORECAST_DAYS, trailing=TRAILING_DAYS):
+    """{product_id: previsão} com a data em que o saldo chega a `min_stock`.
+
+    O consumo de cada dia é o maior entre o dos agendamentos marcados e o
+    ritmo médio dos últimos `trailing` dias (dias ainda pouco agendados
+    seguem o ritmo de costume). Cada previsão traz `on_hand` (saldo físico
+    hoje), `booked` (consumo marcado no horizonte), `daily_rate` e
+    `reorder_date` ('YYYY-MM-DD'; hoje se já está no mínimo, None se não
+    chega lá em `horizon` dias).
+    """
+    today = today or date.today()
+    rows = conn.execute("SELECT id, quantity, min_stock FROM inventory ORDER BY id").fetchall()
+    if not rows:
+        return {}
+    products = np.array([row[0] for row in rows], dtype=np.int64)
+    quantity = np.array([row[1] or 0 for row in rows], dtype=float)
+    min_stock = np.array([row[2] or 0 for row in rows], dtype=float)
+
+    booked = _booked_usage(conn, products, today, horizon)
+    rate, reserved = _recorded_usage(conn, products, today, trailing)
+    on_hand = quantity + reserved
+
+    # saldo ao fim de cada dia; a linha 0 é o saldo de hoje antes do consumo
+    daily = np.maximum(booked, rate)
+    projected = on_hand - np.vstack([np.zeros(len(products)), np.cumsum(daily, axis=0)])
+    reached = projected <= min_stock
+    first = np.where(reached.any(axis=0), reached.argmax(axis=0), -1)
+
+    reorder_dates = [(today + timedelta(days=max(k - 1, 0))).isoformat() if k >= 0 else None
+                     for k in first.tolist()]
+    return {
+        product_id: {"on_hand": stock, "booked": booked_total, "daily_rate": daily_rate, "reorder_date": reorder_date}
+        for product_id, stock, booked_total, daily_rate, reorder_date in zip(
+            products.tolist(), on_hand.round(3).tolist(), booked.sum(axis=0).round(3).tolist(),
+            rate.round(3).tolist(), reorder_dates)
+    }
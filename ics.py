@@ -0,0 +1,91 @@
+# ics.py
+# Geração de feeds iCalendar (RFC 5545) com a agenda de um profissional.
+#
+# Os horários saem como "hora local flutuante" (sem fuso), do mesmo jeito que
+# ficam gravados em schedules.date_time.
+from datetime import datetime, timedelta, timezone
+
+ICS_PAST_DAYS = 30       # o feed mostra de hoje - N ...
+ICS_FUTURE_DAYS = 180    # ... até hoje + N dias
+
+# marcadores de change_markers cujas alterações mudam o conteúdo do feed
+FEED_MARKERS = ("schedules", "services", "clients", "professionals")
+
+
+def feed_marker(conn):
+    """(soma das versões, último changed_at) dos marcadores do feed.
+
+    Só lê `change_markers` (busca pela chave primária), nunca as tabelas da agenda.
+    """
+    placeholders = ",".join("?" * len(FEED_MARKERS))
+    version, changed_at = conn.execute(
+        f"SELECT COALESCE(SUM(version), 0), COALESCE(MAX(changed_at), 0) "
+        f"FROM change_markers WHERE name IN ({placeholders})",
+        FEED_MARKERS,
+    ).fetchone()
+    return version, changed_at
+
+
+def escape_text(value):
+    """Escapa um valor TEXT: barra invertida, ponto e vírgula, vírgula e quebras de linha."""
+    return (str(value or "")
+            .replace("\\", "\\\\")
+            .replace(";", "\\;")
+            .replace(",", "\\,")
+            .replace("\r\n", "\\n")
+            .replace("\n", "\\n"))
+
+
+def fold(line):
+    """Quebra a linha em blocos de até 75 octetos (continuação começa com espaço)."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # não corta no meio de um caractere UTF-8
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+        limit = 74  # o espaço inicial da continuação conta
+    return "\r\n ".join(parts)
+
+
+def _stamp(value):
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def build_calendar(name, uid_domain, rows, now=None):
+    """Texto do VCALENDAR com um VEVENT por linha de `rows`.
+
+    Cada linha precisa de id, date_time, duration, service_name, client_name e notes.
+    """
+    dtstamp = (now or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Agenda//Agenda Profissional//PT-BR",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{escape_text(name)}",
+    ]
+    for row in rows:
+        start = datetime.fromisoformat(row["date_time"].replace("T", " "))
+        end = start + timedelta(minutes=max(int(row["duration"] or 0), 1))
+        summary = f"{row['service_name'] or 'Atendimento'} - {row['client_name'] or ''}".rstrip(" -")
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:schedule-{row['id']}@{uid_domain}",
+            f"DTSTAMP:{dtstamp}",
+            f"DTSTART:{_stamp(start)}",
+            f"DTEND:{_stamp(end)}",
+            f"SUMMARY:{escape_text(summary)}",
+        ]
+        if row["notes"]:
+            lines.append(f"DESCRIPTION:{escape_text(row['notes'])}")
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(fold(line) for line in lines) + "\r\n"
@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 import os
-from db import get_user_db
+import time
+from db import get_user_db, release_user_db, write_transaction
+import stock
+import forecast
+import inventory_import
 
 inventory_bp = Blueprint("inventory", __name__, url_prefix="/inventory")
 
@@ -12,23 +16,26 @@ def inventory():
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
 
-    conn = get_user_db()
+    # saldo e consumo acumulado já vêm materializados pelo livro de estoque
+    conn = get_user_db(readonly=True)
     rows = conn.execute("SELECT * FROM inventory ORDER BY id").fetchall()
     items = [dict(row) for row in rows]
 
-    for i, item in enumerate(items):
-        total_used = conn.execute(
-            "SELECT COALESCE(SUM(quantity_used),0) as total FROM schedule_products WHERE product_id=?",
-            (item["id"],)
-        ).fetchone()["total"]
-        item["total_used"] = total_used
+    for item in items:
         if item.get("usage_per_service", 0) > 0:
             item["usage_per_service_clients"] = int(item["quantity"] // item["usage_per_service"])
         else:
             item["usage_per_service_clients"] = 0
 
-    conn.close()
-    return render_template("inventory.html", items=items)
+    # "estoque baixo" = alerta aberto (mantido pelos triggers), não um corte fixo
+    low_stock_ids = {alert["product_id"] for alert in stock.open_alerts(conn)}
+    forecasts = forecast.depletion_forecast(conn)
+    release_user_db()
+    for item in items:
+        item["forecast"] = forecasts.get(item["id"])
+        reorder_date = item["forecast"] and item["forecast"]["reorder_date"]
+        item["reorder_on"] = "/".join(reversed(reorder_date.split("-"))) if reorder_date else None
+    return render_template("inventory.html", items=items, low_stock_ids=low_stock_ids)
 
 # ==================== Adicionar produto ====================
 @inventory_bp.route("/add", methods=["GET", "POST"])
@@ -46,15 +53,17 @@ def add_item():
 
         conn = get_user_db()
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO inventory (name, category, quantity, unit_price, usage_per_service, min_stock)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (name, category, quantity, unit_price, usage_per_service, min_stock)
-        )
-        conn.commit()
-        conn.close()
+        with write_transaction(conn):
+            # o saldo inicial entra pelo livro (movimentação de abertura)
+            cur.execute(
+                """
+                INSERT INTO inventory (name, category, quantity, unit_price, usage_per_service, min_stock)
+                VALUES (?, ?, 0, ?, ?, ?)
+                """,
+                (name, category, unit_price, usage_per_service, min_stock)
+            )
+            stock.record(conn, [(cur.lastrowid, "opening", quantity, None, "cadastro do produto")])
+        release_user_db()
         flash("Produto adicionado.", "success")
         return redirect(url_for("inventory.inventory"))
 
@@ -75,21 +84,23 @@ def edit_item(item_id):
         usage_per_service = float(request.form.get("usage_per_service") or 0)
         min_stock = int(request.form.get("min_stock") or 0)
 
-        conn.execute(
-            """
-            UPDATE inventory
-            SET name=?, category=?, quantity=?, unit_price=?, usage_per_service=?, min_stock=?
-            WHERE id=?
-            """,
-            (name, category, quantity, unit_price, usage_per_service, min_stock, item_id)
-        )
-        conn.commit()
-        conn.close()
+        with write_transaction(conn):
+            conn.execute(
+                """
+                UPDATE inventory
+                SET name=?, category=?, unit_price=?, usage_per_service=?, min_stock=?
+                WHERE id=?
+                """,
+                (name, category, unit_price, usage_per_service, min_stock, item_id)
+            )
+            # quantidade digitada = contagem do estoque: a diferença vira ajuste
+            stock.adjust(conn, item_id, quantity, "edição do produto")
+        release_user_db()
         flash("Produto atualizado.", "success")
         return redirect(url_for("inventory.inventory"))
 
     item = conn.execute("SELECT * FROM inventory WHERE id=?", (item_id,)).fetchone()
-    conn.close()
+    release_user_db()
     if not item:
         flash("Item não encontrado.", "error")
         return redirect(url_for("inventory.inventory"))
@@ -102,44 +113,136 @@ def delete_item(item_id):
         return redirect(url_for("auth.login"))
 
     conn = get_user_db()
-    conn.execute("DELETE FROM inventory WHERE id=?", (item_id,))
-    conn.commit()
-    conn.close()
-    flash("Produto excluído.", "success")
+    with write_transaction(conn):
+        # o saldo zera pelo livro antes de o produto sair (o histórico continua)
+        removed = stock.remove_product(conn, item_id)
+    release_user_db()
+    if not removed:
+        flash("Item não encontrado.", "error")
+    else:
+        flash("Produto excluído.", "success")
     return redirect(url_for("inventory.inventory"))
 
-# ==================== Upload Excel ====================
+# ==================== Reposição ====================
+@inventory_bp.route("/restock/<int:item_id>", methods=["POST"])
+def restock_item(item_id):
+    if not session.get("user_id"):
+        return redirect(url_for("auth.login"))
+
+    quantity = float(request.form.get("quantity") or 0)
+    if quantity <= 0:
+        flash("Informe a quantidade recebida.", "error")
+        return redirect(url_for("inventory.inventory"))
+
+    conn = get_user_db()
+    with write_transaction(conn):
+        found = conn.execute("SELECT id FROM inventory WHERE id=?", (item_id,)).fetchone()
+        if found:
+            stock.record(conn, [(item_id, "restock", quantity, None, request.form.get("note") or None)])
+    release_user_db()
+    if not found:
+        flash("Item não encontrado.", "error")
+    else:
+        flash("Reposição registrada.", "success")
+    return redirect(url_for("inventory.inventory"))
+
+# ==================== Livro de movimentações ====================
+@inventory_bp.route("/<int:item_id>/movements")
+def item_movements(item_id):
+    """Últimas movimentações do produto (JSON)."""
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    conn = get_user_db(readonly=True)
+    result = stock.movements(conn, item_id, limit=min(request.args.get("limit", 100, type=int), 1000))
+    release_user_db()
+    return jsonify(result)
+
+@inventory_bp.route("/audit")
+def audit():
+    """Confere saldo e consumo acumulado de cada produto contra o livro (JSON)."""
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    conn = get_user_db(readonly=True)
+    problems = stock.audit(conn)
+    release_user_db()
+    return jsonify({"ok": not problems, "problems": problems})
+
+# ==================== Alertas de estoque baixo ====================
+@inventory_bp.route("/alerts")
+def alerts():
+    """Alertas abertos (JSON); `?history=N` inclui os N últimos já resolvidos."""
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    conn = get_user_db(readonly=True)
+    result = {"count": stock.alert_count(conn), "alerts": stock.open_alerts(conn)}
+    history = request.args.get("history", 0, type=int)
+    if history > 0:
+        result["resolved"] = stock.resolved_alerts(conn, limit=min(history, 500))
+    release_user_db()
+    return jsonify(result)
+
+# ==================== Previsão de esgotamento ====================
+@inventory_bp.route("/forecast")
+def depletion_forecast():
+    """Data prevista em que cada produto chega ao estoque mínimo (JSON)."""
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    conn = get_user_db(readonly=True)
+    result = forecast.depletion_forecast(conn)
+    release_user_db()
+    return jsonify({"horizon_days": forecast.FORECAST_DAYS, "products": result})
+
+# ==================== Importar planilha ====================
 @inventory_bp.route("/upload_excel", methods=["POST"])
 def upload_excel():
+    """Importa produtos de um CSV ou XLSX, atualizando pelo nome os que já existem.
+
+    Com ?format=json responde o relatório em JSON; senão, sem erros volta ao
+    estoque e com erros mostra o relatório por linha.
+    """
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
+    as_json = request.args.get("format") == "json"
 
     file = request.files.get("file")
-    if not file:
+    if not file or not file.filename:
+        if as_json:
+            return jsonify({"error": "Nenhum arquivo selecionado."}), 400
         flash("Nenhum arquivo selecionado.", "error")
         return redirect(url_for("inventory.inventory"))
 
-    import pandas as pd
+    started = time.monotonic()
     try:
-        df = pd.read_excel(file)
-        conn = get_user_db()
-        cur = conn.cursor()
-        for _, row in df.iterrows():
-            cur.execute(
-                "INSERT INTO inventory (name, category, quantity, unit_price, usage_per_service, min_stock) VALUES (?, ?, ?, ?, ?, ?)",
-                (
-                    row.get("name", ""),
-                    row.get("category", ""),
-                    row.get("quantity", 0),
-                    row.get("unit_price", 0),
-                    row.get("usage_per_service", 0),
-                    row.get("min_stock", 0),
-                )
-            )
-        conn.commit()
-        conn.close()
-        flash("Produtos importados com sucesso.", "success")
-    except Exception as e:
-        flash(f"Erro ao processar o arquivo: {e}", "error")
+        valid, errors = inventory_import.validate(inventory_import.read_sheet(file, file.filename))
+    except inventory_import.ImportFileError as e:
+        if as_json:
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("inventory.inventory"))
 
-    return redirect(url_for("inventory.inventory"))
+    conn = get_user_db()
+    with write_transaction(conn):
+        created, updated = inventory_import.upsert(conn, valid)
+    release_user_db()
+
+    report = {
+        "filename": file.filename,
+        "rows": len(valid) + len({e["row"] for e in errors}),
+        "created": created,
+        "updated": updated,
+        "rejected": len({e["row"] for e in errors}),
+        "error_count": len(errors),
+        "errors": errors[:inventory_import.MAX_REPORTED_ERRORS],
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    if as_json:
+        return jsonify(report)
+    flash(f"Importação: {created} produto(s) criado(s), {updated} atualizado(s), "
+          f"{report['rejected']} linha(s) recusada(s).", "success" if not errors else "error")
+    if not errors:
+        return redirect(url_for("inventory.inventory"))
+    return render_template("inventory_import.html", report=report)
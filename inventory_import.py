@@ -0,0 +1,190 @@
+# inventory_import.py
+# Importação em lote do estoque (CSV ou XLSX): lê a planilha inteira como
+# texto, valida e converte as colunas de forma vetorizada no pandas e grava
+# numa transação (atualizações em blocos de executemany), atualizando pelo
+# nome os produtos que já existem. Linhas inválidas não entram e voltam no relatório
+# com o número da linha na planilha.
+import os
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import stock
+
+IMPORT_CHUNK = 1000          # linhas por executemany
+MAX_REPORTED_ERRORS = 500    # o relatório lista no máximo N erros (o total vem à parte)
+CATEGORIES = ("uso", "venda")
+
+# cabeçalhos aceitos (já normalizados: minúsculas, sem acento, "_" no lugar de espaço)
+COLUMN_ALIASES = {
+    "name": ("name", "nome", "produto", "descricao"),
+    "category": ("category", "categoria", "tipo"),
+    "quantity": ("quantity", "quantidade", "qtd", "estoque"),
+    "unit_price": ("unit_price", "preco", "preco_unitario", "valor", "valor_unitario"),
+    "usage_per_service": ("usage_per_service", "uso_por_servico", "qtd_por_servico"),
+    "min_stock": ("min_stock", "estoque_minimo", "minimo"),
+}
+NUMERIC_COLUMNS = ("quantity", "unit_price", "usage_per_service", "min_stock")
+DEFAULTS = {"category": "uso", "quantity": 0.0, "unit_price": 0.0, "usage_per_service": 0.0, "min_stock": 0}
+
+
+class ImportFileError(ValueError):
+    """Arquivo que não dá para ler como planilha (formato, cabeçalho)."""
+
+
+def _normalize_header(value):
+    text = unicodedata.normalize("NFKD", str(value)).encode("ascii", "ignore").decode()
+    return "_".join(text.strip().lower().replace(".", " ").split())
+
+
+def read_sheet(file, filename):
+    """DataFrame só de texto (dtype=str) com as colunas renomeadas para as do banco."""
+    ext = os.path.splitext(filename or "")[1].lower()
+    try:
+        if ext in (".xlsx", ".xlsm", ".xls"):
+            df = pd.read_excel(file, dtype=str)
+        elif ext in (".csv", ".txt"):
+            # separador detectado (',' ou ';', comum em planilhas brasileiras)
+            df = pd.read_csv(file, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+        else:
+            raise ImportFileError("Envie um arquivo .csv ou .xlsx.")
+    except ImportFileError:
+        raise
+    except Exception as e:
+        raise ImportFileError(f"Não foi possível ler o arquivo: {e}") from e
+
+    lookup = {alias: column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+    renamed = {}
+    for header in df.columns:
+        column = lookup.get(_normalize_header(header))
+        if column and column not in renamed.values():
+            renamed[header] = column
+    df = df[list(renamed)].rename(columns=renamed)
+    if "name" not in df.columns:
+        raise ImportFileError("A planilha precisa de uma coluna 'name' (ou 'nome').")
+    return df
+
+
+def _to_number(values):
+    """Texto -> float, aceitando '1.234,56' e '1234.56'; inválido vira NaN."""
+    text = values.str.strip().str.replace(r"^R\$\s*", "", regex=True)
+    brazilian = text.str.contains(",", regex=False, na=False)
+    text = text.where(~brazilian, text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(text, errors="coerce")
+
+
+def validate(df):
+    """(linhas válidas, erros) da planilha lida por `read_sheet`.
+
+    As linhas válidas vêm com as colunas já convertidas e `row` (linha na
+    planilha, contando o cabeçalho); cada erro é {row, column, value, error}.
+    """
+    df = df.copy()
+    df["row"] = np.arange(len(df)) + 2
+    present = [c for c in COLUMN_ALIASES if c in df.columns]
+    errors = []
+
+    def reject(mask, column, message):
+        for row, value in zip(df.loc[mask, "row"], df.loc[mask, column] if column in df else [None] * mask.sum()):
+            errors.append({"row": int(row), "column": column, "value": None if pd.isna(value) else value,
+                           "error": message})
+
+    df["name"] = df["name"].fillna("").str.strip()
+    unnamed = df["name"].eq("")
+    reject(unnamed, "name", "nome vazio")
+    rejected = unnamed.copy()
+
+    if "category" in df:
+        category = df["category"].fillna("").str.strip().str.lower()
+        invalid = ~category.isin(CATEGORIES + ("",))
+        reject(invalid & ~unnamed, "category", f"categoria deve ser {' ou '.join(CATEGORIES)}")
+        df["category"] = category.where(category != "", np.nan)  # vazio = manter / padrão
+        rejected |= invalid
+
+    for column in NUMERIC_COLUMNS:
+        if column not in df:
+            continue
+        filled = df[column].notna() & df[column].str.strip().ne("")
+        numbers = _to_number(df[column].fillna(""))
+        bad = filled & numbers.isna()
+        negative = numbers < 0
+        reject(bad & ~unnamed, column, "não é um número")
+        reject(negative & ~unnamed, column, "não pode ser negativo")
+        if column == "min_stock":
+            fraction = numbers.notna() & (numbers % 1 != 0)
+            reject(fraction & ~unnamed & ~negative, column, "deve ser um número inteiro")
+            bad |= fraction
+        df[column] = numbers.where(filled)  # vazio = manter o valor atual / usar o padrão
+        rejected |= bad | negative
+
+    # mesmo produto repetido na planilha: vale a última linha
+    # (só entre as linhas aceitas: uma repetição rejeitada não derruba a válida)
+    key = df["name"].str.casefold()
+    repeated = key[~rejected].duplicated(keep="last").reindex(df.index, fill_value=False)
+    if repeated.any():
+        last_row = df.loc[~rejected].groupby(key[~rejected])["row"].last()
+        for row, name, value in zip(df.loc[repeated, "row"], key[repeated], df.loc[repeated, "name"]):
+            errors.append({"row": int(row), "column": "name", "value": value,
+                           "error": f"produto repetido na planilha (vale a linha {int(last_row[name])})"})
+    valid = df.loc[~rejected & ~repeated, ["row"] + present]
+    errors.sort(key=lambda e: (e["row"], e["column"]))
+    return valid, errors
+
+
+def _value(row, column, default=None):
+    value = row.get(column)
+    return default if value is None or (isinstance(value, float) and np.isnan(value)) else value
+
+
+def _chunks(items):
+    for i in range(0, len(items), IMPORT_CHUNK):
+        yield items[i:i + IMPORT_CHUNK]
+
+
+def upsert(conn, valid):
+    """Grava as linhas válidas; quem chama abre a transação. Retorna (criados, atualizados).
+
+    O produto é encontrado pelo nome (sem diferenciar maiúsculas); com nomes
+    repetidos no banco, vale o de menor id. Colunas ausentes ou vazias não
+    mexem no valor atual. A quantidade entra pelo livro de estoque: abertura
+    nos produtos novos e ajuste (contagem) nos existentes.
+    """
+    existing = {}
+    for row in conn.execute("SELECT id, name, quantity FROM inventory ORDER BY id"):
+        existing.setdefault((row["name"] or "").strip().casefold(), (row["id"], row["quantity"] or 0))
+
+    records = valid.to_dict("records")
+    new = [r for r in records if r["name"].casefold() not in existing]
+    old = [r for r in records if r["name"].casefold() in existing]
+
+    # novos: INSERT com quantidade 0, um por vez para a abertura ir para o id do próprio produto
+    movements = []
+    for r in new:
+        cur = conn.execute(
+            """
+            INSERT INTO inventory (name, category, quantity, unit_price, usage_per_service, min_stock)
+            VALUES (?, ?, 0, ?, ?, ?)
+            """,
+            (r["name"], _value(r, "category", DEFAULTS["category"]),
+             _value(r, "unit_price", DEFAULTS["unit_price"]),
+             _value(r, "usage_per_service", DEFAULTS["usage_per_service"]),
+             int(_value(r, "min_stock", DEFAULTS["min_stock"]))),
+        )
+        movements.append((cur.lastrowid, "opening", _value(r, "quantity", 0.0), None, "importação de planilha"))
+
+    # existentes: só as colunas preenchidas; quantidade diferente vira ajuste
+    for column in ("category", "unit_price", "usage_per_service", "min_stock"):
+        updates = [(_value(r, column), existing[r["name"].casefold()][0])
+                   for r in old if _value(r, column) is not None]
+        for chunk in _chunks(updates):
+            conn.executemany(f"UPDATE inventory SET {column} = ? WHERE id = ?", chunk)
+    for r in old:
+        product_id, current = existing[r["name"].casefold()]
+        quantity = _value(r, "quantity")
+        if quantity is not None and quantity != current:
+            movements.append((product_id, "adjustment", quantity - current, None, "importação de planilha"))
+
+    for chunk in _chunks(movements):
+        stock.record(conn, chunk)
+    return len(new), len(old)
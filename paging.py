@@ -0,0 +1,151 @@
+# paging.py
+# Paginação por chave (keyset): em vez de OFFSET, cada página continua a partir
+# da última chave vista, então o custo não cresce com o número da página.
+
+CURSOR_SEP = "|"
+
+
+def encode_cursor(row, keys):
+    """Cursor textual ('valor|valor') com as colunas-chave de uma linha.
+
+    Chave NULL é erro de definição: `(a, b) > (?, ?)` nunca é verdadeiro com
+    NULL e a linha sumiria das páginas. Use uma expressão NOT NULL (IFNULL).
+    """
+    values = [row[key] for _, key in keys]
+    if any(value is None for value in values):
+        raise ValueError(f"chave de paginação NULL em {[key for _, key in keys]}")
+    return CURSOR_SEP.join(str(value) for value in values)
+
+
+def decode_cursor(value, keys):
+    """Lista de valores do cursor, ou None se ele não tiver o formato esperado.
+
+    Colunas cujo nome termina em 'id' são convertidas para inteiro.
+    """
+    if not value:
+        return None
+    parts = value.split(CURSOR_SEP)
+    if len(parts) != len(keys):
+        return None
+    try:
+        return [int(p) if key.endswith("id") else p for p, (_, key) in zip(parts, keys)]
+    except ValueError:
+        return None
+
+
+class Page:
+    """Uma página de linhas e os cursores para a próxima e a anterior."""
+
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def _keyset_query(sql, params, keys, after, before, limit, descending):
+    """Monta o SELECT paginado; retorna (query, args, voltando?, valores de `after`)."""
+    key_exprs = ", ".join(expr for expr, _ in keys)
+    after_values = decode_cursor(after, keys)
+    before_values = decode_cursor(before, keys) if after_values is None else None
+    backwards = before_values is not None
+
+    # ao voltar uma página a ordem é invertida e o resultado desinvertido depois
+    reverse = descending != backwards
+    direction = "DESC" if reverse else "ASC"
+    op = "<" if reverse else ">"
+
+    query = sql
+    args = list(params)
+    bound = before_values if backwards else after_values
+    if bound is not None:
+        placeholders = ", ".join("?" * len(keys))
+        # o limite redundante na primeira chave deixa o SQLite buscar no índice
+        # (com só o row value ele percorre o índice desde o começo)
+        query += f" AND {keys[0][0]} {op}= ? AND ({key_exprs}) {op} ({placeholders})"
+        args.extend([bound[0], *bound])
+    query += " ORDER BY " + ", ".join(f"{expr} {direction}" for expr, _ in keys)
+    query += " LIMIT ?"
+    args.append(limit + 1)
+    return query, args, backwards, after_values
+
+
+def keyset_page(conn, sql, params, keys, after=None, before=None, limit=50, descending=False):
+    """Busca uma página de `sql` ordenada pelas colunas de `keys`.
+
+    `sql` é um SELECT terminado em um WHERE (use `WHERE 1=1` se não houver
+    filtro); `keys` é uma lista de (expressão SQL, nome da coluna no resultado),
+    do critério principal ao desempate, NOT NULL e servida por um índice.
+    `after`/`before` são cursores de `encode_cursor`; `before` volta uma página.
+    """
+    query, args, backwards, after_values = _keyset_query(sql, params, keys, after, before, limit, descending)
+    rows = conn.execute(query, args).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    if not rows:
+        return Page(rows)
+    first = encode_cursor(rows[0], keys)
+    last = encode_cursor(rows[-1], keys)
+    if backwards:
+        return Page(rows, next_cursor=last, prev_cursor=first if has_more else None)
+    return Page(rows, next_cursor=last if has_more else None,
+                prev_cursor=first if after_values is not None else None)
+
+
+class StreamedPage(Page):
+    """Página cujas linhas saem do cursor à medida que são iteradas.
+
+    `next_cursor`/`prev_cursor` só são preenchidos depois que as linhas forem
+    consumidas (por exemplo, depois do laço no template). Só dá para iterar uma vez.
+    """
+
+    def __init__(self, cursor, keys, limit, prev_cursor_pending):
+        super().__init__(None)
+        self._cursor = cursor
+        self._keys = keys
+        self._limit = limit
+        self._prev_pending = prev_cursor_pending
+
+    def __iter__(self):
+        first = last = None
+        seen = 0
+        try:
+            for row in self._cursor:
+                if seen == self._limit:
+                    self.next_cursor = encode_cursor(last, self._keys)   # havia mais uma linha
+                    break
+                if first is None:
+                    first = row
+                last = row
+                seen += 1
+                yield row
+        finally:
+            self._cursor.close()
+        if first is not None and self._prev_pending:
+            self.prev_cursor = encode_cursor(first, self._keys)
+
+    def __bool__(self):
+        return True
+
+    def __len__(self):
+        raise TypeError("StreamedPage não tem tamanho antes de ser lida")
+
+
+def keyset_stream(conn, sql, params, keys, after=None, before=None, limit=50, descending=False):
+    """Como `keyset_page`, mas as linhas vêm direto do cursor (`StreamedPage`).
+
+    Voltar uma página (`before`) precisa inverter as linhas, então esse caso
+    cai em `keyset_page`, que lê no máximo `limit` linhas.
+    """
+    if decode_cursor(after, keys) is None and decode_cursor(before, keys) is not None:
+        return keyset_page(conn, sql, params, keys, after, before, limit, descending)
+    query, args, _, after_values = _keyset_query(sql, params, keys, after, None, limit, descending)
+    return StreamedPage(conn.execute(query, args), keys, limit, after_values is not None)
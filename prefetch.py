@@ -0,0 +1,62 @@
+# prefetch.py
+# Carregamento em lote das relações usadas pelas telas: uma consulta agrupada
+# por relação em vez de uma consulta por linha listada (N+1).
+from collections import defaultdict
+
+# limite seguro de parâmetros por `IN (...)` (SQLite antigo aceita só 999)
+IN_CHUNK = 500
+
+
+def _chunks(ids):
+    ids = list(dict.fromkeys(ids))
+    for i in range(0, len(ids), IN_CHUNK):
+        yield ids[i:i + IN_CHUNK]
+
+
+def _group(rows, key):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row[key]].append(row)
+    return grouped
+
+
+def _fetch_in(conn, sql, ids):
+    """Roda `sql` (com um `{ids}` no lugar da lista) em blocos de IN_CHUNK ids."""
+    rows = []
+    for chunk in _chunks(ids):
+        placeholders = ",".join("?" * len(chunk))
+        rows.extend(conn.execute(sql.format(ids=placeholders), chunk).fetchall())
+    return rows
+
+
+def load_service_products(conn, service_ids=None, quantity_col="quantity_used"):
+    """Produtos vinculados a cada serviço: {service_id: [linhas (id, name, quantity)]}.
+
+    Sem `service_ids`, carrega os vínculos de todos os serviços numa consulta só.
+    """
+    qty = f"sp.{quantity_col}" if quantity_col else "NULL"
+    sql = f"""
+        SELECT sp.service_id, sp.product_id AS id, i.name, {qty} AS quantity
+        FROM service_products sp
+        JOIN inventory i ON i.id = sp.product_id
+        {{where}}
+        ORDER BY sp.service_id, i.id
+    """
+    if service_ids is None:
+        rows = conn.execute(sql.format(where="")).fetchall()
+    else:
+        rows = _fetch_in(conn, sql.format(where="WHERE sp.service_id IN ({ids})"), service_ids)
+    return _group(rows, "service_id")
+
+
+def load_schedule_products(conn, schedule_ids):
+    """Produtos usados em cada agendamento: {schedule_id: [linhas (name, quantity_used)]}."""
+    rows = _fetch_in(conn, """
+        SELECT sp.schedule_id, sp.product_id, i.name, sp.quantity_used
+        FROM schedule_products sp
+        JOIN inventory i ON i.id = sp.product_id
+        WHERE sp.schedule_id IN ({ids})
+        ORDER BY sp.schedule_id, sp.id
+    """, schedule_ids)
+    return _group(rows, "schedule_id")
+
@@ -1,6 +1,7 @@
-from flask import Blueprint, request, render_template, redirect, url_for, send_file, session, flash
-from db import get_user_db
+from flask import Blueprint, request, render_template, redirect, url_for, send_file, session, flash, jsonify
+from db import get_user_db, release_user_db, write_transaction
 import io
+import secrets
 from reportlab.pdfgen import canvas
 from datetime import date
 import os
@@ -26,11 +27,11 @@ def professionals():
         specialty = request.form.get("specialty", "")
         cpf = request.form.get("cpf", "")
 
-        cur.execute(
-            "INSERT INTO professionals (name, phone, specialty, cpf) VALUES (?, ?, ?, ?)",
-            (name, phone, specialty, cpf),
-        )
-        conn.commit()
+        with write_transaction(conn):
+            cur.execute(
+                "INSERT INTO professionals (name, phone, specialty, cpf) VALUES (?, ?, ?, ?)",
+                (name, phone, specialty, cpf),
+            )
         flash("Profissional cadastrado com sucesso!", "success")
         return redirect(url_for("professionals.professionals"))
 
@@ -38,7 +39,7 @@ def professionals():
     cur.execute("SELECT * FROM professionals")
     all_pros = cur.fetchall()
 
-    conn.close()
+    release_user_db()
     return render_template("professionals.html", all_pros=all_pros)
 
 
@@ -57,18 +58,18 @@ def edit_professionals(prof_id):
         specialty = request.form.get("specialty", "")
         cpf = request.form.get("cpf", "")
 
-        cur.execute(
-            "UPDATE professionals SET name=?, phone=?, specialty=?, cpf=? WHERE id=?",
-            (name, phone, specialty, cpf, prof_id),
-        )
-        conn.commit()
-        conn.close()
+        with write_transaction(conn):
+            cur.execute(
+                "UPDATE professionals SET name=?, phone=?, specialty=?, cpf=? WHERE id=?",
+                (name, phone, specialty, cpf, prof_id),
+            )
+        release_user_db()
         flash("Profissional atualizado com sucesso!", "success")
         return redirect(url_for("professionals.professionals"))
 
     cur.execute("SELECT * FROM professionals WHERE id=?", (prof_id,))
     prof = cur.fetchone()
-    conn.close()
+    release_user_db()
     return render_template("edit_professionals.html", prof=prof)
 
 
@@ -79,13 +80,84 @@ def edit_professionals(prof_id):
 def delete_professionals(prof_id):
     conn = get_user_db()
     cur = conn.cursor()
-    cur.execute("DELETE FROM professionals WHERE id=?", (prof_id,))
-    conn.commit()
-    conn.close()
+    with write_transaction(conn):
+        cur.execute("DELETE FROM professionals WHERE id=?", (prof_id,))
+    release_user_db()
     flash("Profissional excluído com sucesso!", "success")
     return redirect(url_for("professionals.professionals"))
 
 
+# -------------------------------
+# Link do feed de agenda (iCalendar)
+# -------------------------------
+@professionals_bp.route("/<int:prof_id>/ics_token", methods=["POST"])
+def ics_token(prof_id):
+    """Gera um novo token do feed (o link antigo deixa de funcionar) ou desliga o feed."""
+    if not session.get("user_id"):
+        return redirect(url_for("auth.login"))
+
+    token = None if request.form.get("action") == "revoke" else secrets.token_urlsafe(24)
+    conn = get_user_db()
+    with write_transaction(conn):
+        conn.execute("UPDATE professionals SET ics_token=? WHERE id=?", (token, prof_id))
+    release_user_db()
+    flash("Link da agenda gerado!" if token else "Link da agenda desativado.", "success")
+    return redirect(url_for("professionals.professionals"))
+
+
+# -------------------------------
+# Horário de trabalho (JSON)
+# -------------------------------
+@professionals_bp.route("/<int:prof_id>/hours", methods=["GET", "POST"])
+def working_hours(prof_id):
+    """Lista ou substitui o horário de trabalho usado na busca de horários livres.
+
+    POST recebe {"hours": [{"weekday": 0, "start": "09:00", "end": "18:00"}, ...]},
+    com weekday 0 = segunda. Lista vazia volta ao horário padrão.
+    """
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    conn = get_user_db()
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or {}
+        rows = []
+        try:
+            for h in payload.get("hours", []):
+                start_h, start_m = (int(x) for x in h["start"].split(":")[:2])
+                end_h, end_m = (int(x) for x in h["end"].split(":")[:2])
+                weekday = int(h["weekday"])
+                start_minute, end_minute = start_h * 60 + start_m, end_h * 60 + end_m
+                if not 0 <= weekday <= 6 or not 0 <= start_minute < end_minute <= 24 * 60:
+                    raise ValueError
+                rows.append((prof_id, weekday, start_minute, end_minute))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify({"error": "Horário inválido."}), 400
+
+        with write_transaction(conn):
+            conn.execute("DELETE FROM professional_hours WHERE professional_id=?", (prof_id,))
+            conn.executemany(
+                "INSERT INTO professional_hours (professional_id, weekday, start_minute, end_minute) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    hours = conn.execute(
+        "SELECT weekday, start_minute, end_minute FROM professional_hours "
+        "WHERE professional_id=? ORDER BY weekday, start_minute",
+        (prof_id,),
+    ).fetchall()
+    release_user_db()
+    return jsonify({
+        "professional_id": prof_id,
+        "hours": [
+            {"weekday": h["weekday"],
+             "start": f"{h['start_minute'] // 60:02d}:{h['start_minute'] % 60:02d}",
+             "end": f"{h['end_minute'] // 60:02d}:{h['end_minute'] % 60:02d}"}
+            for h in hours
+        ],
+    })
+
+
 # -------------------------------
 # Emitir Nota Fiscal (PDF)
 # -------------------------------
@@ -98,7 +170,7 @@ def emitir_nf(prof_id):
     cur.execute("SELECT * FROM professionals WHERE id = ?", (prof_id,))
     prof = cur.fetchone()
     if not prof:
-        conn.close()
+        release_user_db()
         flash("Profissional não encontrado.", "error")
         return redirect(url_for("professionals.professionals"))
 
@@ -125,15 +197,15 @@ def emitir_nf(prof_id):
         pdf.save()
 
         # Salvar no banco
-        cur.execute(
-            "INSERT INTO notas_fiscais (numero, profissional_id, dono_id, data_emissao, valor, arquivo_pdf) VALUES (?, ?, ?, ?, ?, ?)",
-            (numero, prof_id, user_id, data_emissao, valor, f"nfs/{filename}")
-        )
-        conn.commit()
-        conn.close()
+        with write_transaction(conn):
+            cur.execute(
+                "INSERT INTO notas_fiscais (numero, profissional_id, dono_id, data_emissao, valor, arquivo_pdf) VALUES (?, ?, ?, ?, ?, ?)",
+                (numero, prof_id, user_id, data_emissao, valor, f"nfs/{filename}")
+            )
+        release_user_db()
 
         flash("Nota Fiscal emitida com sucesso!", "success")
         return redirect(url_for("professionals.professionals"))
 
-    conn.close()
+    release_user_db()
     return render_template("emitir_nf.html", prof=prof, today=str(date.today()))
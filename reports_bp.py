@@ -1,7 +1,20 @@
 # reports_bp.py
 
-from flask import Blueprint, render_template, render_template_string, session, redirect, url_for
-from db import get_user_db
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import date, timedelta
+
+from flask import (Blueprint, render_template, stream_template, session, redirect, url_for, request,
+                   jsonify, Response, stream_with_context)
+from db import get_user_db, user_db_path
+from paging import keyset_stream
+from date_windows import parse_day
+import analytics
+
+REPORT_PAGE_SIZE = 200
+ANALYTICS_DEFAULT_DAYS = 90
 
 reports_bp = Blueprint("reports", __name__, url_prefix="/reports")
 
@@ -11,106 +24,209 @@ def index():
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
 
-    conn = get_user_db()
+    conn = get_user_db(readonly=True)
     cur = conn.cursor()
 
     stats = {}
     stats["total_clients"] = cur.execute("SELECT COUNT(*) AS c FROM clients").fetchone()["c"]
     stats["total_professionals"] = cur.execute("SELECT COUNT(*) AS c FROM professionals").fetchone()["c"]
     stats["total_schedules"] = cur.execute("SELECT COUNT(*) AS c FROM schedules").fetchone()["c"]
-    rev = cur.execute("SELECT COALESCE(SUM(amount),0) AS s FROM finance WHERE type='entrada'").fetchone()["s"]
+    rev = cur.execute("SELECT COALESCE(SUM(amount),0) AS s FROM finance_daily WHERE type='entrada'").fetchone()["s"]
     stats["total_revenue"] = rev or 0
 
     return render_template("reports.html", stats=stats)
 
 
-def _render_report(title, rows, headers):
-    template = """
-    {% extends 'base.html' %}
-    {% block title %}{{ title }} - Relatórios{% endblock %}
-    {% block header %}{{ title }}{% endblock %}
-    {% block content %}
-    <h3>{{ title }}</h3>
-    <table class='table-card'>
-      <thead>
-        <tr>{% for h in headers %}<th>{{ h }}</th>{% endfor %}</tr>
-      </thead>
-      <tbody>
-        {% for row in rows %}
-          <tr>{% for col in row %}<td>{{ col }}</td>{% endfor %}</tr>
-        {% endfor %}
-      </tbody>
-    </table>
-    <p><a href="{{ url_for('reports.index') }}">Voltar aos relatórios</a></p>
-    {% endblock %}
-    """
-    return render_template_string(template, title=title, rows=rows, headers=headers)
-
+@reports_bp.route("/analytics")
+def revenue_analytics():
+    """Séries de receita (dia, semana, mês), médias móveis, ano a ano e quebras (JSON).
 
-@reports_bp.route('/schedules')
-def schedules_report():
+    Parâmetros opcionais: start e end ('YYYY-MM-DD', inclusive; padrão: os
+    últimos ANALYTICS_DEFAULT_DAYS dias).
+    """
     if not session.get("user_id"):
-        return redirect(url_for("auth.login"))
-
-    conn = get_user_db()
-    cur = conn.cursor()
-    rows = cur.execute(
-        """
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    end = parse_day(request.args.get("end")) or date.today()
+    start = parse_day(request.args.get("start")) or end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    if start > end:
+        return jsonify({"error": "A data final é anterior à inicial."}), 400
+    start = max(start, end - timedelta(days=analytics.MAX_RANGE_DAYS - 1))
+
+    conn = get_user_db(readonly=True)
+    return jsonify(analytics.revenue_analytics(conn, user_db_path(session["user_id"]), start, end))
+
+
+ReportDef = namedtuple("ReportDef", "name title headers columns sql keys order_by")
+ReportDef.__doc__ = """Definição de um relatório: o mesmo SQL serve HTML, CSV e JSON.
+
+`sql` termina em um WHERE; relatórios com `keys` são paginados por chave
+(mais recentes primeiro) no HTML, os outros usam `order_by`.
+"""
+
+REPORT_FETCH_SIZE = 500      # linhas lidas do cursor por bloco enviado (CSV/JSON)
+
+
+def _report_query(report):
+    """Consulta completa (sem paginação) na ordem do relatório."""
+    if report.keys:
+        return report.sql + " ORDER BY " + ", ".join(f"{expr} DESC" for expr, _ in report.keys)
+    return report.sql + " ORDER BY " + report.order_by
+
+
+def _stream_rows(cursor):
+    """Blocos de linhas do cursor, fechando-o no fim."""
+    try:
+        while True:
+            rows = cursor.fetchmany(REPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def _report_csv(report, cursor):
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(report.headers)
+        for rows in _stream_rows(cursor):
+            writer.writerows([row[c] for c in report.columns] for row in rows)
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.getvalue():
+            yield buffer.getvalue().encode("utf-8")
+
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=relatorio_{report.name}.csv"})
+
+
+def _report_json(report, cursor):
+    def generate():
+        yield "["
+        separator = ""
+        for rows in _stream_rows(cursor):
+            yield separator + ",".join(
+                json.dumps({c: row[c] for c in report.columns}, ensure_ascii=False) for row in rows
+            )
+            separator = ","
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+def _render_report(report):
+    """Responde o relatório no formato pedido (?format=html|csv|json), sempre em streaming."""
+    conn = get_user_db(readonly=True)
+    fmt = request.args.get("format", "html")
+    if fmt == "csv":
+        return _report_csv(report, conn.execute(_report_query(report)))
+    if fmt == "json":
+        return _report_json(report, conn.execute(_report_query(report)))
+
+    if report.keys:
+        page = keyset_stream(
+            conn, report.sql, (), report.keys,
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            limit=REPORT_PAGE_SIZE,
+            descending=True,
+        )
+        rows = page
+    else:
+        page = None
+        rows = conn.execute(_report_query(report))
+    # o template (templates/report.html) é compilado uma vez e fica no cache do Jinja
+    return stream_template(
+        "report.html",
+        title=report.title,
+        headers=report.headers,
+        rows=([row[c] for c in report.columns] for row in rows),
+        page=page,
+    )
+
+
+SCHEDULES_REPORT = ReportDef(
+    name="agendamentos",
+    title="Relatório de Agendamentos",
+    headers=["ID", "Cliente", "Profissional", "Serviço", "Data/Hora", "Notas"],
+    columns=["id", "client", "professional", "service", "date_time", "notes"],
+    sql="""
         SELECT s.id, c.name AS client, p.name AS professional, sv.name AS service, s.date_time, s.notes
         FROM schedules s
         LEFT JOIN clients c ON c.id = s.client_id
         LEFT JOIN professionals p ON p.id = s.professional_id
         LEFT JOIN services sv ON sv.id = s.service_id
-        ORDER BY s.date_time DESC
-        """
-    ).fetchall()
-    rows = [[r['id'], r['client'], r['professional'], r['service'], r['date_time'], r['notes']] for r in rows]
-    headers = ['ID', 'Cliente', 'Profissional', 'Serviço', 'Data/Hora', 'Notas']
-    return _render_report('Relatório de Agendamentos', rows, headers)
+        WHERE 1=1
+    """,
+    keys=[("s.date_time", "date_time"), ("s.id", "id")],
+    order_by=None,
+)
+
+FINANCE_REPORT = ReportDef(
+    name="financeiro",
+    title="Relatório Financeiro",
+    headers=["ID", "Data", "Profissional", "Serviço", "Valor", "Tipo"],
+    columns=["id", "date", "professional", "service", "amount", "type"],
+    sql="""
+        SELECT f.id, f.date, IFNULL(f.date, '') AS date_key,
+               p.name AS professional, s.name AS service, f.amount, f.type
+        FROM finance f
+        LEFT JOIN professionals p ON p.id = f.professional_id
+        LEFT JOIN services s ON s.id = f.service_id
+        WHERE 1=1
+    """,
+    # finance.date aceita NULL: a chave é IFNULL(date, '') (índice idx_finance_date_key)
+    keys=[("IFNULL(f.date, '')", "date_key"), ("f.id", "id")],
+    order_by=None,
+)
+
+CLIENTS_REPORT = ReportDef(
+    name="clientes",
+    title="Relatório de Clientes",
+    headers=["ID", "Cliente", "Telefone", "Notas"],
+    columns=["id", "name", "phone", "notes"],
+    sql="SELECT id, name, phone, notes FROM clients WHERE 1=1",
+    keys=None,
+    order_by="name",
+)
+
+SERVICES_REPORT = ReportDef(
+    name="servicos",
+    title="Relatório de Serviços",
+    headers=["ID", "Serviço", "Categoria", "Preço", "Duração", "Promoção"],
+    columns=["id", "name", "category", "price", "duration", "promotion"],
+    sql="SELECT id, name, category, price, duration, promotion FROM services WHERE 1=1",
+    keys=None,
+    order_by="name",
+)
+
+
+@reports_bp.route('/schedules')
+def schedules_report():
+    if not session.get("user_id"):
+        return redirect(url_for("auth.login"))
+    return _render_report(SCHEDULES_REPORT)
 
 
 @reports_bp.route('/finance')
 def finance_report():
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
-
-    conn = get_user_db()
-    cur = conn.cursor()
-    rows = cur.execute(
-        """
-        SELECT f.id, f.date, p.name AS professional, s.name AS service, f.amount, f.type
-        FROM finance f
-        LEFT JOIN professionals p ON p.id = f.professional_id
-        LEFT JOIN services s ON s.id = f.service_id
-        ORDER BY f.date DESC
-        """
-    ).fetchall()
-    rows = [[r['id'], r['date'], r['professional'], r['service'], r['amount'], r['type']] for r in rows]
-    headers = ['ID', 'Data', 'Profissional', 'Serviço', 'Valor', 'Tipo']
-    return _render_report('Relatório Financeiro', rows, headers)
+    return _render_report(FINANCE_REPORT)
 
 
 @reports_bp.route('/clients')
 def clients_report():
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
-
-    conn = get_user_db()
-    cur = conn.cursor()
-    rows = cur.execute("SELECT id, name, phone, notes FROM clients ORDER BY name").fetchall()
-    rows = [[r['id'], r['name'], r['phone'], r['notes']] for r in rows]
-    headers = ['ID', 'Cliente', 'Telefone', 'Notas']
-    return _render_report('Relatório de Clientes', rows, headers)
+    return _render_report(CLIENTS_REPORT)
 
 
 @reports_bp.route('/services')
 def services_report():
     if not session.get("user_id"):
         return redirect(url_for("auth.login"))
-
-    conn = get_user_db()
-    cur = conn.cursor()
-    rows = cur.execute("SELECT id, name, category, price, duration, promotion FROM services ORDER BY name").fetchall()
-    rows = [[r['id'], r['name'], r['category'], r['price'], r['duration'], r['promotion']] for r in rows]
-    headers = ['ID', 'Serviço', 'Categoria', 'Preço', 'Duração', 'Promoção']
-    return _render_report('Relatório de Serviços', rows, headers)
+    return _render_report(SERVICES_REPORT)
@@ -1,12 +1,40 @@
-from flask import Blueprint, request, render_template, redirect, url_for, flash, session, send_file
-from datetime import datetime, timedelta
+from flask import Blueprint, request, render_template, redirect, url_for, flash, session, jsonify, Response, stream_with_context, abort
+from datetime import datetime, timedelta, timezone
 import csv
 import io
 import os
-from db import get_user_db
+from db import get_user_db, release_user_db, user_db_path, write_transaction
+from date_windows import parse_day, day_window, range_window
+from prefetch import load_service_products, load_schedule_products
+from paging import keyset_page
+from booking import Booking, expand_recurrence, find_conflicts, validate_batch
+import availability
+import ics
+import stock
 
 schedule_bp = Blueprint("schedule", __name__, url_prefix="/schedule")
 
+SCHEDULE_WINDOW_DAYS = 7     # sem filtro, lista de hoje - N até hoje + N dias
+SCHEDULE_PAGE_SIZE = 100     # agendamentos por página
+SCHEDULE_PAGE_KEYS = [("s.date_time", "date_time"), ("s.id", "id")]
+
+def _join_date_time(date, time_value):
+    """Monta 'YYYY-MM-DD HH:MM:SS' a partir dos campos de data e hora do formulário."""
+    time_parts = time_value.split(":")
+    if len(time_parts) == 2:
+        normalized_time = f"{time_parts[0]}:{time_parts[1]}:00"
+    else:
+        normalized_time = ":".join(time_parts[:3])
+    return f"{date} {normalized_time}"
+
+def _professional_id(conn):
+    """professional_id do formulário, se for o id de um profissional cadastrado (senão None)."""
+    professional_id = request.form.get("professional_id", type=int)
+    if professional_id is None:
+        return None
+    found = conn.execute("SELECT id FROM professionals WHERE id=?", (professional_id,)).fetchone()
+    return professional_id if found else None
+
 # ==================== Listar e criar agendamentos ====================
 @schedule_bp.route("/", methods=["GET", "POST"])
 def schedule():
@@ -21,29 +49,22 @@ def schedule():
     professionals = conn.execute("SELECT id, name FROM professionals").fetchall()
     services = conn.execute("SELECT * FROM services").fetchall()
 
-    # Mapeamento produtos por serviço
-    service_products = {}
-    for s in services:
-        products = conn.execute(
-            """
-            SELECT sp.product_id AS id, i.name
-            FROM service_products sp
-            JOIN inventory i ON sp.product_id = i.id
-            WHERE sp.service_id=?
-            """,
-            (s["id"],)
-        ).fetchall()
-        service_products[s["id"]] = products
+    # Mapeamento produtos por serviço (uma consulta para todos os serviços)
+    service_products = load_service_products(conn)
 
     # Criar agendamento
     if request.method == "POST":
         client_id = request.form["client_id"]
-        professional_id = request.form["professional_id"]
+        professional_id = _professional_id(conn)
         service_id = request.form["service_id"]
         date = request.form["date"]
         time_value = request.form["time"]
         notes = request.form.get("notes", "")
 
+        if professional_id is None:
+            flash("Profissional inválido!", "error")
+            return redirect(url_for("schedule.schedule"))
+
         # Obter informações do serviço
         service = conn.execute(
             "SELECT name, price, duration FROM services WHERE id=?",
@@ -54,114 +75,127 @@ def schedule():
             flash("Serviço inválido!", "error")
             return redirect(url_for("schedule.schedule"))
 
-        time_parts = time_value.split(":")
-        if len(time_parts) == 2:
-            normalized_time = f"{time_parts[0]}:{time_parts[1]}:00"
-        else:
-            normalized_time = ":".join(time_parts[:3])
-        date_time = f"{date} {normalized_time}"
-
-        # Checar duplicidade: mesmo profissional no mesmo horário
-        existing = conn.execute(
-            """
-            SELECT * FROM schedules
-            WHERE professional_id=? AND date_time BETWEEN ? AND ?
-            """,
-            (professional_id, date_time, date_time),
-        ).fetchone()
-        if existing:
-            flash("Já existe um agendamento neste horário para este profissional!", "error")
+        # Expandir a série (sem recorrência, uma ocorrência só)
+        try:
+            occurrences = expand_recurrence(
+                _join_date_time(date, time_value),
+                repeat=request.form.get("repeat", ""),
+                count=request.form.get("repeat_count", type=int),
+                until=request.form.get("repeat_until") or None,
+            )
+        except ValueError:
+            flash("Data, horário ou repetição inválidos!", "error")
             return redirect(url_for("schedule.schedule"))
 
-        # Inserir agendamento
-        cur.execute(
-            """
-            INSERT INTO schedules (client_id, professional_id, service_id, date_time, notes)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (client_id, professional_id, service_id, date_time, notes),
-        )
-        schedule_id = cur.lastrowid
-
-        # Produtos usados
-        for prod in service_products.get(service_id, []):
-            qty = float(request.form.get(f"product_{prod['id']}", 0))
-            if qty > 0:
-                conn.execute(
-                    "UPDATE inventory SET quantity = quantity - ? WHERE id=?",
-                    (qty, prod["id"]),
-                )
-                conn.execute(
+        # Checar sobreposição de todas as ocorrências de uma vez: o profissional
+        # não pode ter outro atendimento durante [início, início + duração).
+        # A checagem roda dentro da transação de escrita, então nenhum outro
+        # agendamento entra entre ela e a inserção.
+        with write_transaction(conn):
+            conflicts = validate_batch(conn, [Booking(professional_id, dt, service_id) for dt in occurrences])
+            if not conflicts:
+                # Inserir agendamentos (um por vez: o id de cada ocorrência vem do próprio INSERT)
+                schedule_ids = []
+                for dt in occurrences:
+                    cur.execute(
+                        """
+                        INSERT INTO schedules (client_id, professional_id, service_id, date_time, notes)
+                        VALUES (?, ?, ?, ?, ?)
+                        """,
+                        (client_id, professional_id, service_id, dt, notes),
+                    )
+                    schedule_ids.append(cur.lastrowid)
+
+                # Produtos usados (mesma quantidade em cada ocorrência)
+                used = []
+                for prod in service_products.get(int(service_id), []):
+                    qty = float(request.form.get(f"product_{prod['id']}", 0))
+                    if qty > 0:
+                        used.append((prod["id"], qty))
+                if used:
+                    # uma movimentação de consumo por agendamento e produto (o
+                    # trigger do livro baixa o saldo)
+                    stock.consume(conn, schedule_ids, used)
+                    conn.executemany(
+                        """
+                        INSERT INTO schedule_products (schedule_id, product_id, quantity_used)
+                        VALUES (?, ?, ?)
+                        """,
+                        [(schedule_id, product_id, qty) for schedule_id in schedule_ids for product_id, qty in used],
+                    )
+
+                # Registrar entradas financeiras
+                conn.executemany(
                     """
-                    INSERT INTO schedule_products (schedule_id, product_id, quantity_used)
-                    VALUES (?, ?, ?)
+                    INSERT INTO finance (date, professional_id, service_id, amount, type)
+                    VALUES (?, ?, ?, ?, ?)
                     """,
-                    (schedule_id, prod["id"], qty),
+                    [(dt, professional_id, service_id, service["price"] or 0, "entrada") for dt in occurrences],
                 )
 
-        # Registrar entrada financeira
-        conn.execute(
-            """
-            INSERT INTO finance (date, professional_id, service_id, amount, type)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (
-                date_time,
-                professional_id,
-                service_id,
-                service["price"] or 0,
-                "entrada",
-            ),
-        )
-
-        conn.commit()
+        if conflicts:
+            if len(occurrences) == 1:
+                flash("Já existe um agendamento neste horário para este profissional!", "error")
+            else:
+                dates = ", ".join(occurrences[index][:16] for index, _ in conflicts)
+                flash(f"Nenhum agendamento foi criado. Horários em conflito: {dates}", "error")
+            return redirect(url_for("schedule.schedule"))
+
+        availability.invalidate(conn, user_db_path(session["user_id"]),
+                                [(professional_id, dt, service["duration"]) for dt in occurrences])
+        if len(occurrences) > 1:
+            flash(f"{len(occurrences)} agendamentos criados com sucesso!", "success")
+            return redirect(url_for("schedule.schedule"))
         flash("Agendamento criado com sucesso!", "success")
         return redirect(url_for("schedule.schedule"))
 
-    # Filtrar agendamentos por data
+    # Janela de datas: o dia filtrado, ou hoje ± SCHEDULE_WINDOW_DAYS
     filter_date = request.args.get("filter_date", "")
-    if filter_date:
-        schedule_data = conn.execute(
-            """
-            SELECT s.id, c.name AS client_name, c.phone AS client_phone, p.name AS professional_name,
-                   s.date_time, sv.id AS service_id, sv.name AS service_name, sv.price, s.notes
-            FROM schedules s
-            JOIN clients c ON c.id = s.client_id
-            JOIN professionals p ON p.id = s.professional_id
-            JOIN services sv ON sv.id = s.service_id
-            WHERE date(s.date_time) = ?
-            ORDER BY s.date_time
-            """,
-            (filter_date,),
-        ).fetchall()
+    filter_day = parse_day(filter_date)
+    if filter_day:
+        window_start, window_end = day_window(filter_day)
     else:
-        schedule_data = conn.execute(
-            """
-            SELECT s.id, c.name AS client_name, c.phone AS client_phone, p.name AS professional_name,
-                   s.date_time, sv.id AS service_id, sv.name AS service_name, sv.price, s.notes
-            FROM schedules s
-            JOIN clients c ON c.id = s.client_id
-            JOIN professionals p ON p.id = s.professional_id
-            JOIN services sv ON sv.id = s.service_id
-            ORDER BY s.date_time
-            """
-        ).fetchall()
+        today = datetime.today().date()
+        window_start, window_end = range_window(today - timedelta(days=SCHEDULE_WINDOW_DAYS),
+                                                today + timedelta(days=SCHEDULE_WINDOW_DAYS))
+
+    # date_time começa pelo dia, então os limites 'YYYY-MM-DD' valem direto sobre
+    # ele e o índice em date_time já entrega a ordem (date_time, id) da paginação
+    page = keyset_page(
+        conn,
+        """
+        SELECT s.id, c.name AS client_name, c.phone AS client_phone, p.name AS professional_name,
+               s.date_time, sv.id AS service_id, sv.name AS service_name, sv.price, s.notes
+        FROM schedules s
+        JOIN clients c ON c.id = s.client_id
+        JOIN professionals p ON p.id = s.professional_id
+        JOIN services sv ON sv.id = s.service_id
+        WHERE s.date_time >= ? AND s.date_time < ?
+        """,
+        (window_start, window_end),
+        SCHEDULE_PAGE_KEYS,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        limit=SCHEDULE_PAGE_SIZE,
+    )
+    schedule_data = page.rows
 
-    # Buscar produtos usados em cada agendamento
-    schedule_products = {}
-    for sched in schedule_data:
-        prods = conn.execute(
-            """
-            SELECT i.name, sp.quantity_used
-            FROM schedule_products sp
-            JOIN inventory i ON i.id = sp.product_id
-            WHERE sp.schedule_id = ?
-            """,
-            (sched["id"],),
-        ).fetchall()
-        schedule_products[sched["id"]] = prods
+    # Resumo barato: quantidade de agendamentos por dia dentro da janela
+    day_counts = conn.execute(
+        """
+        SELECT day, COUNT(*) AS total
+        FROM schedules
+        WHERE day >= ? AND day < ?
+        GROUP BY day
+        ORDER BY day
+        """,
+        (window_start, window_end),
+    ).fetchall()
 
-    conn.close()
+    # Buscar produtos usados nos agendamentos listados (em lote)
+    schedule_products = load_schedule_products(conn, [sched["id"] for sched in schedule_data])
+
+    release_user_db()
     return render_template(
         "schedule.html",
         clients=clients,
@@ -171,77 +205,169 @@ def schedule():
         schedule=schedule_data,
         schedule_products=schedule_products,
         filter_date=filter_date,
+        page=page,
+        day_counts=day_counts,
+        window_start=window_start,
+        window_last=(parse_day(window_end) - timedelta(days=1)).isoformat(),
     )
 
-# ==================== Download dos agendamentos ====================
-@schedule_bp.route("/download_weekly")
-def download_weekly_schedule():
-    conn = get_user_db()
-    cur = conn.cursor()
+# ==================== Horários livres (JSON) ====================
+@schedule_bp.route("/api/free_slots")
+def free_slots():
+    """Horários de início livres para um serviço, por profissional e dia.
 
+    Parâmetros: service_id (obrigatório), professional_id, start e end
+    ('YYYY-MM-DD'; padrão: os próximos 7 dias a partir de hoje).
+    """
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    service_id = request.args.get("service_id", type=int)
+    if not service_id:
+        return jsonify({"error": "Informe o service_id."}), 400
+    professional_id = request.args.get("professional_id", type=int)
+    start_day = parse_day(request.args.get("start")) or datetime.today().date()
+    end_day = parse_day(request.args.get("end")) or start_day + timedelta(days=6)
+    if end_day < start_day:
+        return jsonify({"error": "A data final é anterior à inicial."}), 400
+
+    conn = get_user_db(readonly=True)
+    result = availability.free_slots(conn, user_db_path(session["user_id"]), service_id,
+                                     start_day, end_day, professional_id=professional_id)
+    if result is None:
+        return jsonify({"error": "Serviço não encontrado."}), 404
+    return jsonify(result)
+
+# ==================== Feed iCalendar por profissional ====================
+@schedule_bp.route("/ics/<int:user_id>/<token>.ics")
+def ics_feed(user_id, token):
+    """Agenda do profissional dono de `token` em iCalendar, sem login.
+
+    Responde 304 a partir de ETag/Last-Modified calculados só com os
+    marcadores de alteração, sem ler as tabelas da agenda.
+    """
+    if not os.path.exists(user_db_path(user_id)):
+        abort(404)
+    conn = get_user_db(readonly=True, user_id=user_id)
+    prof = conn.execute("SELECT id, name FROM professionals WHERE ics_token=?", (token,)).fetchone()
+    if not prof:
+        release_user_db()
+        abort(404)
+
+    # o dia entra no ETag porque a janela do feed anda sozinha à meia-noite
     today = datetime.today().date()
-    week_later = today + timedelta(days=7)
+    version, changed_at = ics.feed_marker(conn)
+    etag = f"{prof['id']}-{version}-{today.isoformat()}"
+    midnight = datetime.combine(today, datetime.min.time()).timestamp()
+    last_modified = datetime.fromtimestamp(int(max(changed_at, midnight)), timezone.utc)
 
-    rows = conn.execute(
-        """
-        SELECT s.id, c.name AS client_name, p.name AS professional_name,
-               s.date_time, sv.name AS service_name, sv.price, s.notes
-        FROM schedules s
-        JOIN clients c ON c.id = s.client_id
-        JOIN professionals p ON p.id = s.professional_id
-        JOIN services sv ON sv.id = s.service_id
-        WHERE date(s.date_time) BETWEEN ? AND ?
-        ORDER BY s.date_time
-        """,
-        (today, week_later),
-    ).fetchall()
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = bool(request.if_modified_since and request.if_modified_since >= last_modified)
+    if not_modified:
+        release_user_db()
+        response = Response(status=304)
+    else:
+        lower, upper = range_window(today - timedelta(days=ics.ICS_PAST_DAYS),
+                                    today + timedelta(days=ics.ICS_FUTURE_DAYS))
+        rows = conn.execute(
+            """
+            SELECT s.id, s.date_time, s.notes, sv.name AS service_name, sv.duration, c.name AS client_name
+            FROM schedules s
+            LEFT JOIN services sv ON sv.id = s.service_id
+            LEFT JOIN clients c ON c.id = s.client_id
+            WHERE s.professional_id = ? AND s.date_time >= ? AND s.date_time < ?
+            ORDER BY s.date_time
+            """,
+            (prof["id"], lower, upper),
+        ).fetchall()
+        release_user_db()
+        body = ics.build_calendar(f"Agenda - {prof['name']}", f"agenda-{user_id}", rows)
+        response = Response(body, mimetype="text/calendar")
 
-    conn.close()
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Cliente", "Profissional", "Data", "Hora", "Serviço", "Preço", "Observações"])
-    for row in rows:
-        date_str, time_str = row["date_time"].split(" ")
-        writer.writerow([row["client_name"], row["professional_name"], date_str, time_str, row["service_name"], row["price"], row["notes"]])
+# ==================== Download dos agendamentos ====================
+DOWNLOAD_HEADER = ["Cliente", "Profissional", "Data", "Hora", "Serviço", "Preço", "Observações"]
+DOWNLOAD_FETCH_SIZE = 500    # linhas lidas do cursor por bloco enviado
+
+DOWNLOAD_SQL = """
+    SELECT c.name AS client_name, p.name AS professional_name,
+           s.date_time, sv.name AS service_name, sv.price, s.notes
+    FROM schedules s
+    JOIN clients c ON c.id = s.client_id
+    JOIN professionals p ON p.id = s.professional_id
+    JOIN services sv ON sv.id = s.service_id
+    WHERE 1=1
+"""
+
+def _download_filters(default_start=None, default_end=None):
+    """Filtros opcionais dos downloads: ?start=&end= (inclusive) e ?professional_id=."""
+    start = parse_day(request.args.get("start")) or default_start
+    end = parse_day(request.args.get("end")) or default_end
+    lower, upper = range_window(start, end)
+
+    # date_time começa pelo dia: os limites 'YYYY-MM-DD' valem direto sobre ele,
+    # e os índices (date_time) e (professional_id, date_time) servem a ordem
+    where = ""
+    params = []
+    professional_id = request.args.get("professional_id", type=int)
+    if professional_id:
+        where += " AND s.professional_id = ?"
+        params.append(professional_id)
+    if lower:
+        where += " AND s.date_time >= ?"
+        params.append(lower)
+    if upper:
+        where += " AND s.date_time < ?"
+        params.append(upper)
+    return where, params
+
+def _stream_csv(where, params, filename):
+    """Resposta CSV gerada bloco a bloco direto do cursor (memória constante)."""
+    conn = get_user_db(readonly=True)
+    cursor = conn.execute(DOWNLOAD_SQL + where + " ORDER BY s.date_time, s.id", params)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        try:
+            writer.writerow(DOWNLOAD_HEADER)
+            while True:
+                for row in cursor.fetchmany(DOWNLOAD_FETCH_SIZE):
+                    date_str, _, time_str = row["date_time"].partition(" ")
+                    writer.writerow([row["client_name"], row["professional_name"], date_str, time_str,
+                                     row["service_name"], row["price"], row["notes"]])
+                chunk = buffer.getvalue()
+                if not chunk:
+                    break
+                buffer.seek(0)
+                buffer.truncate()
+                yield chunk.encode("utf-8")
+        finally:
+            cursor.close()
+            release_user_db()
+
+    return Response(stream_with_context(generate()), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
 
-    output.seek(0)
-    return send_file(io.BytesIO(output.getvalue().encode('utf-8')),
-                     mimetype='text/csv',
-                     as_attachment=True,
-                     download_name='agendamento_semanal.csv')
+@schedule_bp.route("/download_weekly")
+def download_weekly_schedule():
+    # padrão: hoje e os próximos 7 dias
+    today = datetime.today().date()
+    where, params = _download_filters(today, today + timedelta(days=7))
+    return _stream_csv(where, params, "agendamento_semanal.csv")
 
 @schedule_bp.route("/download_all")
 def download_all_schedule():
-    conn = get_user_db()
-    cur = conn.cursor()
-
-    rows = conn.execute(
-        """
-        SELECT s.id, c.name AS client_name, p.name AS professional_name,
-               s.date_time, sv.name AS service_name, sv.price, s.notes
-        FROM schedules s
-        JOIN clients c ON c.id = s.client_id
-        JOIN professionals p ON p.id = s.professional_id
-        JOIN services sv ON sv.id = s.service_id
-        ORDER BY s.date_time
-        """
-    ).fetchall()
-
-    conn.close()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Cliente", "Profissional", "Data", "Hora", "Serviço", "Preço", "Observações"])
-    for row in rows:
-        date_str, time_str = row["date_time"].split(" ")
-        writer.writerow([row["client_name"], row["professional_name"], date_str, time_str, row["service_name"], row["price"], row["notes"]])
-
-    output.seek(0)
-    return send_file(io.BytesIO(output.getvalue().encode('utf-8')),
-                     mimetype='text/csv',
-                     as_attachment=True,
-                     download_name='todos_agendamentos.csv')
+    # sem filtros, o histórico inteiro
+    where, params = _download_filters()
+    return _stream_csv(where, params, "todos_agendamentos.csv")
 
 # ==================== Editar agendamento ====================
 @schedule_bp.route("/edit/<int:schedule_id>", methods=["GET", "POST"])
@@ -255,69 +381,87 @@ def edit_schedule(schedule_id):
     sched = conn.execute("SELECT * FROM schedules WHERE id=?", (schedule_id,)).fetchone()
     if not sched:
         flash("Agendamento não encontrado.", "error")
-        conn.close()
+        release_user_db()
         return redirect(url_for("schedule.schedule"))
 
     clients = conn.execute("SELECT id, name FROM clients").fetchall()
     professionals = conn.execute("SELECT id, name FROM professionals").fetchall()
     services = conn.execute("SELECT * FROM services").fetchall()
 
-    service_products = {}
-    for s in services:
-        products = conn.execute(
-            """
-            SELECT sp.product_id AS id, i.name
-            FROM service_products sp
-            JOIN inventory i ON sp.product_id = i.id
-            WHERE sp.service_id = ?
-            """,
-            (s["id"],)
-        ).fetchall()
-        service_products[s["id"]] = products
+    service_products = load_service_products(conn)
 
     if request.method == "POST":
         client_id = request.form["client_id"]
-        professional_id = request.form["professional_id"]
+        professional_id = _professional_id(conn)
         service_id = request.form["service_id"]
         date = request.form["date"]
         time_value = request.form["time"]
         notes = request.form.get("notes", "")
 
-        time_parts = time_value.split(":")
-        if len(time_parts) == 2:
-            normalized_time = f"{time_parts[0]}:{time_parts[1]}:00"
-        else:
-            normalized_time = ":".join(time_parts[:3])
-        date_time = f"{date} {normalized_time}"
+        if professional_id is None:
+            flash("Profissional inválido!", "error")
+            return redirect(url_for("schedule.edit_schedule", schedule_id=schedule_id))
 
-        cur.execute(
-            """
-            UPDATE schedules
-            SET client_id=?, professional_id=?, service_id=?, date_time=?, notes=?
-            WHERE id=?
-            """,
-            (client_id, professional_id, service_id, date_time, notes, schedule_id)
-        )
-
-        cur.execute("DELETE FROM schedule_products WHERE schedule_id=?", (schedule_id,))
-        for prod in service_products.get(int(service_id), []):
-            qty = float(request.form.get(f"product_{prod['id']}", 0))
-            if qty > 0:
-                conn.execute(
+        date_time = _join_date_time(date, time_value)
+
+        service = conn.execute("SELECT duration FROM services WHERE id=?", (service_id,)).fetchone()
+        if not service:
+            flash("Serviço inválido!", "error")
+            return redirect(url_for("schedule.edit_schedule", schedule_id=schedule_id))
+        with write_transaction(conn):
+            try:
+                conflicts = find_conflicts(conn, professional_id, date_time, service["duration"],
+                                           exclude_id=schedule_id)
+            except ValueError:
+                conflicts = None
+            if conflicts == []:
+                cur.execute(
                     """
-                    INSERT INTO schedule_products (schedule_id, product_id, quantity_used)
-                    VALUES (?, ?, ?)
+                    UPDATE schedules
+                    SET client_id=?, professional_id=?, service_id=?, date_time=?, notes=?
+                    WHERE id=?
                     """,
-                    (schedule_id, prod["id"], qty)
+                    (client_id, professional_id, service_id, date_time, notes, schedule_id)
                 )
 
-        conn.commit()
-        conn.close()
+                used = []
+                for prod in service_products.get(int(service_id), []):
+                    qty = float(request.form.get(f"product_{prod['id']}", 0))
+                    if qty > 0:
+                        used.append((prod["id"], qty))
+
+                # produtos mudaram: estorna o consumo antigo e registra o novo
+                previous = stock.schedule_usage(conn, schedule_id)
+                if previous != dict(used):
+                    stock.reverse(conn, schedule_id, previous, "agendamento editado")
+                    stock.consume(conn, [schedule_id], used)
+                    cur.execute("DELETE FROM schedule_products WHERE schedule_id=?", (schedule_id,))
+                    conn.executemany(
+                        """
+                        INSERT INTO schedule_products (schedule_id, product_id, quantity_used)
+                        VALUES (?, ?, ?)
+                        """,
+                        [(schedule_id, product_id, qty) for product_id, qty in used],
+                    )
+
+        if conflicts is None:
+            flash("Data ou horário inválido!", "error")
+            return redirect(url_for("schedule.edit_schedule", schedule_id=schedule_id))
+        if conflicts:
+            flash("Já existe um agendamento neste horário para este profissional!", "error")
+            return redirect(url_for("schedule.edit_schedule", schedule_id=schedule_id))
+
+        old_duration = next((s["duration"] for s in services if s["id"] == sched["service_id"]), None)
+        availability.invalidate(conn, user_db_path(session["user_id"]),
+                                [(sched["professional_id"], sched["date_time"], old_duration),
+                                 (professional_id, date_time, service["duration"])],
+                                expected_changes=1)
+        release_user_db()
         flash("Agendamento atualizado com sucesso!", "success")
         return redirect(url_for("schedule.schedule"))
 
     sched_date, sched_time = sched["date_time"].split(" ")
-    conn.close()
+    release_user_db()
     return render_template(
         "schedule_edit.html",
         sched=sched,
@@ -336,9 +480,22 @@ def delete_schedule(schedule_id):
         return redirect(url_for("auth.login"))
 
     conn = get_user_db()
-    conn.execute("DELETE FROM schedule_products WHERE schedule_id=?", (schedule_id,))
-    conn.execute("DELETE FROM schedules WHERE id=?", (schedule_id,))
-    conn.commit()
-    conn.close()
+    with write_transaction(conn):
+        sched = conn.execute(
+            """
+            SELECT s.professional_id, s.date_time, sv.duration
+            FROM schedules s
+            LEFT JOIN services sv ON sv.id = s.service_id
+            WHERE s.id=?
+            """,
+            (schedule_id,),
+        ).fetchone()
+        stock.reverse(conn, schedule_id, stock.schedule_usage(conn, schedule_id), "agendamento excluído")
+        conn.execute("DELETE FROM schedule_products WHERE schedule_id=?", (schedule_id,))
+        conn.execute("DELETE FROM schedules WHERE id=?", (schedule_id,))
+    if sched:
+        availability.invalidate(conn, user_db_path(session["user_id"]),
+                                [(sched["professional_id"], sched["date_time"], sched["duration"])])
+    release_user_db()
     flash("Agendamento excluído com sucesso!", "success")
     return redirect(url_for("schedule.schedule"))
@@ -5,7 +5,8 @@ import pandas as pd
 import os
 import sqlite3
 from werkzeug.utils import secure_filename
-from db import get_user_db
+from db import get_user_db, release_user_db, write_transaction
+from prefetch import load_service_products
 
 services_bp = Blueprint('services', __name__, url_prefix='/services')
 
@@ -55,31 +56,31 @@ def services():
             if 'avg_quantity' in svc_cols: fields.append('avg_quantity'); values.append(avg_quantity or 0)
             if 'promotion' in svc_cols: fields.append('promotion'); values.append(promotion or 0)
 
-            sql = f"INSERT INTO services ({','.join(fields)}) VALUES ({','.join(['?']*len(fields))})"
-            cur.execute(sql, tuple(values))
-            service_id = cur.lastrowid
-
-            # produtos vinculados
-            products_ids = request.form.getlist('products_ids')
-            for pid in products_ids:
-                try:
-                    pid_int = int(pid)
-                except ValueError:
-                    continue
-                qty_val = request.form.get(f'products_qty_{pid}', None)
-                if sp_quantity_col:
-                    qty_num = float(qty_val) if qty_val not in (None, '') else 0
-                    cur.execute(
-                        f'INSERT INTO service_products (service_id, product_id, {sp_quantity_col}) VALUES (?,?,?)',
-                        (service_id, pid_int, qty_num)
-                    )
-                else:
-                    cur.execute('INSERT INTO service_products (service_id, product_id) VALUES (?,?)',
-                                (service_id, pid_int))
-
-            conn.commit()
+            with write_transaction(conn):
+                sql = f"INSERT INTO services ({','.join(fields)}) VALUES ({','.join(['?']*len(fields))})"
+                cur.execute(sql, tuple(values))
+                service_id = cur.lastrowid
+
+                # produtos vinculados
+                products_ids = request.form.getlist('products_ids')
+                for pid in products_ids:
+                    try:
+                        pid_int = int(pid)
+                    except ValueError:
+                        continue
+                    qty_val = request.form.get(f'products_qty_{pid}', None)
+                    if sp_quantity_col:
+                        qty_num = float(qty_val) if qty_val not in (None, '') else 0
+                        cur.execute(
+                            f'INSERT INTO service_products (service_id, product_id, {sp_quantity_col}) VALUES (?,?,?)',
+                            (service_id, pid_int, qty_num)
+                        )
+                    else:
+                        cur.execute('INSERT INTO service_products (service_id, product_id) VALUES (?,?)',
+                                    (service_id, pid_int))
+
             flash('Serviço adicionado com sucesso!', 'success')
-            conn.close()
+            release_user_db()
             return redirect(url_for('services.services'))
 
         # UPDATE
@@ -99,83 +100,69 @@ def services():
             if 'avg_quantity' in svc_cols: set_parts.append('avg_quantity=?'); params.append(avg_quantity or 0)
             if 'promotion' in svc_cols: set_parts.append('promotion=?'); params.append(promotion or 0)
 
-            if set_parts:
-                sql = f"UPDATE services SET {', '.join(set_parts)} WHERE id=?"
-                params.append(sid)
-                cur.execute(sql, tuple(params))
-
-            cur.execute('DELETE FROM service_products WHERE service_id=?', (sid,))
-            for pid in request.form.getlist('products_ids'):
-                try:
-                    pid_int = int(pid)
-                except ValueError:
-                    continue
-                qty_val = request.form.get(f'products_qty_{pid}', None)
-                if sp_quantity_col:
-                    qty_num = float(qty_val) if qty_val not in (None, '') else 0
-                    cur.execute(
-                        f'INSERT INTO service_products (service_id, product_id, {sp_quantity_col}) VALUES (?,?,?)',
-                        (sid, pid_int, qty_num)
-                    )
-                else:
-                    cur.execute('INSERT INTO service_products (service_id, product_id) VALUES (?,?)',
-                                (sid, pid_int))
-
-            conn.commit()
+            with write_transaction(conn):
+                if set_parts:
+                    sql = f"UPDATE services SET {', '.join(set_parts)} WHERE id=?"
+                    params.append(sid)
+                    cur.execute(sql, tuple(params))
+
+                cur.execute('DELETE FROM service_products WHERE service_id=?', (sid,))
+                for pid in request.form.getlist('products_ids'):
+                    try:
+                        pid_int = int(pid)
+                    except ValueError:
+                        continue
+                    qty_val = request.form.get(f'products_qty_{pid}', None)
+                    if sp_quantity_col:
+                        qty_num = float(qty_val) if qty_val not in (None, '') else 0
+                        cur.execute(
+                            f'INSERT INTO service_products (service_id, product_id, {sp_quantity_col}) VALUES (?,?,?)',
+                            (sid, pid_int, qty_num)
+                        )
+                    else:
+                        cur.execute('INSERT INTO service_products (service_id, product_id) VALUES (?,?)',
+                                    (sid, pid_int))
+
             flash('Serviço atualizado com sucesso!', 'info')
-            conn.close()
+            release_user_db()
             return redirect(url_for('services.services'))
 
         # DELETE
         if 'delete' in request.form:
             sid = int(request.form.get('service_id'))
-            cur.execute('DELETE FROM service_products WHERE service_id=?', (sid,))
-            cur.execute('DELETE FROM services WHERE id=?', (sid,))
-            conn.commit()
+            with write_transaction(conn):
+                cur.execute('DELETE FROM service_products WHERE service_id=?', (sid,))
+                cur.execute('DELETE FROM services WHERE id=?', (sid,))
+
             flash('Serviço excluído!', 'success')
-            conn.close()
+            release_user_db()
             return redirect(url_for('services.services'))
 
         # CLEAR ALL
         if 'clear_all' in request.form:
-            cur.execute('DELETE FROM service_products')
-            cur.execute('DELETE FROM services')
-            conn.commit()
+            with write_transaction(conn):
+                cur.execute('DELETE FROM service_products')
+                cur.execute('DELETE FROM services')
+
             flash('Todos os serviços foram excluídos!', 'warning')
-            conn.close()
+            release_user_db()
             return redirect(url_for('services.services'))
 
     # ---------- GET ----------
     cur.execute('SELECT * FROM services ORDER BY id')
     services_data = [dict(r) for r in cur.fetchall()]
 
+    linked = load_service_products(conn, quantity_col=sp_quantity_col)
     service_products, service_products_ids = {}, {}
     for s in services_data:
-        if sp_quantity_col:
-            sql = f'''
-                SELECT sp.product_id, i.name, sp.{sp_quantity_col} as quantity
-                FROM service_products sp
-                JOIN inventory i ON i.id = sp.product_id
-                WHERE sp.service_id=? ORDER BY i.id
-            '''
-            rows_sp = cur.execute(sql, (s['id'],)).fetchall()
-            service_products[s['id']] = [{"id": r["product_id"], "name": r["name"], "quantity": r["quantity"]} for r in rows_sp]
-            service_products_ids[s['id']] = [r["product_id"] for r in rows_sp]
-        else:
-            sql = '''
-                SELECT sp.product_id, i.name
-                FROM service_products sp
-                JOIN inventory i ON i.id = sp.product_id
-                WHERE sp.service_id=? ORDER BY i.id
-            '''
-            rows_sp = cur.execute(sql, (s['id'],)).fetchall()
-            service_products[s['id']] = [{"id": r["product_id"], "name": r["name"], "quantity": None} for r in rows_sp]
-            service_products_ids[s['id']] = [r["product_id"] for r in rows_sp]
+        rows_sp = linked.get(s['id'], [])
+        service_products[s['id']] = [{"id": r["id"], "name": r["name"], "quantity": r["quantity"]} for r in rows_sp]
+        service_products_ids[s['id']] = [r["id"] for r in rows_sp]
 
     cur.execute('SELECT id, name, quantity FROM inventory WHERE category="uso" ORDER BY id')
     inventory_items = [dict(r) for r in cur.fetchall()]
 
-    conn.close()
+    release_user_db()
     return render_template(
         'services.html',
         services=services_data,
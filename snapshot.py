@@ -0,0 +1,299 @@
+# snapshot.py
+# Snapshot colunar do financeiro e dos agendamentos de cada banco, para as
+# análises em NumPy/pandas.
+#
+# Cada coluna é um arquivo binário cru (`<tabela>.<geração>.<coluna>.bin`)
+# lido com np.memmap; `meta.json` guarda tipos, quantidade de linhas, a
+# geração atual e até qual versão do `change_log` o snapshot está aplicado.
+# Um refresh lê só as entradas novas do change_log: linhas novas são
+# acrescentadas no fim dos arquivos, alterações são regravadas no lugar e
+# exclusões só zeram a coluna `alive`. Quando há lixo demais (ou algo que o
+# incremental não sabe aplicar), uma nova geração é montada do zero e o
+# meta.json passa a apontar para ela.
+import copy
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+
+from db import USER_DB_DIR
+from prefetch import IN_CHUNK
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o lock entre threads
+    fcntl = None
+
+SNAPSHOT_DIR = os.path.join(USER_DB_DIR, "snapshots")
+SNAPSHOT_FORMAT = 1
+FETCH_SIZE = 5000                # linhas por bloco ao montar uma geração
+MAX_DEAD_FRACTION = 0.25         # acima disso, monta uma geração nova
+
+# day = dias desde 1970-01-01 (-1 quando a data é inválida); ids ausentes = 0
+_DAY_EXPR = "IFNULL(CAST(julianday({col}) - 2440587.5 AS INTEGER), -1)"
+
+TABLES = {
+    "finance": {
+        "columns": {
+            "id": "int64",
+            "day": "int32",
+            "professional_id": "int64",
+            "service_id": "int64",
+            "amount": "float64",
+            "is_income": "int8",
+            "alive": "int8",
+        },
+        "select": f"""
+            SELECT id, {_DAY_EXPR.format(col="day")}, IFNULL(professional_id, 0), IFNULL(service_id, 0),
+                   IFNULL(amount, 0), IFNULL(type = 'entrada', 0), 1
+            FROM finance
+        """,
+    },
+    "schedules": {
+        "columns": {
+            "id": "int64",
+            "day": "int32",
+            "professional_id": "int64",
+            "service_id": "int64",
+            "alive": "int8",
+        },
+        "select": f"""
+            SELECT id, {_DAY_EXPR.format(col="day")}, IFNULL(professional_id, 0), IFNULL(service_id, 0), 1
+            FROM schedules
+        """,
+    },
+}
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def snapshot_dir(db_path):
+    name = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+class _SnapshotLock:
+    """Lock do snapshot: entre threads (threading) e entre workers (flock)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with _locks_guard:
+            self.thread_lock = _locks.setdefault(directory, threading.Lock())
+        self.handle = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            self.handle = open(os.path.join(self.directory, ".lock"), "a")
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+        self.thread_lock.release()
+
+
+def _column_path(directory, table, generation, column):
+    return os.path.join(directory, f"{table}.{generation}.{column}.bin")
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == SNAPSHOT_FORMAT else None
+
+
+def _write_meta(directory, meta):
+    tmp = os.path.join(directory, f"meta.json.{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(meta, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, os.path.join(directory, "meta.json"))
+
+
+def _log_version(conn):
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+
+
+def _append_rows(directory, table, generation, rows, start):
+    """Grava `rows` (tuplas na ordem das colunas) a partir da linha `start`.
+
+    Cada arquivo é cortado em `start` linhas antes de escrever: o que sobrou
+    de um append interrompido (além do que o meta.json publicou) é
+    descartado e as colunas continuam alinhadas. Retorna False se algum
+    arquivo tem menos que `start` linhas (snapshot inconsistente).
+    """
+    columns = TABLES[table]["columns"]
+    if not rows:
+        return True
+    data = list(zip(*rows))
+    for (column, dtype), values in zip(columns.items(), data):
+        path = _column_path(directory, table, generation, column)
+        offset = start * np.dtype(dtype).itemsize
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as fh:
+            if os.fstat(fh.fileno()).st_size < offset:
+                return False
+            fh.truncate(offset)
+            fh.seek(offset)
+            fh.write(np.asarray(values, dtype=dtype).tobytes())
+    return True
+
+
+def _build(conn, directory):
+    """Monta uma geração nova inteira e devolve o meta correspondente."""
+    old = _read_meta(directory)
+    generation = (old["generation"] + 1) if old else 1
+    # a versão é lida antes: o que mudar durante a leitura é reaplicado depois
+    version = _log_version(conn)
+    meta = {"format": SNAPSHOT_FORMAT, "generation": generation, "version": version, "tables": {}}
+    for table, spec in TABLES.items():
+        for column in spec["columns"]:
+            open(_column_path(directory, table, generation, column), "wb").close()
+        cursor = conn.execute(spec["select"] + " ORDER BY id")
+        rows_total = 0
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            _append_rows(directory, table, generation, [tuple(r) for r in rows], rows_total)
+            rows_total += len(rows)
+        meta["tables"][table] = {"rows": rows_total, "dead": 0}
+    _write_meta(directory, meta)
+
+    # a geração anterior fica: leitores sem lock podem ter acabado de ler o
+    # meta.json antigo e ainda vão abrir os arquivos dela. Só as mais velhas saem.
+    for path in glob.glob(os.path.join(directory, "*.bin")):
+        try:
+            file_generation = int(os.path.basename(path).split(".")[1])
+        except (IndexError, ValueError):
+            continue
+        if file_generation < generation - 1:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return meta
+
+
+def _open_column(directory, table, meta, column, mode="r"):
+    rows = meta["tables"][table]["rows"]
+    dtype = TABLES[table]["columns"][column]
+    if rows == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(_column_path(directory, table, meta["generation"], column),
+                     dtype=dtype, mode=mode, shape=(rows,))
+
+
+def _apply_changes(conn, directory, meta):
+    """Aplica as entradas do change_log posteriores a meta['version'].
+
+    Retorna um meta novo (o recebido não é alterado, e o meta.json só é
+    trocado depois de tudo gravado), ou None se for preciso montar uma
+    geração nova. Um refresh interrompido não publica nada: o próximo
+    reaplica as mesmas entradas (alterações regravam a linha inteira e os
+    appends partem de `rows` do meta publicado).
+    """
+    meta = copy.deepcopy(meta)
+    # a versão é lida antes do log: o que chegar depois fica para o próximo refresh
+    version = _log_version(conn)
+    log = conn.execute(
+        "SELECT version, table_name, row_id, op FROM change_log "
+        "WHERE version > ? AND version <= ? AND table_name IN ('finance', 'schedules') ORDER BY version",
+        (meta["version"], version),
+    ).fetchall()
+
+    for table, spec in TABLES.items():
+        entries = [e for e in log if e["table_name"] == table]
+        if not entries:
+            continue
+        info = meta["tables"][table]
+        ids = _open_column(directory, table, meta, "id")
+        last_id = int(ids[-1]) if len(ids) else 0
+
+        deleted = [e["row_id"] for e in entries if e["op"] == "delete"]
+        upserted = [e["row_id"] for e in entries if e["op"] != "delete"]
+
+        # linhas atuais das alteradas/novas, em blocos
+        current = []
+        for i in range(0, len(upserted), IN_CHUNK):
+            chunk = upserted[i:i + IN_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            current.extend(tuple(r) for r in conn.execute(
+                spec["select"] + f" WHERE id IN ({placeholders})", chunk))
+        current.sort()
+
+        positions = {}
+        lookup = [row_id for row_id in deleted + [r[0] for r in current] if row_id <= last_id]
+        if lookup:
+            found = np.searchsorted(ids, lookup)
+            for row_id, pos in zip(lookup, found):
+                if pos < len(ids) and ids[pos] == row_id:
+                    positions[row_id] = int(pos)
+
+        updates = [r for r in current if r[0] in positions]
+        appends = [r for r in current if r[0] > last_id]
+        if len(updates) + len(appends) != len(current):
+            return None  # id antigo que o snapshot não conhece: monta de novo
+
+        if updates or deleted:
+            columns = {c: _open_column(directory, table, meta, c, mode="r+") for c in spec["columns"]}
+            for row in updates:
+                pos = positions[row[0]]
+                for column, value in zip(spec["columns"], row):
+                    columns[column][pos] = value
+            for row_id in deleted:
+                pos = positions.get(row_id)
+                if pos is not None:
+                    columns["alive"][pos] = 0
+            for column in columns.values():
+                column.flush()
+            # contado na coluna: um refresh interrompido já pode ter zerado parte delas
+            info["dead"] = int(len(columns["alive"]) - np.count_nonzero(columns["alive"]))
+
+        if not _append_rows(directory, table, meta["generation"], appends, info["rows"]):
+            return None
+        info["rows"] += len(appends)
+        if info["rows"] and info["dead"] / info["rows"] > MAX_DEAD_FRACTION:
+            return None
+
+    meta["version"] = version
+    _write_meta(directory, meta)
+    return meta
+
+
+def refresh(conn, db_path):
+    """Deixa o snapshot do banco em dia com o change_log e devolve seu meta."""
+    directory = snapshot_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    meta = _read_meta(directory)
+    if meta is not None and meta["version"] == _log_version(conn):
+        return meta  # caminho quente: nada mudou, nenhum lock
+
+    with _SnapshotLock(directory):
+        meta = _read_meta(directory)
+        if meta is None:
+            return _build(conn, directory)
+        if meta["version"] == _log_version(conn):
+            return meta
+        return _apply_changes(conn, directory, meta) or _build(conn, directory)
+
+
+def load(conn, db_path):
+    """{tabela: {coluna: array}} do snapshot em dia, só com as linhas vivas."""
+    directory = snapshot_dir(db_path)
+    meta = refresh(conn, db_path)
+    frames = {}
+    for table, spec in TABLES.items():
+        columns = {c: _open_column(directory, table, meta, c) for c in spec["columns"]}
+        alive = columns.pop("alive").astype(bool)
+        frames[table] = {c: values[alive] for c, values in columns.items()}
+    return frames
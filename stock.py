@@ -0,0 +1,147 @@
+# stock.py
+# Movimentações de estoque: tudo o que muda a quantidade de um produto passa
+# por aqui e vira uma linha de `stock_movements` (ver db.create_stock_ledger).
+# Os triggers do livro atualizam `inventory.quantity` e `inventory.total_used`
+# na mesma transação, então quem chama só precisa estar dentro de um
+# `write_transaction`. Os alertas de estoque baixo (`stock_alerts`) também
+# são abertos e fechados por triggers, só para o produto que mudou.
+from db import check_stock_ledger
+
+MOVEMENT_SQL = """
+    INSERT INTO stock_movements (product_id, kind, quantity, schedule_id, note)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+
+def record(conn, movements):
+    """Grava [(product_id, kind, quantidade com sinal, schedule_id, nota)].
+
+    Movimentações zeradas são descartadas, menos a abertura: ela também faz
+    os triggers avaliarem o alerta de estoque baixo do produto recém-criado.
+    """
+    movements = [m for m in movements if m[2] or m[1] == "opening"]
+    if movements:
+        conn.executemany(MOVEMENT_SQL, movements)
+    return len(movements)
+
+
+def consume(conn, schedule_ids, used):
+    """Consumo dos produtos `used` ([(product_id, qtd)]) em cada agendamento de `schedule_ids`."""
+    return record(conn, [
+        (product_id, "consumption", -qty, schedule_id, None)
+        for schedule_id in schedule_ids
+        for product_id, qty in used
+    ])
+
+
+def schedule_usage(conn, schedule_id):
+    """{product_id: quantidade} registrada em schedule_products para o agendamento.
+
+    Produtos já excluídos ficam de fora: o saldo deles foi zerado na exclusão
+    e um estorno abriria de novo o livro de um produto que não existe.
+    """
+    usage = {}
+    for row in conn.execute(
+        """
+        SELECT sp.product_id, sp.quantity_used
+        FROM schedule_products sp
+        JOIN inventory i ON i.id = sp.product_id
+        WHERE sp.schedule_id = ?
+        """,
+        (schedule_id,),
+    ):
+        usage[row["product_id"]] = usage.get(row["product_id"], 0) + (row["quantity_used"] or 0)
+    return usage
+
+
+def reverse(conn, schedule_id, usage, note):
+    """Estorna o consumo `usage` ({product_id: qtd}) de um agendamento editado ou excluído."""
+    return record(conn, [
+        (product_id, "reversal", qty, schedule_id, note)
+        for product_id, qty in usage.items()
+    ])
+
+
+def adjust(conn, product_id, new_quantity, note=None):
+    """Leva o saldo do produto a `new_quantity` com uma movimentação de ajuste."""
+    row = conn.execute("SELECT quantity FROM inventory WHERE id = ?", (product_id,)).fetchone()
+    if row is None:
+        return 0
+    return record(conn, [(product_id, "adjustment", new_quantity - (row["quantity"] or 0), None, note)])
+
+
+def remove_product(conn, product_id, note="produto excluído"):
+    """Exclui o produto, zerando antes o saldo no livro (o histórico continua).
+
+    Sai também dos serviços que o usavam, para nenhum agendamento novo
+    consumir um produto que não existe; os alertas saem pelo trigger de
+    `inventory`. Retorna False se o produto não existe.
+    """
+    if conn.execute("SELECT 1 FROM inventory WHERE id = ?", (product_id,)).fetchone() is None:
+        return False
+    adjust(conn, product_id, 0, note)
+    conn.execute("DELETE FROM service_products WHERE product_id = ?", (product_id,))
+    conn.execute("DELETE FROM inventory WHERE id = ?", (product_id,))
+    return True
+
+
+def movements(conn, product_id, limit=100):
+    """Últimas movimentações do produto, da mais nova para a mais antiga."""
+    return [dict(row) for row in conn.execute(
+        """
+        SELECT id, kind, quantity, schedule_id, note, created_at
+        FROM stock_movements
+        WHERE product_id = ?
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (product_id, limit),
+    )]
+
+
+def audit(conn):
+    """Produtos cujo saldo ou consumo acumulado diverge do livro (lista de dicts)."""
+    return [
+        {
+            "product_id": product_id,
+            "name": name,
+            "ledger": {"quantity": expected[0], "total_used": expected[1]},
+            "inventory": {"quantity": found[0], "total_used": found[1]},
+        }
+        for product_id, name, expected, found in check_stock_ledger(conn)
+    ]
+
+
+def alert_count(conn):
+    """Quantos alertas de estoque baixo estão abertos (lê só o índice parcial)."""
+    return conn.execute("SELECT COUNT(*) FROM stock_alerts WHERE resolved_at IS NULL").fetchone()[0]
+
+
+def open_alerts(conn):
+    """Alertas abertos com o saldo e o mínimo atuais do produto, do mais antigo ao mais novo."""
+    return [dict(row) for row in conn.execute(
+        """
+        SELECT a.id, a.product_id, i.name, i.quantity, i.min_stock,
+               a.quantity AS opened_quantity, a.opened_at
+        FROM stock_alerts a
+        JOIN inventory i ON i.id = a.product_id
+        WHERE a.resolved_at IS NULL
+        ORDER BY a.id
+        """
+    )]
+
+
+def resolved_alerts(conn, limit=50):
+    """Últimos alertas fechados (o saldo voltou acima do mínimo)."""
+    return [dict(row) for row in conn.execute(
+        """
+        SELECT a.id, a.product_id, i.name, a.quantity AS opened_quantity, a.min_stock,
+               a.opened_at, a.resolved_at, a.resolved_quantity
+        FROM stock_alerts a
+        JOIN inventory i ON i.id = a.product_id
+        WHERE a.resolved_at IS NOT NULL
+        ORDER BY a.resolved_at DESC
+        LIMIT ?
+        """,
+        (limit,),
+    )]
@@ -0,0 +1,89 @@
+# sync_bp.py
+# API de sincronização incremental: devolve só as linhas alteradas desde a
+# versão que o cliente já tem, mais as exclusões (tombstones).
+
+from flask import Blueprint, request, session, jsonify
+from db import get_user_db, release_user_db, SYNC_TABLES
+from prefetch import IN_CHUNK
+
+sync_bp = Blueprint("sync", __name__, url_prefix="/sync")
+
+SYNC_PAGE_SIZE = 500         # alterações por resposta
+SYNC_MAX_PAGE_SIZE = 5000
+
+# colunas que nunca saem pela API
+SYNC_HIDDEN_COLUMNS = {"professionals": {"ics_token"}}
+
+def _load_rows(conn, table, ids):
+    """Linhas atuais de `table` com esses ids, em blocos de IN_CHUNK."""
+    hidden = SYNC_HIDDEN_COLUMNS.get(table, set())
+    rows = []
+    for i in range(0, len(ids), IN_CHUNK):
+        chunk = ids[i:i + IN_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(f"SELECT * FROM {table} WHERE id IN ({placeholders})", chunk):
+            rows.append({key: row[key] for key in row.keys() if key not in hidden})
+    return rows
+
+# ==================== Alterações desde uma versão ====================
+@sync_bp.route("/changes")
+def changes():
+    """Alterações com versão maior que `since` (padrão 0 = tudo).
+
+    Resposta: {"version": última versão incluída, "has_more": bool,
+    "changes": {tabela: [linhas]}, "deleted": {tabela: [ids]}}. O cliente
+    guarda `version` e repete com `since=version` enquanto `has_more`.
+    """
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    since = request.args.get("since", 0, type=int)
+    limit = min(max(request.args.get("limit", SYNC_PAGE_SIZE, type=int), 1), SYNC_MAX_PAGE_SIZE)
+    tables = [t for t in request.args.get("tables", "").split(",") if t] or list(SYNC_TABLES)
+    unknown = [t for t in tables if t not in SYNC_TABLES]
+    if unknown:
+        return jsonify({"error": f"Tabela não sincronizada: {', '.join(unknown)}"}), 400
+
+    conn = get_user_db(readonly=True)
+    log = conn.execute(
+        """
+        SELECT version, table_name, row_id, op
+        FROM change_log
+        WHERE version > ?
+        ORDER BY version
+        LIMIT ?
+        """,
+        (since, limit + 1),
+    ).fetchall()
+    has_more = len(log) > limit
+    log = log[:limit]
+
+    upserts = {}
+    deleted = {}
+    for entry in log:
+        if entry["table_name"] not in tables:
+            continue
+        if entry["op"] == "delete":
+            deleted.setdefault(entry["table_name"], []).append(entry["row_id"])
+        else:
+            upserts.setdefault(entry["table_name"], []).append(entry["row_id"])
+
+    result = {
+        "version": log[-1]["version"] if log else since,
+        "has_more": has_more,
+        "changes": {table: _load_rows(conn, table, ids) for table, ids in upserts.items()},
+        "deleted": deleted,
+    }
+    release_user_db()
+    return jsonify(result)
+
+@sync_bp.route("/version")
+def version():
+    """Versão atual do banco: um GET barato para saber se vale chamar /changes."""
+    if not session.get("user_id"):
+        return jsonify({"error": "Usuário não está logado."}), 401
+
+    conn = get_user_db(readonly=True)
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+    release_user_db()
+    return jsonify({"version": current})
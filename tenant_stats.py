@@ -0,0 +1,291 @@
+# tenant_stats.py
+# Visão da plataforma para a área administrativa: percorre todos os bancos
+# individuais em USER_DB_DIR, lê cada um somente leitura (`mode=ro`) e junta
+# quantidade de contas, tamanho dos bancos, agendamentos por dia, receita e
+# última atividade.
+#
+# A leitura de cada banco roda num pool de processos, criado na primeira
+# vez que é preciso e reaproveitado pelas requisições seguintes do mesmo
+# processo (um worker do gunicorn nunca herda o pool de quem o criou: após
+# um fork o pool é descartado e recriado sob demanda). O resultado fica em
+# cache por banco: só é relido o banco cujo arquivo (ou WAL) mudou de mtime
+# ou tamanho *e* cuja versão de dados (topo do `change_log`) andou. O
+# `PRAGMA data_version` do SQLite só compara commits vistos pela mesma
+# conexão, então entre processos a versão usada é a do change_log, que todo
+# INSERT/UPDATE/DELETE das tabelas sincronizadas incrementa.
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+
+from db import USER_DB_DIR, USER_SCHEMA_VERSION, readonly_uri
+
+STATS_DAYS = 30              # janela de agendamentos por dia e de receita
+ACTIVE_DAYS = 7              # "ativo" = alguma alteração nos últimos N dias
+POOL_MIN_TENANTS = 4         # abaixo disso, lê no próprio processo
+MAX_WORKERS = int(os.environ.get("TENANT_STATS_WORKERS", "0")) or min(os.cpu_count() or 1, 8)
+
+# versão do schema a partir da qual cada métrica existe no banco
+_DAY_COLUMNS_VERSION = 4
+_MARKERS_VERSION = 7
+_CHANGE_LOG_VERSION = 9
+_ROLLUP_VERSION = 10
+
+_FILE_NAME = re.compile(r"agenda_(\d+)\.db$")
+
+_cache = {}                  # caminho -> (stamp, data_version, dia da leitura, resultado)
+_cache_lock = threading.Lock()
+
+_pool = None                 # ProcessPoolExecutor deste processo (criado sob demanda)
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def tenant_files():
+    """{user_id: caminho} de todos os bancos individuais."""
+    files = {}
+    for path in glob.glob(os.path.join(USER_DB_DIR, "agenda_*.db")):
+        match = _FILE_NAME.search(os.path.basename(path))
+        if match:
+            files[int(match.group(1))] = path
+    return files
+
+
+def file_stamp(path):
+    """(mtime_ns, tamanho) do banco e do WAL: muda a cada commit, sem abrir o arquivo."""
+    stamp = []
+    for name in (path, path + "-wal"):
+        try:
+            st = os.stat(name)
+            stamp += [st.st_mtime_ns, st.st_size]
+        except OSError:
+            stamp += [0, 0]
+    return tuple(stamp)
+
+
+def _stamp_bytes(stamp):
+    return stamp[1] + stamp[3]
+
+
+def _connect(path):
+    conn = sqlite3.connect(readonly_uri(path), uri=True, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _data_version(conn, schema):
+    if schema < _CHANGE_LOG_VERSION:
+        return None
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM change_log").fetchone()[0]
+
+
+def read_data_version(path):
+    """Topo do change_log do banco (None se o schema ainda não tem change_log)."""
+    conn = _connect(path)
+    try:
+        schema = conn.execute("PRAGMA user_version").fetchone()[0]
+        return _data_version(conn, schema)
+    finally:
+        conn.close()
+
+
+def scan_tenant(path, today):
+    """Métricas de um banco (roda nos processos do pool: só depende de sqlite3/os).
+
+    `today` é a data ISO que fecha a janela de STATS_DAYS dias.
+    """
+    start = (date.fromisoformat(today) - timedelta(days=STATS_DAYS - 1)).isoformat()
+    stamp = file_stamp(path)
+    result = {
+        "path": path,
+        "bytes": _stamp_bytes(stamp),
+        "clients": 0,
+        "professionals": 0,
+        "services": 0,
+        "appointments": 0,
+        "upcoming": 0,
+        "per_day": {},
+        "revenue_window": 0.0,
+        "revenue_total": 0.0,
+        "last_activity": max(stamp[0], stamp[2]) // 1_000_000_000 or None,
+        "schema_version": 0,
+        "outdated": False,
+        "error": None,
+    }
+    try:
+        conn = _connect(path)
+    except sqlite3.Error as e:
+        result["error"] = str(e)
+        return stamp, None, result
+    try:
+        schema = conn.execute("PRAGMA user_version").fetchone()[0]
+        result["schema_version"] = schema
+        result["outdated"] = schema < USER_SCHEMA_VERSION
+        version = _data_version(conn, schema)
+
+        result["clients"] = conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
+        result["professionals"] = conn.execute("SELECT COUNT(*) FROM professionals").fetchone()[0]
+        result["services"] = conn.execute("SELECT COUNT(*) FROM services").fetchone()[0]
+        result["appointments"] = conn.execute("SELECT COUNT(*) FROM schedules").fetchone()[0]
+
+        if schema >= _DAY_COLUMNS_VERSION:
+            result["upcoming"] = conn.execute(
+                "SELECT COUNT(*) FROM schedules WHERE day >= ?", (today,)
+            ).fetchone()[0]
+            result["per_day"] = {
+                row["day"]: row["total"] for row in conn.execute(
+                    "SELECT day, COUNT(*) AS total FROM schedules WHERE day >= ? AND day <= ? GROUP BY day",
+                    (start, today),
+                )
+            }
+
+        if schema >= _ROLLUP_VERSION:
+            result["revenue_total"] = conn.execute(
+                "SELECT COALESCE(SUM(amount), 0) FROM finance_daily WHERE type = 'entrada'"
+            ).fetchone()[0]
+            result["revenue_window"] = conn.execute(
+                "SELECT COALESCE(SUM(amount), 0) FROM finance_daily "
+                "WHERE type = 'entrada' AND day >= ? AND day <= ?",
+                (start, today),
+            ).fetchone()[0]
+
+        if schema >= _MARKERS_VERSION:
+            changed_at = conn.execute("SELECT MAX(changed_at) FROM change_markers").fetchone()[0]
+            if changed_at:
+                result["last_activity"] = changed_at
+    except sqlite3.Error as e:
+        result["error"] = str(e)
+        version = None
+    finally:
+        conn.close()
+    return stamp, version, result
+
+
+def _stale(paths, today):
+    """Caminhos que precisam ser relidos; atualiza o stamp dos que só mudaram de arquivo."""
+    stale = []
+    for path in paths:
+        with _cache_lock:
+            cached = _cache.get(path)
+        if cached is None or cached[2] != today:
+            stale.append(path)
+            continue
+        stamp = file_stamp(path)
+        if stamp == cached[0]:
+            continue
+        # o arquivo mudou (checkpoint, VACUUM, commit): só relê se os dados mudaram
+        try:
+            version = read_data_version(path)
+        except sqlite3.Error:
+            version = None
+        if version is None or version != cached[1]:
+            stale.append(path)
+        else:
+            with _cache_lock:
+                _cache[path] = (stamp,) + cached[1:]
+    return stale
+
+
+def _get_pool():
+    """Pool de processos deste processo; recriado se foi herdado de um fork ou quebrou."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # o pool herdado de um fork pertence ao pai: não dá para usar nem encerrar aqui
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_pool():
+    """Encerra o pool deste processo (o próximo scan cria outro)."""
+    with _pool_lock:
+        pool = _pool if _pool_pid == os.getpid() else None
+    if pool is not None:
+        _discard_pool(pool)
+
+
+def _scan_many(paths, today):
+    if len(paths) < POOL_MIN_TENANTS:
+        return [scan_tenant(path, today) for path in paths], 0
+    pool = _get_pool()
+    try:
+        scanned = list(pool.map(scan_tenant, paths, [today] * len(paths), chunksize=4))
+    except BrokenProcessPool:
+        # um processo do pool morreu: descarta o pool e lê no próprio processo desta vez
+        _discard_pool(pool)
+        return [scan_tenant(path, today) for path in paths], 0
+    return scanned, min(MAX_WORKERS, len(paths))
+
+
+def platform_stats(today=None):
+    """Agregado de todos os bancos, relendo só os que mudaram desde a última chamada."""
+    started = time.monotonic()
+    today = today or date.today().isoformat()
+    files = tenant_files()
+    paths = sorted(files.values())
+
+    stale = _stale(paths, today)
+    scanned, workers = _scan_many(stale, today)
+    with _cache_lock:
+        for stamp, version, result in scanned:
+            _cache[result["path"]] = (stamp, version, today, result)
+        current = set(paths)
+        removed = [path for path in _cache if path not in current]
+        for path in removed:
+            del _cache[path]
+        # o tamanho vem sempre do stamp atual: o WAL cresce/encolhe sem a versão mudar
+        results = {path: {**_cache[path][3], "bytes": _stamp_bytes(_cache[path][0])} for path in paths}
+
+    window = [(date.fromisoformat(today) - timedelta(days=STATS_DAYS - 1 - i)).isoformat()
+              for i in range(STATS_DAYS)]
+    per_day = dict.fromkeys(window, 0)
+    active_since = int(time.time()) - ACTIVE_DAYS * 86400
+    tenants = []
+    for user_id, path in files.items():
+        result = results[path]
+        for day, total in result["per_day"].items():
+            if day in per_day:
+                per_day[day] += total
+        tenants.append({
+            "user_id": user_id,
+            **{key: value for key, value in result.items() if key not in ("path", "per_day")},
+            "appointments_window": sum(result["per_day"].values()),
+        })
+    tenants.sort(key=lambda t: t["last_activity"] or 0, reverse=True)
+
+    return {
+        "today": today,
+        "window_days": STATS_DAYS,
+        "tenants": len(tenants),
+        "active": sum(1 for t in tenants if (t["last_activity"] or 0) >= active_since),
+        "outdated": sum(1 for t in tenants if t["outdated"]),
+        "errors": sum(1 for t in tenants if t["error"]),
+        "total_bytes": sum(t["bytes"] for t in tenants),
+        "appointments": sum(t["appointments"] for t in tenants),
+        "upcoming": sum(t["upcoming"] for t in tenants),
+        "revenue_window": round(sum(t["revenue_window"] for t in tenants), 2),
+        "revenue_total": round(sum(t["revenue_total"] for t in tenants), 2),
+        "per_day": {"dates": window, "counts": [per_day[d] for d in window]},
+        "tenant_list": tenants,
+        "scan": {
+            "rescanned": len(stale),
+            "cached": len(paths) - len(stale),
+            "removed": len(removed),
+            "workers": workers,
+            "seconds": round(time.monotonic() - started, 3),
+        },
+    }
@@ -0,0 +1,67 @@
+# conftest.py
+# Os testes rodam contra uma pasta de dados temporária (AGENDA_DATA_DIR), nunca
+# contra os bancos do projeto; as variáveis precisam existir antes de importar o app.
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ["AGENDA_DATA_DIR"] = tempfile.mkdtemp(prefix="agenda-tests-")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "test")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "test")
+os.environ["ADMIN_EMAILS"] = "admin@example.com"
+
+
+@pytest.fixture(scope="session")
+def app():
+    import app as app_module
+    app_module.app.testing = True
+    return app_module.app
+
+
+def register(client, email):
+    """Cria a conta (se ainda não existe) e deixa o client logado com ela."""
+    client.post("/register", data={"email": email, "password": "x", "name": email, "birth_date": "2000-01-01"})
+    client.post("/login", data={"email": email, "password": "x"})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_conn():
+    """Banco de usuário novo (arquivo temporário) já migrado até a versão atual."""
+    from db import init_user_db
+    handle, path = tempfile.mkstemp(suffix=".db", dir=os.environ["AGENDA_DATA_DIR"])
+    os.close(handle)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    init_user_db(conn)
+    yield conn
+    conn.close()
+    os.remove(path)
+
+
+@pytest.fixture
+def tenant_db(client):
+    """Conexão direta com o banco do usuário logado no `client` (depois de `register`)."""
+    from db import user_db_path
+    conns = []
+
+    def connect():
+        with client.session_transaction() as sess:
+            path = user_db_path(sess["user_id"])
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conns.append(conn)
+        return conn
+    yield connect
+    for conn in conns:
+        conn.close()
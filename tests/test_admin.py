@@ -0,0 +1,38 @@
+# test_admin.py
+# Toda rota /admin enxerga dados de todos os bancos: só ADMIN_EMAILS entra.
+from conftest import register
+
+
+def _admin_urls(app):
+    return sorted(rule.rule for rule in app.url_map.iter_rules()
+                  if rule.rule.startswith("/admin") and "GET" in rule.methods and not rule.arguments)
+
+
+def test_there_are_admin_routes(app):
+    assert "/admin/db_pool" in _admin_urls(app)
+    assert "/admin/db_writes" in _admin_urls(app)
+
+
+def test_admin_routes_require_login(app, client):
+    for url in _admin_urls(app):
+        assert client.get(url).status_code == 401, url
+
+
+def test_admin_routes_reject_regular_users(app, client):
+    register(client, "someone@example.com")
+    for url in _admin_urls(app):
+        assert client.get(url).status_code == 403, url
+
+
+def test_admin_routes_allow_admins(app, client):
+    register(client, "admin@example.com")
+    for url in _admin_urls(app):
+        assert client.get(url).status_code == 200, url
+
+
+def test_db_writes_does_not_expose_file_names(client):
+    register(client, "admin@example.com")
+    client.post("/clients", data={"name": "Cliente", "phone": "11999999999"})
+    tenants = client.get("/admin/db_writes").get_json()["tenants"]
+    assert tenants
+    assert all(not key.endswith(".db") and "/" not in key for key in tenants)
@@ -0,0 +1,41 @@
+# test_availability.py
+from datetime import date, datetime
+
+import availability
+
+DAY = date(2030, 3, 4)            # segunda-feira
+NEXT_DAY = date(2030, 3, 5)
+NOW = datetime(2030, 3, 1, 8, 0)
+
+
+def _setup(conn):
+    conn.execute("INSERT INTO professionals (name) VALUES ('Ana')")
+    conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Longo', 'x', 100, 120)")
+    # dia inteiro de trabalho, para os slots da madrugada aparecerem
+    conn.executemany("INSERT INTO professional_hours (professional_id, weekday, start_minute, end_minute) "
+                     "VALUES (1, ?, 0, 1440)", [(weekday,) for weekday in range(7)])
+
+
+def _times(conn, tenant, day):
+    result = availability.free_slots(conn, tenant, 1, day, day, now=NOW)
+    return next((s["times"] for s in result["slots"] if s["date"] == day.isoformat()), [])
+
+
+def test_booking_across_midnight_invalidates_the_next_day(user_conn):
+    tenant = "tenant-midnight"
+    _setup(user_conn)
+    assert "00:30" in _times(user_conn, tenant, NEXT_DAY)   # bitmap do dia seguinte em cache
+
+    user_conn.execute("INSERT INTO schedules (professional_id, service_id, date_time) "
+                      "VALUES (1, 1, '2030-03-04 23:30')")
+    availability.invalidate(user_conn, tenant, [(1, "2030-03-04 23:30", 120)])
+
+    times = _times(user_conn, tenant, NEXT_DAY)
+    assert "00:30" not in times and "01:15" not in times
+    assert "01:30" in times
+
+
+def test_touched_days():
+    assert availability._touched_days("2030-03-04 10:00", 60) == ["2030-03-04"]
+    assert availability._touched_days("2030-03-04 23:30", 120) == ["2030-03-04", "2030-03-05"]
+    assert availability._touched_days("2030-03-04 23:00", 60) == ["2030-03-04"]
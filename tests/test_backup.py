@@ -0,0 +1,53 @@
+# test_backup.py
+import pytest
+
+import backup
+from db import _open_user_db
+
+
+def _markers(conn):
+    return dict(conn.execute("SELECT name, version FROM change_markers").fetchall())
+
+
+@pytest.fixture
+def tenant(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup, "BACKUP_DIR", str(tmp_path / "backups"))
+    monkeypatch.setattr(backup, "CHUNK_DIR", str(tmp_path / "backups" / "chunks"))
+    return str(tmp_path / "agenda_restore.db")
+
+
+def test_restore_moves_markers_forward_and_keeps_live_watermarks(tenant):
+    conn = _open_user_db(tenant)
+    with conn:
+        conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'x', 50, 30)")
+    conn.close()
+    assert "error" not in backup.backup_tenant(tenant)
+
+    conn = _open_user_db(tenant)
+    with conn:
+        for price in (60, 70, 80):
+            conn.execute("UPDATE services SET price = ? WHERE id = 1", (price,))
+        conn.execute("INSERT INTO export_watermarks (consumer, version, previous_version, exported_at) "
+                     "VALUES ('contador', 4, 1, 123)")
+        conn.execute("INSERT INTO export_batches (consumer, table_name, row_id, change, version) "
+                     "VALUES ('contador', 'services', 1, 'update', 4)")
+    before = _markers(conn)
+    conn.close()
+
+    backup.restore_tenant(tenant, "latest")
+
+    conn = _open_user_db(tenant)
+    try:
+        after = _markers(conn)
+        assert all(after[name] > version for name, version in before.items())
+        assert sum(after.values()) > sum(before.values())     # ETag nova, nunca a de antes
+        marks = conn.execute("SELECT consumer, version, previous_version FROM export_watermarks").fetchall()
+        assert [tuple(mark) for mark in marks] == [("contador", 4, 1)]
+        batch = conn.execute("SELECT consumer, row_id FROM export_batches").fetchall()
+        assert [tuple(row) for row in batch] == [("contador", 1)]
+        # a linha já existia antes da restauração: continua com a versão de inserção
+        assert conn.execute("SELECT created_version FROM change_log "
+                            "WHERE table_name = 'services' AND row_id = 1").fetchone()[0] is not None
+        assert conn.execute("SELECT price FROM services WHERE id = 1").fetchone()[0] == 50
+    finally:
+        conn.close()
@@ -0,0 +1,62 @@
+# test_booking.py
+import pytest
+
+from booking import Booking, find_conflicts, validate_batch
+
+
+@pytest.fixture
+def conn(user_conn):
+    user_conn.execute("INSERT INTO professionals (name) VALUES ('Ana')")
+    user_conn.execute("INSERT INTO professionals (name) VALUES ('Bia')")
+    user_conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'x', 50, 60)")
+    user_conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Longo', 'x', 90, 180)")
+    # Ana: 10:00-11:00 e 23:00-02:00 (atravessa a meia-noite)
+    user_conn.execute("INSERT INTO schedules (professional_id, service_id, date_time) VALUES (1, 1, '2030-03-04 10:00')")
+    user_conn.execute("INSERT INTO schedules (professional_id, service_id, date_time) VALUES (1, 2, '2030-03-04 23:00')")
+    return user_conn
+
+
+def _ids(rows):
+    return [row["id"] for row in rows]
+
+
+@pytest.mark.parametrize("date_time, duration, expected", [
+    ("2030-03-04 10:30", 60, [1]),      # começa no meio
+    ("2030-03-04 09:30", 60, [1]),      # termina no meio
+    ("2030-03-04 09:00", 180, [1]),     # engloba
+    ("2030-03-04 11:00", 60, []),       # encosta no fim
+    ("2030-03-04 09:00", 60, []),       # encosta no início
+    ("2030-03-05 01:00", 30, [2]),      # madrugada do dia seguinte, ainda ocupada
+    ("2030-03-05 02:00", 30, []),
+    ("2030-03-04 22:30", 60, [2]),
+])
+def test_find_conflicts(conn, date_time, duration, expected):
+    assert _ids(find_conflicts(conn, 1, date_time, duration)) == expected
+
+
+def test_other_professional_does_not_conflict(conn):
+    assert find_conflicts(conn, 2, "2030-03-04 10:00", 60) == []
+
+
+def test_edit_ignores_the_booking_itself(conn):
+    assert find_conflicts(conn, 1, "2030-03-04 10:30", 60, exclude_id=1) == []
+    assert validate_batch(conn, [Booking(1, "2030-03-04 10:30", 1, schedule_id=1)]) == []
+
+
+def test_batch_against_existing_bookings(conn):
+    conflicts = validate_batch(conn, [
+        Booking(1, "2030-03-04 11:00", 1),          # encosta: livre
+        Booking(1, "2030-03-05 01:30", 1),          # dentro do de 23:00
+        Booking(2, "2030-03-04 10:00", 1),          # outro profissional
+    ])
+    assert conflicts == [(1, "conflita com o agendamento de 2030-03-04 23:00")]
+
+
+def test_batch_occurrences_conflict_with_each_other(conn):
+    conflicts = validate_batch(conn, [
+        Booking(2, "2030-03-06 09:00", 2),          # 09:00-12:00
+        Booking(2, "2030-03-06 11:00", 1),          # dentro do anterior
+        Booking(2, "2030-03-06 12:00", 1),          # encosta no primeiro: livre
+        Booking(1, "2030-03-06 11:00", 1),          # mesmo horário, outro profissional
+    ])
+    assert conflicts == [(1, "conflita com 2030-03-06 09:00 do mesmo lote")]
@@ -0,0 +1,187 @@
+# test_db.py
+import os
+import sqlite3
+import threading
+import types
+
+import pytest
+
+import db
+
+
+class _CountingConn:
+    in_transaction = False
+
+    def __init__(self):
+        self.checkpoints = 0
+
+    def execute(self, sql):
+        assert sql == "PRAGMA wal_checkpoint(PASSIVE)"
+        self.checkpoints += 1
+
+
+def test_concurrent_releases_run_a_single_checkpoint():
+    conn = _CountingConn()
+    start = threading.Barrier(16)
+
+    def release():
+        start.wait()
+        db.checkpoint_wal("/tmp/agenda_checkpoint_test.db", conn)
+
+    threads = [threading.Thread(target=release) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert conn.checkpoints == 1
+
+
+# ---- TenantWriteCoordinator ----
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "agenda_7.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE t (v INTEGER)")
+    conn.close()
+    return path
+
+
+def _values(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT v FROM t ORDER BY v")]
+    finally:
+        conn.close()
+
+
+def test_nested_transactions_commit_once(db_path):
+    coordinator = db.TenantWriteCoordinator()
+    conn = sqlite3.connect(db_path)
+    with coordinator.transaction(db_path, conn):
+        conn.execute("INSERT INTO t VALUES (1)")
+        with coordinator.transaction(db_path, conn):
+            conn.execute("INSERT INTO t VALUES (2)")
+        assert conn.in_transaction and _values(db_path) == []     # o de dentro não comita
+    assert _values(db_path) == [1, 2]
+    assert coordinator.stats()["tenants"]["7"]["transactions"] == 1
+
+
+def test_exception_rolls_back_the_whole_transaction(db_path):
+    coordinator = db.TenantWriteCoordinator()
+    conn = sqlite3.connect(db_path)
+    with pytest.raises(ZeroDivisionError):
+        with coordinator.transaction(db_path, conn):
+            conn.execute("INSERT INTO t VALUES (1)")
+            with coordinator.transaction(db_path, conn):
+                conn.execute("INSERT INTO t VALUES (2)")
+                1 / 0
+    assert not conn.in_transaction and _values(db_path) == []
+    with coordinator.transaction(db_path, conn):                   # a fila foi liberada
+        conn.execute("INSERT INTO t VALUES (3)")
+    assert _values(db_path) == [3]
+
+
+def test_busy_database_is_retried_with_backoff(db_path):
+    coordinator = db.TenantWriteCoordinator(busy_slice_ms=10, backoff_base=0.01)
+    other = sqlite3.connect(db_path, check_same_thread=False)       # "outro processo"
+    other.execute("BEGIN IMMEDIATE")
+    timer = threading.Timer(0.2, other.rollback)
+    timer.start()
+    conn = sqlite3.connect(db_path)
+    with coordinator.transaction(db_path, conn):
+        conn.execute("INSERT INTO t VALUES (1)")
+    timer.join()
+    stats = coordinator.stats()["tenants"]["7"]
+    assert stats["busy_retries"] > 0 and stats["failures"] == 0
+    assert _values(db_path) == [1]
+    # o busy_timeout normal volta depois das tentativas
+    assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == db.SQLITE_PROFILE["busy_timeout"]
+
+
+def test_busy_database_gives_up_after_retry_seconds(db_path):
+    coordinator = db.TenantWriteCoordinator(retry_seconds=0.1, busy_slice_ms=10)
+    other = sqlite3.connect(db_path)
+    other.execute("BEGIN IMMEDIATE")
+    conn = sqlite3.connect(db_path)
+    with pytest.raises(sqlite3.OperationalError):
+        with coordinator.transaction(db_path, conn):
+            pass
+    other.rollback()
+    assert coordinator.stats()["tenants"]["7"]["failures"] == 1
+
+
+# ---- UserDBPool ----
+
+class _FakeConn:
+    in_transaction = False
+    row_factory = None
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(db, "time", types.SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_pool_reuses_released_connections(clock):
+    pool = db.UserDBPool(max_size=4, idle_seconds=60)
+    conn = pool.acquire("a", _FakeConn)
+    pool.release("a", conn)
+    assert pool.acquire("a", _FakeConn) is conn
+    assert pool.acquire("a", _FakeConn) is not conn            # emprestada: não é dividida
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["borrowed"]) == (1, 2, 2)
+
+
+def test_pool_evicts_least_recently_used_at_capacity(clock):
+    pool = db.UserDBPool(max_size=2, idle_seconds=60)
+    conns = {path: pool.acquire(path, _FakeConn) for path in "abc"}
+    pool.release("a", conns["a"])
+    pool.release("b", conns["b"])
+    assert pool.acquire("a", _FakeConn) is conns["a"]         # "a" vira o mais recente
+    pool.release("a", conns["a"])
+    pool.release("c", conns["c"])                              # passa de 2: sai "b"
+    assert conns["b"].closed and not conns["a"].closed and not conns["c"].closed
+    stats = pool.stats()
+    assert (stats["idle"], stats["evicted_capacity"]) == (2, 1)
+
+
+def test_pool_closes_idle_connections(clock):
+    pool = db.UserDBPool(max_size=4, idle_seconds=60)
+    old, fresh = pool.acquire("a", _FakeConn), pool.acquire("b", _FakeConn)
+    pool.release("a", old)
+    clock.now += 45
+    pool.release("b", fresh)
+    clock.now += 30                                            # "a" ocioso há 75 s, "b" há 30 s
+    assert pool.acquire("a", _FakeConn) is not old
+    assert old.closed and not fresh.closed
+    assert pool.stats()["evicted_idle"] == 1
+    assert pool.acquire("b", _FakeConn) is fresh
+
+
+def test_pool_does_not_reuse_connections_across_fork(clock):
+    pool = db.UserDBPool(max_size=4, idle_seconds=60)
+    conn = pool.acquire("a", _FakeConn)
+    pool.release("a", conn)
+    pool._pid = -1                      # estado herdado: o pool foi preenchido por outro processo
+    assert pool.acquire("a", _FakeConn) is not conn
+    stats = pool.stats()
+    assert (stats["pid"], stats["hits"], stats["idle"]) == (os.getpid(), 0, 0)
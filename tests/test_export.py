@@ -0,0 +1,36 @@
+# test_export.py
+import io
+import zipfile
+
+import export
+from conftest import register
+
+
+def _tables(conn):
+    return {row["name"] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")}
+
+
+def test_every_table_is_exported_or_explicitly_excluded(user_conn):
+    exported = {table for table, _ in export.export_tables(user_conn)}
+    assert exported == _tables(user_conn) - export.EXPORT_EXCLUDED
+
+
+def test_every_exported_table_has_a_title(user_conn):
+    # tabela nova de migration: decidir o nome da aba (EXPORT_TABLES) ou excluí-la (EXPORT_EXCLUDED)
+    named = {table for table, _ in export.EXPORT_TABLES}
+    assert _tables(user_conn) - export.EXPORT_EXCLUDED <= named
+
+
+def test_new_table_gets_a_fallback_title(user_conn):
+    user_conn.execute("CREATE TABLE loyalty_points (id INTEGER PRIMARY KEY, points INTEGER)")
+    assert export.export_tables(user_conn)[-1] == ("loyalty_points", "Loyalty points")
+
+
+def test_full_csv_export_includes_the_stock_ledger(client):
+    register(client, "export@example.com")
+    response = client.get("/export/?format=csv")
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert "movimentos_de_estoque.csv" in names
+    assert "alertas_de_estoque.csv" in names
+    assert not any(name.startswith("change_") for name in names)
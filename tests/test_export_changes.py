@@ -0,0 +1,83 @@
+# test_export_changes.py
+import csv
+import io
+import zipfile
+
+import pytest
+
+from conftest import register
+
+
+def _changes(client, **args):
+    query = "&".join(f"{key}={value}" for key, value in {"format": "csv", **args}.items())
+    response = client.get(f"/export/changes?{query}")
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        rows = list(csv.DictReader(io.TextIOWrapper(zf.open("clientes.csv"), encoding="utf-8-sig")))
+    return [(row["change"], int(row["id"]), row["name"]) for row in rows], response.headers
+
+
+@pytest.fixture
+def conn(client, tenant_db, request):
+    register(client, f"{request.node.name}@example.com")   # banco novo por teste
+    return tenant_db()
+
+
+def test_first_batch_is_all_inserts_and_marks_the_consumer(client, conn):
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1'), ('Bia', '2')")
+    rows, headers = _changes(client)
+    assert rows == [("insert", 1, "Ana"), ("insert", 2, "Bia")]
+    mark = client.get("/export/watermarks").get_json()
+    assert [(m["consumer"], m["version"]) for m in mark] == [("padrao", int(headers["X-Export-Version"]))]
+    assert _changes(client)[0] == []                    # nada novo depois da marca
+
+
+def test_insert_update_delete_after_the_mark(client, conn):
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1'), ('Bia', '2')")
+    _changes(client)
+    conn.execute("UPDATE clients SET name = 'Ana Maria' WHERE id = 1")
+    conn.execute("DELETE FROM clients WHERE id = 2")
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Caio', '3'), ('Duda', '4')")
+    conn.execute("DELETE FROM clients WHERE id = 4")    # criada e excluída depois da marca
+    rows, _ = _changes(client)
+    assert rows == [("update", 1, "Ana Maria"), ("delete", 2, ""), ("insert", 3, "Caio")]
+
+
+def test_peek_does_not_move_the_mark(client, conn):
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1')")
+    assert _changes(client, peek=1)[0] == [("insert", 1, "Ana")]
+    assert _changes(client)[0] == [("insert", 1, "Ana")]
+
+
+def test_replay_repeats_the_batch_after_rows_change_again(client, conn):
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1'), ('Bia', '2')")
+    _changes(client)
+    conn.execute("UPDATE clients SET name = 'Ana Maria' WHERE id = 1")
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Caio', '3')")
+    batch, headers = _changes(client)
+    assert batch == [("update", 1, "Ana Maria"), ("insert", 3, "Caio")]
+
+    # as duas linhas mudam de novo: a versão delas passa da marca
+    conn.execute("UPDATE clients SET name = 'Ana M.' WHERE id = 1")
+    conn.execute("DELETE FROM clients WHERE id = 3")
+    replayed, replay_headers = _changes(client, replay=1)
+    assert replayed == [("update", 1, "Ana M."), ("delete", 3, "")]
+    assert replay_headers["X-Export-Version"] == headers["X-Export-Version"]
+    assert _changes(client)[0] == [("update", 1, "Ana M."), ("delete", 3, "")]
+
+
+def test_row_without_created_version_is_sent_as_insert(client, conn):
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1')")
+    _changes(client)
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Bia', '2')")
+    conn.execute("UPDATE change_log SET created_version = NULL WHERE table_name = 'clients' AND row_id = 2")
+    assert _changes(client)[0] == [("insert", 2, "Bia")]
+
+
+def test_migration_backfills_created_version(user_conn):
+    from db import _user_v15_export_batches
+    user_conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1')")
+    user_conn.execute("UPDATE change_log SET created_version = NULL")
+    _user_v15_export_batches(user_conn)
+    row = user_conn.execute("SELECT version, created_version FROM change_log WHERE table_name = 'clients'").fetchone()
+    assert row["created_version"] == row["version"]
@@ -0,0 +1,49 @@
+# test_finance_rollup.py
+from db import check_finance_rollup, rebuild_finance_rollup
+
+
+def _rollup(conn):
+    return sorted(tuple(row) for row in conn.execute(
+        "SELECT type, day, professional_id, service_id, entries, ROUND(amount, 2) FROM finance_daily"))
+
+
+def _assert_matches_rebuild(conn):
+    kept = _rollup(conn)
+    conn.execute("BEGIN")
+    rebuild_finance_rollup(conn)
+    rebuilt = _rollup(conn)
+    conn.execute("ROLLBACK")
+    assert kept == rebuilt
+    assert check_finance_rollup(conn) == []
+    return kept
+
+
+def test_triggers_match_a_full_rebuild(user_conn):
+    conn = user_conn
+    conn.executemany(
+        "INSERT INTO finance (date, professional_id, service_id, amount, type) VALUES (?, ?, ?, ?, ?)", [
+            ("2030-03-04 10:00", 1, 1, 50, "entrada"),
+            ("2030-03-04 15:00", 1, 1, 30, "entrada"),
+            ("2030-03-05 09:00", 2, None, 20, "saida"),
+            (None, None, None, 5, "entrada"),
+        ])
+    assert ("entrada", "2030-03-04", 1, 1, 2, 80) in _assert_matches_rebuild(conn)
+
+    conn.execute("UPDATE finance SET amount = 70 WHERE id = 2")
+    _assert_matches_rebuild(conn)
+
+    # troca de dia: sai do grupo antigo e entra no novo
+    conn.execute("UPDATE finance SET date = '2030-03-06 08:00' WHERE id = 1")
+    rollup = _assert_matches_rebuild(conn)
+    assert ("entrada", "2030-03-04", 1, 1, 1, 70) in rollup
+    assert ("entrada", "2030-03-06", 1, 1, 1, 50) in rollup
+
+    conn.execute("UPDATE finance SET type = 'saida', professional_id = 2 WHERE id = 4")
+    _assert_matches_rebuild(conn)
+
+    conn.execute("DELETE FROM finance WHERE id = 2")
+    rollup = _assert_matches_rebuild(conn)
+    assert not any(row[1] == "2030-03-04" for row in rollup)   # grupo vazio some
+
+    conn.execute("DELETE FROM finance")
+    assert _assert_matches_rebuild(conn) == []
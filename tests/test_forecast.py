@@ -0,0 +1,44 @@
+# test_forecast.py
+from datetime import date
+
+import forecast
+
+TODAY = date(2030, 3, 10)
+
+
+def _book(conn, date_time, used):
+    cur = conn.execute("INSERT INTO schedules (professional_id, service_id, date_time) VALUES (1, 1, ?)",
+                       (date_time,))
+    conn.execute("INSERT INTO schedule_products (schedule_id, product_id, quantity_used) VALUES (?, 1, ?)",
+                 (cur.lastrowid, used))
+
+
+def test_forecast_combines_bookings_and_trailing_rate(user_conn):
+    conn = user_conn
+    conn.execute("INSERT INTO professionals (name) VALUES ('Ana')")
+    conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'x', 50, 30)")
+    conn.execute("INSERT INTO inventory (name, category, quantity, min_stock) VALUES ('Shampoo', 'uso', 20, 5)")
+    conn.execute("INSERT INTO inventory (name, category, quantity, min_stock) VALUES ('Creme', 'uso', 3, 5)")
+    conn.execute("INSERT INTO inventory (name, category, quantity, min_stock) VALUES ('Gel', 'uso', 10, 0)")
+    conn.execute("INSERT INTO service_products (service_id, product_id, quantity_used) VALUES (1, 1, 2)")
+    # passado (janela de 28 dias): 14 usados -> ritmo 0,5/dia; o de 40 dias atrás não conta
+    _book(conn, "2030-02-01 10:00", 100)
+    _book(conn, "2030-03-01 10:00", 7)
+    _book(conn, "2030-03-09 10:00", 7)
+    # marcados: hoje 1 e dia 12 2 (2 por atendimento), já baixados do saldo (reservado 6)
+    for date_time in ("2030-03-10 10:00", "2030-03-12 10:00", "2030-03-12 11:00"):
+        _book(conn, date_time, 2)
+
+    result = forecast.depletion_forecast(conn, today=TODAY)
+
+    # saldo físico 26; consumo diário max(marcado, 0,5): 2, 0,5, 4 e depois 0,5
+    # -> 19,5 ao fim do dia 12, chega a 5 depois de mais 29 dias (10/04)
+    assert result[1] == {"on_hand": 26.0, "booked": 6.0, "daily_rate": 0.5, "reorder_date": "2030-04-10"}
+    # já no mínimo: repor hoje
+    assert result[2]["reorder_date"] == TODAY.isoformat()
+    # sem consumo e sem mínimo: nunca chega lá no horizonte
+    assert result[3] == {"on_hand": 10.0, "booked": 0.0, "daily_rate": 0.0, "reorder_date": None}
+
+
+def test_no_products_no_forecast(user_conn):
+    assert forecast.depletion_forecast(user_conn, today=TODAY) == {}
@@ -0,0 +1,103 @@
+# test_inventory_import.py
+import io
+
+import pandas as pd
+import pytest
+
+import inventory_import
+from conftest import register
+from db import check_stock_ledger
+
+
+def _sheet(text):
+    return inventory_import.read_sheet(io.BytesIO(text.encode("utf-8")), "estoque.csv")
+
+
+def _products(conn):
+    return {row["name"]: dict(row) for row in conn.execute(
+        "SELECT id, name, category, quantity, unit_price, min_stock FROM inventory")}
+
+
+def test_headers_are_matched_by_alias():
+    df = _sheet("Nome;Qtd;Preço Unitário;Estoque mínimo;Observação\nShampoo;5;10;2;x\n")
+    assert list(df.columns) == ["name", "quantity", "unit_price", "min_stock"]
+
+
+def test_sheet_without_a_name_column_is_refused():
+    with pytest.raises(inventory_import.ImportFileError):
+        _sheet("quantidade;preco\n1;2\n")
+
+
+def test_brazilian_and_plain_numbers():
+    numbers = inventory_import._to_number(pd.Series(["1.234,56", "1234.56", "R$ 7,5", "abc", ""]))
+    assert numbers[:3].tolist() == [1234.56, 1234.56, 7.5]
+    assert numbers[3:].isna().all()
+
+
+def test_errors_point_at_the_sheet_row():
+    valid, errors = inventory_import.validate(pd.DataFrame({
+        "name": ["Shampoo", "", "Creme", "Gel"],
+        "quantity": ["5", "1", "-2", "1,5"],
+        "min_stock": ["1", None, None, "2,5"],
+    }))
+    assert valid["row"].tolist() == [2]
+    assert [(e["row"], e["column"], e["error"]) for e in errors] == [
+        (3, "name", "nome vazio"),
+        (4, "quantity", "não pode ser negativo"),
+        (5, "min_stock", "deve ser um número inteiro"),
+    ]
+
+
+def test_rejected_repeat_does_not_drop_the_valid_row():
+    valid, errors = inventory_import.validate(pd.DataFrame({"name": ["Shampoo", "Shampoo"],
+                                                            "quantity": ["5", "abc"]}))
+    assert valid["row"].tolist() == [2]
+    assert [(e["row"], e["column"], e["error"]) for e in errors] == [(3, "quantity", "não é um número")]
+
+
+def test_last_valid_repeat_wins():
+    valid, errors = inventory_import.validate(pd.DataFrame({"name": ["Shampoo", "shampoo", "SHAMPOO"],
+                                                            "quantity": ["1", "2", "x"]}))
+    assert valid["row"].tolist() == [3]
+    assert errors[0] == {"row": 2, "column": "name", "value": "Shampoo",
+                         "error": "produto repetido na planilha (vale a linha 3)"}
+
+
+def test_upsert_creates_updates_and_adjusts(user_conn):
+    user_conn.execute("INSERT INTO inventory (name, category, quantity, unit_price) VALUES ('Velho', 'uso', 0, 1)")
+    user_conn.execute("INSERT INTO stock_movements (product_id, kind, quantity) VALUES (1, 'opening', 4)")
+    # id 2 apagado: os novos não começam logo depois do maior id existente
+    user_conn.execute("INSERT INTO inventory (name, category) VALUES ('Apagado', 'uso')")
+    user_conn.execute("DELETE FROM inventory WHERE id = 2")
+
+    valid, errors = inventory_import.validate(_sheet(
+        "nome;quantidade;preco;categoria\n"
+        "velho;10;;\n"
+        "Novo A;3;2,50;venda\n"
+        "Novo B;7;;\n"
+    ))
+    assert errors == []
+    user_conn.execute("BEGIN")
+    assert inventory_import.upsert(user_conn, valid) == (2, 1)
+    user_conn.execute("COMMIT")
+
+    products = _products(user_conn)
+    assert products["Velho"]["quantity"] == 10 and products["Velho"]["unit_price"] == 1
+    assert products["Novo A"]["quantity"] == 3 and products["Novo A"]["unit_price"] == 2.5
+    assert products["Novo A"]["category"] == "venda"
+    assert products["Novo B"]["quantity"] == 7 and products["Novo B"]["category"] == "uso"
+    kinds = {(row["product_id"], row["kind"], row["quantity"]) for row in user_conn.execute(
+        "SELECT product_id, kind, quantity FROM stock_movements")}
+    assert (1, "adjustment", 6) in kinds
+    assert (products["Novo A"]["id"], "opening", 3) in kinds
+    assert (products["Novo B"]["id"], "opening", 7) in kinds
+    assert check_stock_ledger(user_conn) == []
+
+
+def test_upload_reports_rejected_rows(client):
+    register(client, "import@example.com")
+    data = {"file": (io.BytesIO("nome;quantidade\nShampoo;5\nCreme;abc\n".encode()), "estoque.csv")}
+    report = client.post("/inventory/upload_excel?format=json", data=data,
+                         content_type="multipart/form-data").get_json()
+    assert (report["created"], report["updated"], report["rejected"]) == (1, 0, 1)
+    assert report["errors"] == [{"row": 3, "column": "quantity", "value": "abc", "error": "não é um número"}]
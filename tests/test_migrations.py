@@ -0,0 +1,110 @@
+# test_migrations.py
+# Bancos criados antes da série de migrações (user_version 0, schema do
+# init_user_db original, às vezes sem as colunas que vieram depois) precisam
+# chegar à versão atual sem perder dados.
+import sqlite3
+
+import pytest
+
+import db
+
+LEGACY_USER_SCHEMA = """
+CREATE TABLE services (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, category TEXT NOT NULL,
+                       price REAL NOT NULL, duration INTEGER NOT NULL, promotion INTEGER DEFAULT 0);
+CREATE TABLE clients (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, phone TEXT);
+CREATE TABLE schedules (id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER, service_id INTEGER,
+                        date_time TEXT NOT NULL, notes TEXT);
+CREATE TABLE professionals (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, phone TEXT,
+                            specialty TEXT, cpf TEXT, cnpj TEXT);
+CREATE TABLE inventory (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, category TEXT NOT NULL,
+                        quantity REAL DEFAULT 0, unit_price REAL DEFAULT 0, usage_per_service REAL DEFAULT 0,
+                        min_stock INTEGER DEFAULT 0);
+CREATE TABLE service_products (id INTEGER PRIMARY KEY AUTOINCREMENT, service_id INTEGER NOT NULL,
+                               product_id INTEGER NOT NULL, quantity_used REAL DEFAULT 0);
+CREATE TABLE schedule_products (id INTEGER PRIMARY KEY AUTOINCREMENT, schedule_id INTEGER NOT NULL,
+                                product_id INTEGER NOT NULL, quantity_used REAL DEFAULT 0);
+CREATE TABLE finance (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, professional_id INTEGER,
+                      service_id INTEGER, amount REAL, type TEXT);
+CREATE TABLE notas_fiscais (id INTEGER PRIMARY KEY AUTOINCREMENT, numero TEXT, profissional_id INTEGER,
+                            dono_id INTEGER, data_emissao TEXT, valor REAL, arquivo_pdf TEXT);
+
+INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'Serviço', 50, 30);
+INSERT INTO clients (name, phone) VALUES ('Ana', '1');
+INSERT INTO professionals (name) VALUES ('Bia');
+INSERT INTO schedules (client_id, service_id, date_time) VALUES (1, 1, '2024-05-02T10:00');
+INSERT INTO inventory (name, category, quantity, min_stock) VALUES ('Shampoo', 'uso', 3, 5);
+INSERT INTO finance (date, professional_id, service_id, amount, type) VALUES ('2024-05-02 10:00', 1, 1, 50, 'entrada');
+"""
+
+
+@pytest.fixture
+def legacy(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "agenda_legacy.db"), isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(LEGACY_USER_SCHEMA)
+    assert db.schema_version(conn) == 0
+    yield conn
+    conn.close()
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+
+
+def test_baseline_user_db_upgrades_to_the_latest_version(legacy):
+    assert db.init_user_db(legacy) == db.USER_SCHEMA_VERSION
+    assert db.schema_version(legacy) == db.USER_SCHEMA_VERSION
+
+    assert {"notes"} <= _columns(legacy, "clients")
+    assert {"professional_id", "day"} <= _columns(legacy, "schedules")
+    assert legacy.execute("SELECT name FROM clients").fetchone()[0] == "Ana"
+    assert legacy.execute("SELECT day FROM schedules").fetchone()[0] == "2024-05-02"
+
+    # dados anteriores ao log entram com versão e versão de inserção
+    log = legacy.execute("SELECT table_name, created_version FROM change_log WHERE table_name != '_restore'").fetchall()
+    assert {row["table_name"] for row in log} >= {"clients", "schedules", "services", "finance", "inventory"}
+    assert all(row["created_version"] is not None for row in log)
+
+    # rollup, livro de estoque e alerta montados a partir dos dados que já existiam
+    assert db.check_finance_rollup(legacy) == []
+    assert db.check_stock_ledger(legacy) == []
+    assert legacy.execute("SELECT quantity FROM inventory").fetchone()[0] == 3
+    assert legacy.execute("SELECT COUNT(*) FROM stock_alerts WHERE resolved_at IS NULL").fetchone()[0] == 1
+    assert legacy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+
+
+def test_migrations_run_once(legacy):
+    db.init_user_db(legacy)
+    tables = legacy.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]
+    log = legacy.execute("SELECT COUNT(*) FROM change_log").fetchone()[0]
+    assert db.init_user_db(legacy) == db.USER_SCHEMA_VERSION
+    assert legacy.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == tables
+    assert legacy.execute("SELECT COUNT(*) FROM change_log").fetchone()[0] == log
+
+
+def test_each_partial_version_upgrades_to_the_latest(tmp_path):
+    for stop in range(1, db.USER_SCHEMA_VERSION):
+        conn = sqlite3.connect(str(tmp_path / f"agenda_v{stop}.db"), isolation_level=None)
+        db.migrate(conn, db.USER_MIGRATIONS[:stop])
+        conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1')")
+        assert db.init_user_db(conn) == db.USER_SCHEMA_VERSION, stop
+        assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == 1
+        conn.close()
+
+
+@pytest.mark.parametrize("legacy_columns, password_hash", [
+    ("name TEXT, email TEXT UNIQUE NOT NULL, password TEXT", "hash-antigo"),     # senha na coluna antiga
+    ("name TEXT, email TEXT UNIQUE NOT NULL", None),
+])
+def test_auth_legacy_users_table(tmp_path, legacy_columns, password_hash):
+    conn = sqlite3.connect(str(tmp_path / "auth.db"), isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, {legacy_columns})")
+    values = ("Ana", "ana@example.com") + (("hash-antigo",) if password_hash else ())
+    conn.execute(f"INSERT INTO users VALUES (NULL, {', '.join('?' * len(values))})", values)
+
+    assert db.migrate(conn, db.AUTH_MIGRATIONS) == len(db.AUTH_MIGRATIONS)
+    user = conn.execute("SELECT * FROM users").fetchone()
+    assert {"password_hash", "birth_date"} <= set(user.keys())
+    assert user["password_hash"] == password_hash and user["email"] == "ana@example.com"
+    conn.close()
@@ -0,0 +1,47 @@
+# test_paging.py
+import pytest
+
+from paging import encode_cursor, keyset_page
+from reports_bp import FINANCE_REPORT
+
+
+@pytest.fixture
+def finance(user_conn):
+    # 3 lançamentos sem data no meio dos ids: com página de 2, um limite de página cai entre eles
+    dates = ["2024-01-01", None, "2024-01-02", None, "2024-01-02", None, "2024-01-03"]
+    user_conn.executemany("INSERT INTO finance (date, amount, type) VALUES (?, 10, 'entrada')",
+                          [(d,) for d in dates])
+    return user_conn
+
+
+def _all_pages(conn, limit):
+    seen, after = [], None
+    while True:
+        page = keyset_page(conn, FINANCE_REPORT.sql, (), FINANCE_REPORT.keys,
+                           after=after, limit=limit, descending=True)
+        seen.extend(row["id"] for row in page)
+        if not page.next_cursor:
+            return seen
+        assert "None" not in page.next_cursor
+        after = page.next_cursor
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 50])
+def test_finance_report_pages_include_null_dates(finance, limit):
+    # decrescente por (data, id); sem data ('') vem por último
+    assert _all_pages(finance, limit) == [7, 5, 3, 1, 6, 4, 2]
+
+
+def test_finance_report_pages_back_across_null_dates(finance):
+    first = keyset_page(finance, FINANCE_REPORT.sql, (), FINANCE_REPORT.keys, limit=3, descending=True)
+    second = keyset_page(finance, FINANCE_REPORT.sql, (), FINANCE_REPORT.keys,
+                         after=first.next_cursor, limit=3, descending=True)
+    assert [r["id"] for r in second] == [1, 6, 4]
+    back = keyset_page(finance, FINANCE_REPORT.sql, (), FINANCE_REPORT.keys,
+                       before=second.prev_cursor, limit=3, descending=True)
+    assert [r["id"] for r in back] == [7, 5, 3]
+
+
+def test_null_key_is_rejected_instead_of_encoded():
+    with pytest.raises(ValueError):
+        encode_cursor({"date": None, "id": 1}, [("f.date", "date"), ("f.id", "id")])
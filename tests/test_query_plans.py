@@ -0,0 +1,24 @@
+# test_query_plans.py
+# check_query_plans.py na suíte: SQL quente que volte a fazer SCAN quebra o teste.
+import os
+
+import check_query_plans
+from db import BASE_DIR
+
+
+def test_no_query_plan_regressions():
+    checked, problems = check_query_plans.check()
+    assert checked > 0
+    assert not problems, "\n".join(problems)
+
+
+def test_dynamic_sql_is_rendered_with_representative_values():
+    statements, unbound = check_query_plans.collect_statements(
+        os.path.join(BASE_DIR, "admin_bp.py"), [{"placeholders": "?,?,?"}])
+    assert not unbound
+    assert any("WHERE id IN (?,?,?)" in sql for _, sql in statements)
+
+
+def test_dynamic_sql_without_values_is_reported():
+    _, unbound = check_query_plans.collect_statements(os.path.join(BASE_DIR, "sync_bp.py"))
+    assert unbound
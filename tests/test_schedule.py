@@ -0,0 +1,63 @@
+# test_schedule.py
+import pytest
+
+from conftest import register
+
+
+@pytest.mark.parametrize("professional_id", ["", "abc", "999"])
+def test_invalid_professional_is_flashed_not_500(client, professional_id):
+    register(client, "agenda@example.com")
+    # serviço válido: o que deve barrar o agendamento é só o profissional
+    client.post("/services/", data={"add": "1", "name": "Corte", "price": "50", "duration": "30"})
+    response = client.post("/schedule/", data={
+        "client_id": "1", "professional_id": professional_id, "service_id": "1",
+        "date": "2030-03-04", "time": "10:00",
+    })
+    assert response.status_code == 302
+
+
+@pytest.fixture
+def booked(client, tenant_db, request):
+    register(client, f"{request.node.name}@example.com")
+    conn = tenant_db()
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1')")
+    conn.execute("INSERT INTO professionals (name) VALUES ('Bia')")
+    conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'x', 50, 60)")
+    # já ocupado: a 2ª ocorrência da série semanal (11/03 10:30)
+    conn.execute("INSERT INTO schedules (client_id, professional_id, service_id, date_time) "
+                 "VALUES (1, 1, 1, '2030-03-11 10:30:00')")
+    return conn
+
+
+def _series(client, count, **extra):
+    return client.post("/schedule/", data={
+        "client_id": "1", "professional_id": "1", "service_id": "1",
+        "date": "2030-03-04", "time": "10:00", "repeat": "weekly", "repeat_count": str(count), **extra,
+    })
+
+
+def _flashes(client):
+    with client.session_transaction() as sess:
+        return sess.pop("_flashes", [])
+
+
+def test_conflicting_series_is_rejected_as_a_whole(client, booked):
+    _flashes(client)
+    assert _series(client, 3).status_code == 302
+    assert booked.execute("SELECT COUNT(*) FROM schedules").fetchone()[0] == 1
+    assert booked.execute("SELECT COUNT(*) FROM finance").fetchone()[0] == 0
+    assert _flashes(client) == [("error", "Nenhum agendamento foi criado. Horários em conflito: 2030-03-11 10:00")]
+
+
+def test_series_consumption_goes_to_each_occurrence(client, booked):
+    booked.execute("DELETE FROM schedules")
+    booked.execute("INSERT INTO inventory (name, category) VALUES ('Shampoo', 'uso')")
+    booked.execute("INSERT INTO stock_movements (product_id, kind, quantity) VALUES (1, 'opening', 10)")
+    booked.execute("INSERT INTO service_products (service_id, product_id, quantity_used) VALUES (1, 1, 1)")
+    _series(client, 3, product_1="2")
+    schedules = {row["id"]: row["date_time"] for row in booked.execute("SELECT id, date_time FROM schedules")}
+    assert sorted(schedules.values()) == ["2030-03-04 10:00:00", "2030-03-11 10:00:00", "2030-03-18 10:00:00"]
+    consumed = [row["schedule_id"] for row in booked.execute(
+        "SELECT schedule_id FROM stock_movements WHERE kind = 'consumption' ORDER BY schedule_id")]
+    assert consumed == sorted(schedules)
+    assert booked.execute("SELECT quantity FROM inventory").fetchone()[0] == 4
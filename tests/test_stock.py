@@ -0,0 +1,113 @@
+# test_stock.py
+import pytest
+
+import stock
+from conftest import register
+from db import check_stock_ledger
+
+
+def _quantity(conn, product_id=1):
+    return conn.execute("SELECT quantity FROM inventory WHERE id = ?", (product_id,)).fetchone()[0]
+
+
+def test_removed_product_leaves_a_clean_ledger(user_conn):
+    user_conn.execute("INSERT INTO inventory (name, category, min_stock) VALUES ('Shampoo', 'uso', 5)")
+    user_conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'x', 50, 30)")
+    user_conn.execute("INSERT INTO service_products (service_id, product_id, quantity_used) VALUES (1, 1, 1)")
+    stock.record(user_conn, [(1, "opening", 3, None, None)])           # abaixo do mínimo: alerta aberto
+    assert stock.alert_count(user_conn) == 1
+
+    assert stock.remove_product(user_conn, 1)
+    assert user_conn.execute("SELECT SUM(quantity) FROM stock_movements WHERE product_id = 1").fetchone()[0] == 0
+    assert user_conn.execute("SELECT COUNT(*) FROM stock_alerts").fetchone()[0] == 0
+    assert user_conn.execute("SELECT COUNT(*) FROM service_products").fetchone()[0] == 0
+    assert check_stock_ledger(user_conn) == []
+    assert not stock.remove_product(user_conn, 1)
+
+
+def test_orphan_movements_with_a_balance_are_reported(user_conn):
+    user_conn.execute("INSERT INTO inventory (name, category) VALUES ('Shampoo', 'uso')")
+    stock.record(user_conn, [(1, "opening", 3, None, None)])
+    user_conn.execute("DELETE FROM inventory WHERE id = 1")           # sem passar pelo livro
+    assert check_stock_ledger(user_conn) == [(1, None, (3, 0), (0, 0))]
+
+
+@pytest.fixture
+def booking(client, tenant_db, request):
+    """Agendamento 1 consumindo 2 do produto 1 (saldo 10 -> 8), criado pela rota."""
+    register(client, f"{request.node.name}@example.com")
+    conn = tenant_db()
+    conn.execute("INSERT INTO clients (name, phone) VALUES ('Ana', '1')")
+    conn.execute("INSERT INTO professionals (name) VALUES ('Bia')")
+    conn.execute("INSERT INTO services (name, category, price, duration) VALUES ('Corte', 'x', 50, 30)")
+    conn.execute("INSERT INTO inventory (name, category) VALUES ('Shampoo', 'uso')")
+    conn.execute("INSERT INTO inventory (name, category) VALUES ('Creme', 'uso')")
+    stock.record(conn, [(1, "opening", 10, None, None), (2, "opening", 10, None, None)])
+    conn.executemany("INSERT INTO service_products (service_id, product_id, quantity_used) VALUES (1, ?, 1)",
+                     [(1,), (2,)])
+    client.post("/schedule/", data={"client_id": "1", "professional_id": "1", "service_id": "1",
+                                    "date": "2030-03-04", "time": "10:00", "product_1": "2"})
+    assert _quantity(conn) == 8
+    return conn
+
+
+def _edit(client, **products):
+    return client.post("/schedule/edit/1", data={"client_id": "1", "professional_id": "1", "service_id": "1",
+                                                 "date": "2030-03-04", "time": "10:00", **products})
+
+
+def test_editing_a_booking_reverses_its_consumption(client, booking):
+    _edit(client, product_2="3")
+    assert (_quantity(booking, 1), _quantity(booking, 2)) == (10, 7)
+    assert check_stock_ledger(booking) == []
+
+
+def test_deleting_a_booking_reverses_its_consumption(client, booking):
+    client.post("/schedule/delete/1")
+    assert _quantity(booking) == 10
+    assert booking.execute("SELECT total_used FROM inventory WHERE id = 1").fetchone()[0] == 0
+    assert check_stock_ledger(booking) == []
+
+
+def test_deleting_a_booking_after_its_product_is_gone(client, booking):
+    client.post("/inventory/delete/1")
+    client.post("/schedule/delete/1")
+    assert booking.execute("SELECT COUNT(*) FROM stock_movements WHERE kind = 'reversal'").fetchone()[0] == 0
+    assert check_stock_ledger(booking) == []
+
+
+def test_alert_opens_at_min_stock_and_resolves_above_it(user_conn):
+    user_conn.execute("INSERT INTO inventory (name, category, min_stock) VALUES ('Shampoo', 'uso', 5)")
+    stock.record(user_conn, [(1, "opening", 10, None, None)])
+    assert stock.alert_count(user_conn) == 0
+
+    stock.record(user_conn, [(1, "consumption", -5, None, None)])       # 5 <= mínimo
+    alerts = stock.open_alerts(user_conn)
+    assert [(a["product_id"], a["opened_quantity"], a["min_stock"]) for a in alerts] == [(1, 5, 5)]
+
+    stock.record(user_conn, [(1, "consumption", -2, None, None)])       # continua baixo: um alerta só
+    assert stock.alert_count(user_conn) == 1
+
+    stock.record(user_conn, [(1, "restock", 10, None, None)])
+    assert stock.alert_count(user_conn) == 0
+    resolved = stock.resolved_alerts(user_conn)
+    assert [(a["product_id"], a["resolved_quantity"]) for a in resolved] == [(1, 13)]
+
+
+def test_raising_min_stock_opens_an_alert(user_conn):
+    user_conn.execute("INSERT INTO inventory (name, category) VALUES ('Shampoo', 'uso')")
+    stock.record(user_conn, [(1, "opening", 4, None, None)])
+    assert stock.alert_count(user_conn) == 0                            # sem mínimo, sem alerta
+    user_conn.execute("UPDATE inventory SET min_stock = 4 WHERE id = 1")
+    assert stock.alert_count(user_conn) == 1
+    user_conn.execute("UPDATE inventory SET min_stock = 0 WHERE id = 1")
+    assert stock.alert_count(user_conn) == 0
+
+
+def test_alerts_follow_only_the_product_that_changed(user_conn):
+    user_conn.executemany("INSERT INTO inventory (name, category, min_stock) VALUES (?, 'uso', 2)",
+                          [("Shampoo",), ("Creme",)])
+    stock.record(user_conn, [(1, "opening", 1, None, None), (2, "opening", 9, None, None)])
+    assert [a["product_id"] for a in stock.open_alerts(user_conn)] == [1]
+    stock.record(user_conn, [(2, "consumption", -8, None, None)])
+    assert [a["product_id"] for a in stock.open_alerts(user_conn)] == [1, 2]
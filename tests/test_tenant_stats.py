@@ -0,0 +1,52 @@
+# test_tenant_stats.py
+import os
+import sqlite3
+
+import pytest
+
+import tenant_stats
+from db import init_user_db
+
+TODAY = "2030-03-04"
+
+
+@pytest.fixture
+def tenants(tmp_path, monkeypatch):
+    monkeypatch.setattr(tenant_stats, "USER_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(tenant_stats, "_cache", {})
+    paths = []
+    for user_id in range(1, tenant_stats.POOL_MIN_TENANTS + 1):
+        path = str(tmp_path / f"agenda_{user_id}.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        init_user_db(conn)
+        conn.close()
+        paths.append(path)
+    yield paths
+    tenant_stats.shutdown_pool()
+
+
+def test_pool_is_reused_across_calls(tenants):
+    assert tenant_stats.platform_stats(TODAY)["scan"]["workers"]
+    pool = tenant_stats._pool
+    tenant_stats._cache.clear()
+    assert tenant_stats.platform_stats(TODAY)["scan"]["workers"]
+    assert tenant_stats._pool is pool
+
+
+def test_pool_inherited_from_fork_is_replaced(tenants, monkeypatch):
+    tenant_stats.platform_stats(TODAY)
+    inherited = tenant_stats._pool
+    monkeypatch.setattr(tenant_stats, "_pool_pid", os.getpid() + 1)   # como se fosse o processo pai
+    tenant_stats._cache.clear()
+    tenant_stats.platform_stats(TODAY)
+    assert tenant_stats._pool is not inherited
+    inherited.shutdown()
+
+
+def test_bytes_follow_the_file_without_a_data_change(tenants):
+    before = tenant_stats.platform_stats(TODAY)
+    with open(tenants[0] + "-wal", "wb") as wal:        # WAL cresce, change_log igual
+        wal.write(b"\0" * 4096)
+    after = tenant_stats.platform_stats(TODAY)
+    assert after["scan"]["rescanned"] == 0
+    assert after["total_bytes"] == before["total_bytes"] + 4096